@@ -140,7 +140,7 @@ setup(
     ],
     entry_points={
         'console_scripts': [
-            'screen_audio_recorder = main:main'
+            'screen_audio_recorder = cli:main'
         ]
     },
     include_package_data=True,
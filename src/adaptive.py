@@ -0,0 +1,213 @@
+"""
+Closed-loop quality control for a running ScreenRecorder.
+
+AdaptiveController samples the recorder's metrics every `interval` seconds.
+Frames dropped or duplicated, an encoder or capture thread busy for most of
+the interval, or a nearly full ring count as overload and lower the quality
+by one level at once. Quality only goes back up after `patience` calm
+intervals in a row, and only if the load measured at the current level,
+scaled by what the level above costs, still leaves headroom. That way the
+controller does not flip between two levels.
+
+The levels form one ladder from the configured quality down to the user's
+bounds. Faster encoder presets come first because they are the cheapest thing
+to give up, then lower capture rates, then smaller capture scales. Each level
+is applied through the recorder: SegmentedEncoder.reconfigure() for the
+preset, ScreenRecorder.set_capture_step() for the rate and
+ScreenRecorder.set_scale() for the scale. The output keeps its frame rate and
+size throughout.
+"""
+import threading
+import time
+
+# x264/x265 presets, slowest first, with their rough encode cost relative to ultrafast
+PRESET_COST = {
+    'veryslow': 18.0,
+    'slower': 9.0,
+    'slow': 5.5,
+    'medium': 3.6,
+    'fast': 3.0,
+    'faster': 2.4,
+    'veryfast': 1.8,
+    'superfast': 1.4,
+    'ultrafast': 1.0,
+}
+PRESETS = tuple(PRESET_COST)
+
+SCALE_STEP = 0.25
+
+
+class QualityLevel:
+    """One rung of the ladder: encoder preset, capture step (every n-th frame) and capture scale."""
+
+    def __init__(self, preset, step, scale):
+        self.preset = preset
+        self.step = step
+        self.scale = scale
+
+    @property
+    def cost(self):
+        """Work per output second relative to ultrafast, every frame, full scale."""
+        return PRESET_COST.get(self.preset, 1.0) * self.scale ** 2 / self.step
+
+    def describe(self, fps):
+        parts = [f"{fps / self.step:g} fps"]
+        if self.preset:
+            parts.append(f"preset {self.preset}")
+        parts.append(f"scale {self.scale:g}")
+        return ', '.join(parts)
+
+
+def build_ladder(fps, preset=None, fastest_preset='ultrafast', min_fps=None, min_scale=1.0, scalable=True):
+    """Quality levels from the configured one (first) down to the bounds (last)."""
+    ladder = [QualityLevel(preset, 1, 1.0)]
+    if preset in PRESET_COST and fastest_preset in PRESET_COST:
+        for faster in PRESETS[PRESETS.index(preset) + 1:PRESETS.index(fastest_preset) + 1]:
+            ladder.append(QualityLevel(faster, 1, 1.0))
+    preset = ladder[-1].preset
+    step = 2
+    while min_fps is not None and fps / step >= min_fps:
+        ladder.append(QualityLevel(preset, step, 1.0))
+        step += 1
+    step = ladder[-1].step
+    scale = 1.0 - SCALE_STEP
+    while scalable and scale >= min_scale - 1e-9:
+        ladder.append(QualityLevel(preset, step, scale))
+        scale -= SCALE_STEP
+    return ladder
+
+
+class AdaptiveController(threading.Thread):
+    """
+    Steps `recorder`'s quality down under load and back up when there is
+    headroom, within `min_fps`, `min_scale` and `fastest_preset`. `preset` is
+    the preset the recorder's encoder was started with; presets are only
+    changed when the encoder has a reconfigure() that takes one. Every change
+    is passed to `log` and kept in `adjustments`.
+    """
+
+    def __init__(self, recorder, min_fps=None, min_scale=1.0, preset=None, fastest_preset='ultrafast',
+                 interval=1.0, patience=5, busy_limit=0.9, headroom=0.7, max_lost=0.02, log=print):
+        threading.Thread.__init__(self, name='adaptive-quality', daemon=True)
+        self.recorder = recorder
+        self.interval = interval
+        self.patience = patience
+        self.busy_limit = busy_limit
+        self.headroom = headroom
+        self.max_lost = max_lost
+        self.log = log
+        encoder = recorder.out
+        supports = getattr(encoder, 'supports', None)
+        if not (hasattr(encoder, 'reconfigure') and supports is not None and supports('preset')):
+            preset = None
+        scalable = recorder.pipeline.scalable and supports is not None and supports('output_size')
+        self.ladder = build_ladder(recorder.fps, preset, fastest_preset, min_fps, min_scale, scalable)
+        self.level = 0
+        self.adjustments = []
+        self._calm = 0
+        self._previous = None
+        self._began = None
+        self._stop_event = threading.Event()
+        metrics = recorder.metrics
+        self._adjustments_total = metrics.counter('quality_adjustments_total',
+                                                  'Quality changes made by the adaptive controller')
+        metrics.gauge('quality_level', 'Adaptive quality level, 0 is the configured quality',
+                      function=lambda: self.level)
+        metrics.gauge('capture_fps', 'Frames per second being captured',
+                      function=lambda: recorder.fps / self.ladder[self.level].step)
+
+    @property
+    def current(self):
+        return self.ladder[self.level]
+
+    def _sample(self):
+        snapshot = self.recorder.metrics.snapshot()
+
+        def busy(name):
+            value = snapshot.get(name)
+            return value['sum'] if value else 0.0
+
+        return {
+            'time': time.monotonic(),
+            'capture': busy('grab_seconds') + busy('convert_seconds'),
+            'encode': busy('encode_seconds'),
+            'lost': (snapshot.get('frames_dropped_total') or 0) + (snapshot.get('frames_duplicated_total') or 0),
+            'depth': snapshot.get('queue_depth') or 0,
+        }
+
+    def update(self):
+        """Take one sample and adjust the quality if needed; returns the reason of a change or None."""
+        sample = self._sample()
+        previous, self._previous = self._previous, sample
+        if previous is None:
+            return None
+        elapsed = sample['time'] - previous['time']
+        if elapsed <= 0:
+            return None
+        busy = max(sample['capture'] - previous['capture'], sample['encode'] - previous['encode']) / elapsed
+        lost = sample['lost'] - previous['lost']
+        ticks = elapsed * self.recorder.fps
+        capacity = len(self.recorder.pipeline.ring.slots)
+
+        reason = None
+        if lost > max(1, self.max_lost * ticks):
+            reason = f"{lost} frames dropped or duplicated"
+        elif busy > self.busy_limit:
+            reason = f"{busy:.0%} busy"
+        elif sample['depth'] >= capacity - 1:
+            reason = f"{sample['depth']} frames queued"
+        if reason is not None:
+            self._calm = 0
+            if self.level + 1 < len(self.ladder):
+                return self._apply(self.level + 1, reason)
+            return None
+
+        if self.level == 0 or lost or sample['depth'] > 1:
+            self._calm = 0
+            return None
+        predicted = busy * self.ladder[self.level - 1].cost / self.current.cost
+        if predicted >= self.headroom:
+            self._calm = 0
+            return None
+        self._calm += 1
+        if self._calm < self.patience:
+            return None
+        self._calm = 0
+        return self._apply(self.level - 1, f"{busy:.0%} busy, about {predicted:.0%} expected")
+
+    def _apply(self, level, reason):
+        old, new = self.current, self.ladder[level]
+        if new.preset != old.preset:
+            self.recorder.out.reconfigure(preset=new.preset)
+        if new.step != old.step:
+            self.recorder.set_capture_step(new.step)
+        if new.scale != old.scale:
+            self.recorder.set_scale(new.scale)
+        direction = 'down' if level > self.level else 'up'
+        self.level = level
+        self._adjustments_total.inc()
+        # The change itself (e.g. a new encoder part starting) should not count towards the next decision
+        self._previous = None
+        elapsed = time.monotonic() - self._began if self._began is not None else 0.0
+        self.adjustments.append({'time': elapsed, 'level': level, 'direction': direction, 'preset': new.preset,
+                                 'fps': self.recorder.fps / new.step, 'scale': new.scale, 'reason': reason})
+        self.log(f"Quality {direction} at {elapsed:.1f} s: {new.describe(self.recorder.fps)} ({reason})")
+        return reason
+
+    def run(self):
+        self._began = time.monotonic()
+        while not self._stop_event.wait(self.interval):
+            if not self.recorder.is_alive():
+                break
+            try:
+                self.update()
+            except Exception as e:
+                print(f"Error in adaptive quality control: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def format_summary(self):
+        ups = sum(a['direction'] == 'up' for a in self.adjustments)
+        return (f"{len(self.adjustments)} quality adjustments ({len(self.adjustments) - ups} down, {ups} up), "
+                f"ended at {self.current.describe(self.recorder.fps)}")
@@ -0,0 +1,15 @@
+"""
+Where the recorder keeps its caches (audio device list, encoder probe
+results). Standard library only, so the command line entry point can import
+it at startup.
+"""
+import os
+import sys
+
+
+def cache_dir():
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'screen_audio_recorder')
@@ -0,0 +1,169 @@
+"""
+Callback-mode audio capture from one or more input devices, mixed into one
+stream (e.g. microphone plus the system audio monitor).
+
+Each AudioInput runs a PyAudio stream in callback mode. The callback, which
+runs on PortAudio's thread, only stamps the buffer with the monotonic time
+and puts it on a queue.SimpleQueue; put() never blocks, so the callback cannot
+stall the device. A buffer flagged paInputOverflow carries the number of
+samples lost before it (PortAudio does not say, so one buffer is assumed). AudioMixer is driven by the first input. For every one of
+its buffers it takes the same span from each other input, after converting
+channels and resampling to the output rate, applies the per-input gain and
+sums everything in NumPy.
+"""
+import queue
+import time
+
+import numpy as np
+
+# Secondary inputs are mixed in this far behind, so callback jitter between
+# devices does not starve the mix
+CUSHION_SECONDS = 0.05
+# A secondary input that gets further ahead of the primary than this is trimmed
+MAX_BACKLOG_SECONDS = 0.5
+
+
+class AudioInput:
+    def __init__(self, audio, backend, device_index, format, rate, channels, chunk, gain=1.0):
+        self.backend = backend
+        self.device_index = device_index
+        self.format = format
+        self.rate = rate
+        self.channels = channels
+        self.gain = gain
+        self.queue = queue.SimpleQueue()
+        self.overflows = 0
+        self.underflows = 0
+        self.stream = audio.open(format=format, channels=channels, rate=rate, input=True,
+                                 frames_per_buffer=chunk, input_device_index=device_index,
+                                 stream_callback=self._callback)
+        self.latency = self.stream.get_input_latency()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        lost = 0
+        if status & self.backend.paInputOverflow:
+            self.overflows += 1
+            lost = frame_count
+        if status & self.backend.paInputUnderflow:
+            self.underflows += 1
+        self.queue.put((in_data, time.monotonic(), lost))
+        return None, self.backend.paContinue
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+
+
+class Resampler:
+    """Streaming linear-interpolation resampler for (frames, channels) float32 blocks."""
+
+    def __init__(self, in_rate, out_rate):
+        self.step = in_rate / out_rate
+        self._position = 0.0  # Of the next output sample, relative to the first sample of the next block
+        self._last = None
+
+    def process(self, block):
+        if self.step == 1.0 or not len(block):
+            return block
+        # The previous block's last sample lets positions fall between blocks
+        x = block if self._last is None else np.concatenate((self._last, block))
+        end = len(x) - 1
+        count = int((end - self._position) // self.step) + 1 if end >= self._position else 0
+        positions = self._position + np.arange(count) * self.step
+        index = positions.astype(np.intp)
+        frac = (positions - index)[:, None].astype(np.float32)
+        following = np.minimum(index + 1, end)
+        out = x[index] * (1.0 - frac) + x[following] * frac
+        self._position = (positions[-1] + self.step if count else self._position) - end
+        self._last = x[-1:]
+        return out
+
+
+def convert_channels(block, channels):
+    if block.shape[1] == channels:
+        return block
+    if block.shape[1] == 1:
+        return np.repeat(block, channels, axis=1)
+    if channels == 1:
+        return block.mean(axis=1, keepdims=True)
+    if block.shape[1] > channels:
+        return block[:, :channels]
+    return np.concatenate((block, np.repeat(block.mean(axis=1, keepdims=True), channels - block.shape[1], axis=1)),
+                          axis=1)
+
+
+class AudioMixer:
+    """
+    Mixes `inputs` into int16 PCM at `rate` Hz with `channels` channels. A
+    single input already at the output format passes through untouched.
+    """
+
+    def __init__(self, inputs, rate, channels):
+        self.inputs = inputs
+        self.rate = rate
+        self.channels = channels
+        self.resamplers = [Resampler(i.rate, rate) for i in inputs]
+        self._pending = [np.zeros((0, channels), dtype=np.float32) for _ in inputs]
+        self._primed = [False] * len(inputs)
+        self._cushion = int(CUSHION_SECONDS * rate)
+        self._max_backlog = int(MAX_BACKLOG_SECONDS * rate)
+        self.underruns = 0
+        self.overruns = 0
+        primary = inputs[0]
+        self.passthrough = (len(inputs) == 1 and primary.rate == rate and primary.channels == channels
+                            and primary.gain == 1.0)
+
+    def _convert(self, n, data):
+        source = self.inputs[n]
+        block = np.frombuffer(data, dtype=np.int16).reshape(-1, source.channels).astype(np.float32)
+        block = convert_channels(block, self.channels)
+        block = self.resamplers[n].process(block)
+        if source.gain != 1.0:
+            block *= source.gain
+        return block
+
+    def read(self, timeout=0.5):
+        """
+        Wait for the primary input's next buffer and return (pcm bytes, capture
+        time on the monotonic clock, samples the primary input lost to an
+        overflow just before it, at the output rate), or None if nothing
+        arrived in `timeout`.
+        """
+        try:
+            data, captured_at, lost = self.inputs[0].queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if lost:
+            lost = int(round(lost * self.rate / self.inputs[0].rate))
+        if self.passthrough:
+            return data, captured_at, lost
+
+        mix = self._convert(0, data)
+        frames = len(mix)
+        for n in range(1, len(self.inputs)):
+            pending = [self._pending[n]]
+            while True:
+                try:
+                    pending.append(self._convert(n, self.inputs[n].queue.get_nowait()[0]))
+                except queue.Empty:
+                    break
+            available = np.concatenate(pending) if len(pending) > 1 else pending[0]
+            if not self._primed[n]:
+                # Wait until the cushion has built up before mixing this input in
+                self._pending[n] = available
+                self._primed[n] = len(available) >= self._cushion + frames
+                continue
+            if len(available) > self._max_backlog + frames:
+                # This device's clock runs ahead (or the primary stalled): drop the oldest samples
+                self.overruns += 1
+                available = available[len(available) - self._max_backlog - frames:]
+            if len(available) < frames:
+                self.underruns += 1
+                mix[:len(available)] += available
+                self._pending[n] = available[:0]
+                self._primed[n] = False
+            else:
+                mix += available[:frames]
+                self._pending[n] = available[frames:]
+        np.clip(mix, -32768, 32767, out=mix)
+        return mix.astype(np.int16).tobytes(), captured_at, lost
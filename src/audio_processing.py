@@ -0,0 +1,308 @@
+"""
+Streaming audio post-processing: normalization, noise gate, silence trimming
+and channel downmix in one pass over int16 PCM chunks.
+
+The same AudioProcessor works on live chunks (as an AudioRecorder stage) and
+on finished files (process_audio_file, which decodes and re-encodes through
+ffmpeg pipes). Memory stays constant in both cases: stages only keep a few
+scalars and at most one block of state.
+"""
+import subprocess
+import wave
+
+import numpy as np
+
+from audio_mixer import convert_channels
+from audio_writers import open_audio_writer
+
+NORMALIZE_MODES = ('peak', 'rms')
+
+
+def db_to_gain(db):
+    return 10.0 ** (db / 20.0)
+
+
+class NoiseGate:
+    """
+    Mutes audio whose RMS over `window` seconds stays below `threshold_db`
+    (dBFS). The gain opens within `attack` seconds and closes over `release`
+    seconds, ramped per sample so the gate does not click.
+    """
+
+    def __init__(self, rate, threshold_db=-50.0, floor_db=-80.0, attack=0.005, release=0.15, window=0.01):
+        self.threshold = db_to_gain(threshold_db)
+        self.floor = db_to_gain(floor_db)
+        self.window = max(1, int(window * rate))
+        self.open_step = self.window / max(1, attack * rate)
+        self.close_step = self.window / max(1, release * rate)
+        self.gain = 1.0
+
+    def process(self, block):
+        if not len(block):
+            return block
+        gains = np.empty(len(block), dtype=np.float32)
+        for start in range(0, len(block), self.window):
+            segment = block[start:start + self.window]
+            rms = np.sqrt(np.mean(np.square(segment)))
+            target = 1.0 if rms >= self.threshold else self.floor
+            if target > self.gain:
+                new_gain = min(target, self.gain + self.open_step)
+            else:
+                new_gain = max(target, self.gain - self.close_step)
+            gains[start:start + len(segment)] = np.linspace(self.gain, new_gain, len(segment), endpoint=False)
+            self.gain = new_gain
+        block *= gains[:, None]
+        return block
+
+
+class Normalizer:
+    """
+    Brings the level to `target_db` (dBFS, peak or RMS depending on `mode`).
+
+    With a fixed `gain` (measured over a finished file, see measure_level) every
+    sample is scaled the same. Without one it works live: the gain follows a
+    running level estimate with a time constant of `smoothing` seconds, never
+    exceeds `max_gain_db`, is lowered at once when a block would clip, and is
+    ramped across each block.
+    """
+
+    def __init__(self, rate, mode='peak', target_db=-1.0, gain=None, max_gain_db=20.0, smoothing=3.0):
+        if mode not in NORMALIZE_MODES:
+            raise ValueError(f"Unknown normalization mode: {mode}")
+        self.rate = rate
+        self.mode = mode
+        self.target = db_to_gain(target_db)
+        self.max_gain = db_to_gain(max_gain_db)
+        self.fixed_gain = gain
+        self.smoothing = smoothing
+        self.gain = gain if gain is not None else 1.0
+        self._level = None
+
+    def process(self, block):
+        if not len(block):
+            return block
+        if self.fixed_gain is not None:
+            block *= self.fixed_gain
+            return block
+
+        peak = float(np.max(np.abs(block)))
+        if self.mode == 'peak':
+            level = peak
+        else:
+            level = float(np.sqrt(np.mean(np.square(block))))
+        # Exponential moving average, with the block length as the time step
+        alpha = min(1.0, len(block) / (self.smoothing * self.rate))
+        if self._level is None:
+            self._level = level
+        elif self.mode == 'peak':
+            # Peaks are tracked with instant attack and slow decay
+            self._level = max(level, self._level + alpha * (level - self._level))
+        else:
+            self._level += alpha * (level - self._level)
+        if self._level <= 1e-6:
+            return block  # Silence so far, nothing to scale against
+
+        gain = min(self.max_gain, self.target / self._level)
+        if peak * gain > 1.0:
+            gain = 1.0 / peak
+        ramp = np.linspace(self.gain, gain, len(block), dtype=np.float32)
+        block *= ramp[:, None]
+        self.gain = gain
+        return block
+
+
+class SilenceTrimmer:
+    """
+    Drops leading and trailing audio below `threshold_db`, keeping `keep`
+    seconds next to the sound. Internal pauses are preserved, but a pause is
+    only known not to be trailing once sound resumes, so it is held as a sample
+    count and re-emitted as digital silence; memory does not grow with its length.
+    Changes the length of the audio, so it is not for streams synced to video.
+    """
+
+    changes_length = True
+
+    def __init__(self, rate, threshold_db=-50.0, keep=0.1):
+        self.threshold = db_to_gain(threshold_db)
+        self.keep = int(keep * rate)
+        self._started = False
+        self._lead = None  # Up to `keep` samples before the first sound
+        self._silent = 0   # Trailing silent samples not emitted yet
+
+    def process(self, block):
+        if not len(block):
+            return block
+        loud = np.flatnonzero(np.max(np.abs(block), axis=1) >= self.threshold)
+        channels = block.shape[1]
+        if not len(loud):
+            if self._started:
+                self._silent += len(block)
+            else:
+                lead = block if self._lead is None else np.concatenate((self._lead, block))
+                self._lead = lead[-self.keep:] if self.keep else lead[:0]
+            return block[:0]
+
+        first, last = loud[0], loud[-1]
+        parts = []
+        if not self._started:
+            lead = block[:first] if self._lead is None else np.concatenate((self._lead, block[:first]))
+            parts.append(lead[len(lead) - min(len(lead), self.keep):])
+            self._started = True
+            self._lead = None
+        elif self._silent:
+            parts.append(np.zeros((self._silent, channels), dtype=np.float32))
+            self._silent = 0
+            parts.append(block[:first])
+        else:
+            parts.append(block[:first])
+        parts.append(block[first:last + 1])
+        self._silent = len(block) - last - 1
+        return np.concatenate(parts)
+
+    def flush(self, channels):
+        keep = min(self._silent, self.keep) if self._started else 0
+        self._silent = 0
+        return np.zeros((keep, channels), dtype=np.float32)
+
+
+class AudioProcessor:
+    """
+    Chain of stages over interleaved int16 PCM: noise gate, normalization,
+    downmix to `out_channels`, silence trim (in that order, each optional).
+    process(data) and flush() return int16 PCM bytes with `self.channels`
+    channels.
+    """
+
+    def __init__(self, rate, channels, normalize=None, target_db=None, gain_db=None, noise_gate_db=None,
+                 trim_silence_db=None, out_channels=None):
+        self.rate = rate
+        self.in_channels = channels
+        self.channels = out_channels or channels
+        self.gate = NoiseGate(rate, noise_gate_db) if noise_gate_db is not None else None
+        self.normalizer = None
+        if normalize is not None:
+            if target_db is None:
+                target_db = -1.0 if normalize == 'peak' else -20.0
+            gain = db_to_gain(gain_db) if gain_db is not None else None
+            self.normalizer = Normalizer(rate, normalize, target_db, gain=gain)
+        self.trimmer = SilenceTrimmer(rate, trim_silence_db) if trim_silence_db is not None else None
+
+    @property
+    def changes_length(self):
+        return self.trimmer is not None
+
+    def process_block(self, block):
+        """Run the stages over a float32 (frames, channels) block scaled to [-1, 1]."""
+        if self.gate is not None:
+            block = self.gate.process(block)
+        if self.normalizer is not None:
+            block = self.normalizer.process(block)
+        block = convert_channels(block, self.channels)
+        if self.trimmer is not None:
+            block = self.trimmer.process(block)
+        return block
+
+    def process(self, data):
+        block = np.frombuffer(data, dtype=np.int16).reshape(-1, self.in_channels).astype(np.float32)
+        block *= 1.0 / 32768.0
+        return self._to_pcm(self.process_block(block))
+
+    def flush(self):
+        if self.trimmer is None:
+            return b''
+        return self._to_pcm(self.trimmer.flush(self.channels))
+
+    @staticmethod
+    def _to_pcm(block):
+        block = block * 32768.0
+        np.clip(block, -32768, 32767, out=block)
+        return block.astype(np.int16).tobytes()
+
+
+class ProcessingSink:
+    """Runs an AudioProcessor in front of another sink (a writer or encoder input)."""
+
+    def __init__(self, processor, sink):
+        self.processor = processor
+        self.sink = sink
+
+    def write(self, data):
+        out = self.processor.process(data)
+        if out:
+            self.sink.write(out)
+
+    def close(self):
+        tail = self.processor.flush()
+        if tail:
+            self.sink.write(tail)
+        return self.sink.close()
+
+
+def read_pcm_chunks(filename, rate, channels, chunk_seconds=1.0, ffmpeg='ffmpeg'):
+    """Yield int16 PCM chunks of any audio file ffmpeg can decode, resampled to rate/channels."""
+    chunk_bytes = int(chunk_seconds * rate) * channels * 2
+    if filename.lower().endswith('.wav'):
+        with wave.open(filename, 'rb') as f:
+            if f.getsampwidth() == 2 and f.getframerate() == rate and f.getnchannels() == channels:
+                while True:
+                    data = f.readframes(chunk_bytes // (channels * 2))
+                    if not data:
+                        return
+                    yield data
+    command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-i', filename,
+               '-f', 's16le', '-ar', str(rate), '-ac', str(channels), 'pipe:1']
+    with subprocess.Popen(command, stdout=subprocess.PIPE) as proc:
+        while True:
+            data = proc.stdout.read(chunk_bytes)
+            if not data:
+                break
+            yield data
+    if proc.returncode != 0:
+        raise OSError(f"ffmpeg could not decode {filename} (code {proc.returncode})")
+
+
+def measure_level(filename, rate, channels, mode='peak', ffmpeg='ffmpeg'):
+    """Peak or RMS level (linear, 1.0 = full scale) of a whole file, read in chunks."""
+    peak = 0.0
+    squares = 0.0
+    frames = 0
+    for data in read_pcm_chunks(filename, rate, channels, ffmpeg=ffmpeg):
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32) * (1.0 / 32768.0)
+        peak = max(peak, float(np.max(np.abs(samples))) if len(samples) else 0.0)
+        squares += float(np.dot(samples, samples))
+        frames += len(samples)
+    if mode == 'peak':
+        return peak
+    return (squares / frames) ** 0.5 if frames else 0.0
+
+
+def process_audio_file(input_file, output_file, rate=44100, channels=2, normalize=None, target_db=None,
+                       noise_gate_db=None, trim_silence_db=None, out_channels=None, max_gain_db=20.0,
+                       ffmpeg='ffmpeg'):
+    """
+    Post-process a finished recording into `output_file` in a streaming pass (two
+    when normalizing: one to measure the level, one to apply a fixed gain).
+    """
+    gain_db = None
+    if normalize is not None:
+        if target_db is None:
+            target_db = -1.0 if normalize == 'peak' else -20.0
+        level = measure_level(input_file, rate, channels, normalize, ffmpeg)
+        if level > 0:
+            gain_db = min(max_gain_db, target_db - 20.0 * np.log10(level))
+            if normalize == 'rms':
+                # Never push the peaks past full scale
+                peak = measure_level(input_file, rate, channels, 'peak', ffmpeg)
+                gain_db = min(gain_db, -20.0 * np.log10(peak)) if peak > 0 else gain_db
+        else:
+            normalize = None  # Digital silence, nothing to normalize
+    processor = AudioProcessor(rate, channels, normalize=normalize, target_db=target_db, gain_db=gain_db,
+                               noise_gate_db=noise_gate_db, trim_silence_db=trim_silence_db,
+                               out_channels=out_channels)
+    writer = ProcessingSink(processor, open_audio_writer(output_file, processor.channels, 2, rate))
+    try:
+        for data in read_pcm_chunks(input_file, rate, channels, ffmpeg=ffmpeg):
+            writer.write(data)
+    finally:
+        writer.close()
+    return output_file
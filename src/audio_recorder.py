@@ -1,59 +1,150 @@
-import pyaudio
-import wave
 import threading
-import os
-from pydub import AudioSegment
+import time
+from audio_mixer import AudioInput, AudioMixer
+from audio_processing import ProcessingSink
+from audio_writers import open_audio_writer
+from av_sync import AudioAligner
+from metrics import MetricsRegistry, path_size
 
 class AudioRecorder(threading.Thread):
-    def __init__(self, format, channels, rate, chunk, filename, device_index=None):
+    def __init__(self, format, channels, rate, chunk, filename, device_index=None, sink=None,
+                 session=None, sync=None, metrics=None, devices=None, backend=None, processor=None):
         threading.Thread.__init__(self)
+        if backend is None:
+            import pyaudio as backend
+        # `backend` is the pyaudio module, or anything with its API such as fake_audio
+        self.backend = backend
         self.format = format
         self.channels = channels
         self.rate = rate
         self.chunk = chunk
         self.filename = filename
-        self.frames = []
         self.is_recording = False
         self.device_index = device_index
+        # [(device_index, gain), ...] to record several inputs (e.g. microphone and
+        # system audio monitor) mixed into one stream
+        self.devices = devices or [(device_index, 1.0)]
+        # When a sink (e.g. FFmpegPipeEncoder.audio_sink) is given, chunks are streamed
+        # to it and no audio file is written
+        self.sink = sink
+        # With a shared SessionClock, audio is aligned to session start and gaps are
+        # filled and recorded in the SyncTrack
+        self.session = session
+        self.sync = sync
+        # Optional AudioProcessor (gate, normalize, downmix) applied to every chunk
+        # on its way to the sink; its channel count is what the sink receives
+        if processor is not None and processor.changes_length and session is not None:
+            raise ValueError("Silence trimming would break the sync with the video")
+        self.processor = processor
+        self.aligner = None
+        self.inputs = []
+        self.mixer = None
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self._chunks = self.metrics.counter('audio_chunks_total', 'Audio chunks read from the device')
+        for name, help, read in (
+                ('audio_overflows_total', 'Input buffers the devices reported as overflowed',
+                 lambda: sum(i.overflows for i in self.inputs)),
+                ('audio_underflows_total', 'Input buffers the devices reported as underflowed',
+                 lambda: sum(i.underflows for i in self.inputs)),
+                ('audio_mixer_underruns_total', 'Mixes where a secondary input had too few samples',
+                 lambda: self.mixer.underruns if self.mixer is not None else 0),
+                ('audio_mixer_overruns_total', 'Times a secondary input ran too far ahead and was trimmed',
+                 lambda: self.mixer.overruns if self.mixer is not None else 0),
+                ('audio_gaps_total', 'Audio gaps filled with silence on the session timeline',
+                 lambda: self.aligner.gaps if self.aligner is not None else 0)):
+            self.metrics.counter(name, help, function=read)
+        if sink is None:
+            self.metrics.gauge('audio_output_bytes', 'Bytes of audio written to disk so far',
+                               function=lambda: path_size(self.filename))
 
     def run(self):
-        audio = pyaudio.PyAudio()
-        stream = audio.open(format=self.format, channels=self.channels, rate=self.rate, input=True,
-                            frames_per_buffer=self.chunk, input_device_index=self.device_index)
-        self.is_recording = True
+        if self.sink is not None:
+            sink = self.sink if self.processor is None else ProcessingSink(self.processor, self.sink)
+            try:
+                self.record(sink)
+            finally:
+                sink.close()
+            print("Audio streamed to the encoder")
+            return
 
-        while self.is_recording:
-            data = stream.read(self.chunk, exception_on_overflow=False)
-            self.frames.append(data)
+        # Chunks are written (or encoded, for anything but .wav) as they arrive, so
+        # finishing the file never depends on how long the recording was
+        channels = self.processor.channels if self.processor is not None else self.channels
+        writer = open_audio_writer(self.filename, channels, self.backend.get_sample_size(self.format), self.rate)
+        if self.processor is not None:
+            writer = ProcessingSink(self.processor, writer)
+        try:
+            self.record(writer)
+        finally:
+            writer.close()
+        print(f"Audio saved as {self.filename}")
 
-        stream.stop_stream()
-        stream.close()
-        audio.terminate()
+    def open_inputs(self, audio):
+        """One callback-mode AudioInput per device."""
+        if len(self.devices) > 1 and self.format != self.backend.paInt16:
+            raise ValueError("Mixing several devices needs paInt16 samples")
+        for device_index, gain in self.devices:
+            rate, channels, chunk = self.rate, self.channels, self.chunk
+            if len(self.devices) > 1:
+                # Every device runs at its own native rate and channel count, the mixer converts
+                info = audio.get_device_info_by_index(device_index)
+                rate = int(info['defaultSampleRate'])
+                channels = max(1, min(self.channels, int(info['maxInputChannels'])))
+                chunk = max(1, self.chunk * rate // self.rate)
+            self.inputs.append(AudioInput(audio, self.backend, device_index, self.format, rate, channels,
+                                          chunk, gain))
 
-        # Save as WAV first
-        wav_filename = self.filename.replace('.mp3', '.wav')
-        with wave.open(wav_filename, 'wb') as wf:
-            wf.setnchannels(self.channels)
-            wf.setsampwidth(audio.get_sample_size(self.format))
-            wf.setframerate(self.rate)
-            wf.writeframes(b''.join(self.frames))
-
-        # Convert WAV to MP3
-        audio_segment = AudioSegment.from_wav(wav_filename)
-        audio_segment.export(self.filename, format='mp3')
-        os.remove(wav_filename)
-        print(f"Audio saved as {self.filename}")
+    def record(self, sink):
+        audio = self.backend.PyAudio()
+        self.is_recording = True
+        try:
+            self.open_inputs(audio)
+            self.mixer = AudioMixer(self.inputs, self.rate, self.channels)
+            latency = self.inputs[0].latency
+
+            aligner = None
+            if self.session is not None:
+                frame_bytes = self.channels * self.backend.get_sample_size(self.format)
+                # Streamed audio cannot be shifted when muxing, so it is padded back to session start
+                aligner = self.aligner = AudioAligner(self.session, self.sync, self.rate, frame_bytes,
+                                                      pad_start=self.sink is not None)
+
+            while self.is_recording:
+                block = self.mixer.read(timeout=0.5)
+                if block is None:
+                    continue
+                data, captured_at, lost = block
+                self._chunks.inc()
+                if aligner is None:
+                    sink.write(data)
+                    continue
+                # The chunk ended `latency` before the callback ran, and may have waited in the queue since
+                delay = latency + time.monotonic() - captured_at
+                for block in aligner.process(data, delay, lost):
+                    sink.write(block)
+        finally:
+            for audio_input in self.inputs:
+                audio_input.close()
+            audio.terminate()
 
     def stop(self):
         self.is_recording = False
 
-    @staticmethod
-    def list_audio_devices():
-        audio = pyaudio.PyAudio()
+    # Starting PortAudio scans every host API, so the device list is built once per process
+    _devices = None
+
+    @classmethod
+    def list_audio_devices(cls, refresh=False, backend=None):
+        if cls._devices is not None and not refresh:
+            return list(cls._devices)
+        if backend is None:
+            import pyaudio as backend
+        audio = backend.PyAudio()
         device_count = audio.get_device_count()
         devices = []
         for i in range(device_count):
             info = audio.get_device_info_by_index(i)
             devices.append((i, info.get('name')))
         audio.terminate()
-        return devices
+        cls._devices = devices
+        return list(devices)
@@ -0,0 +1,128 @@
+"""
+Incremental audio writers used as AudioRecorder sinks.
+
+A sink exposes write(data) for raw PCM chunks and close() to finalize.
+"""
+import os
+import struct
+import subprocess
+import wave
+
+# Codec ffmpeg uses for each audio file extension
+AUDIO_CODECS = {
+    '.m4a': 'aac',
+    '.aac': 'aac',
+    '.mp3': 'libmp3lame',
+    '.opus': 'libopus',
+    '.ogg': 'libvorbis',
+    '.flac': 'flac',
+}
+
+PCM_FORMATS = {1: 'u8', 2: 's16le', 3: 's24le', 4: 's32le'}
+
+
+class StreamingWavWriter:
+    """
+    Writes PCM to a WAV file through a fixed-size buffer, so memory use does not
+    grow with the length of the recording. The RIFF header is patched every time
+    the buffer is flushed, which leaves a playable file on disk if the process
+    dies; at most one buffer's worth of audio is lost.
+    """
+
+    def __init__(self, filename, channels, sample_width, rate, buffer_size=64 * 1024):
+        self.filename = filename
+        self.buffer_size = buffer_size
+        self._file = open(filename, 'wb')
+        self._wav = wave.open(self._file, 'wb')
+        self._wav.setnchannels(channels)
+        self._wav.setsampwidth(sample_width)
+        self._wav.setframerate(rate)
+        self._buffer = bytearray()
+        self.bytes_written = 0
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            # wave patches the header sizes on every writeframes() call
+            self._wav.writeframes(self._buffer)
+            self.bytes_written += len(self._buffer)
+            self._buffer.clear()
+        self._file.flush()
+
+    def close(self):
+        if self._wav is None:
+            return
+        self.flush()
+        self._wav.close()
+        self._file.close()
+        self._wav = None
+
+
+class FFmpegAudioEncoder:
+    """
+    Encodes PCM chunks with ffmpeg while recording, straight into the codec the
+    final container will carry, so the file is complete as soon as the stream is
+    closed and can later be muxed with `-c:a copy`.
+    """
+
+    def __init__(self, filename, channels, sample_width, rate, codec=None, bitrate='192k', ffmpeg='ffmpeg'):
+        self.filename = filename
+        if codec is None:
+            codec = AUDIO_CODECS.get(os.path.splitext(filename)[1].lower(), 'aac')
+        # The PCM format is given, so skip probing: it would hold back seconds of
+        # input and block the recording thread's writes meanwhile
+        command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-probesize', '32', '-analyzeduration', '0',
+                   '-f', PCM_FORMATS[sample_width], '-ar', str(rate), '-ac', str(channels), '-i', 'pipe:0',
+                   '-c:a', codec]
+        if codec != 'flac':
+            command += ['-b:a', bitrate]
+        command.append(filename)
+        self.command = command
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, data):
+        self.proc.stdin.write(data)
+
+    def close(self):
+        if self.proc.stdin.closed:
+            return self.proc.returncode
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        result = self.proc.wait()
+        if result != 0:
+            print(f"FFmpeg audio encoder exited with code {result}")
+        return result
+
+
+def open_audio_writer(filename, channels, sample_width, rate):
+    """Pick the sink for `filename`: PCM for .wav, a single ffmpeg encode otherwise."""
+    if filename.lower().endswith('.wav'):
+        return StreamingWavWriter(filename, channels, sample_width, rate)
+    return FFmpegAudioEncoder(filename, channels, sample_width, rate)
+
+
+def recover_wav(filename):
+    """
+    Repair the header of a WAV file left behind by a crash, trimming any partial
+    sample frame at the end. Returns the number of audio bytes kept.
+    """
+    with open(filename, 'r+b') as f:
+        header = f.read(44)
+        if len(header) < 44 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            raise ValueError(f"{filename} is not a WAV file written by StreamingWavWriter")
+        block_align = struct.unpack('<H', header[32:34])[0]
+        file_size = os.fstat(f.fileno()).st_size
+        data_size = file_size - 44
+        data_size -= data_size % block_align
+        f.truncate(44 + data_size)
+        f.seek(4)
+        f.write(struct.pack('<I', 36 + data_size))
+        f.seek(40)
+        f.write(struct.pack('<I', data_size))
+    return data_size
@@ -0,0 +1,185 @@
+"""
+Shared time base and sync bookkeeping for one recording session.
+
+Both recorders stamp their data against the same SessionClock. The video
+stream runs on the scheduler's frame grid, so its start is how far capture
+lags that grid. The audio stream starts with its first captured sample; the
+remaining offset between the two is applied with -itsoffset when muxing.
+Audio gaps (overflows, device stalls) are filled with silence as they are
+detected, and the slow drift between the sound card clock and the monotonic
+clock is estimated from periodic anchors and corrected when muxing.
+
+Audio streamed into the encoder while recording cannot be corrected
+afterwards. It is padded with silence back to session time zero instead,
+and the drift is only written to the sidecar.
+"""
+import json
+import time
+
+# Drift below this ratio (50 ppm, about 0.18 s per hour) is left alone
+DRIFT_TOLERANCE = 5e-5
+
+
+class SessionClock:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.start_time = None
+
+    def start(self):
+        self.start_time = self.clock()
+        return self.start_time
+
+    def now(self):
+        """Seconds since the session started."""
+        return self.clock() - self.start_time
+
+
+class SyncTrack:
+    """Sync events of one session, saved next to the recording as JSON."""
+
+    def __init__(self, audio_rate=None):
+        self.audio_rate = audio_rate
+        self.audio_start = None
+        self.video_start = None
+        self.anchors = []
+        self.audio_gaps = []
+        self.video_gaps = []
+
+    def mark_video_start(self, t):
+        """Session time of the content at video stream time zero."""
+        self.video_start = t
+
+    def mark_video_gap(self, t, ticks):
+        self.video_gaps.append((t, ticks))
+
+    def mark_audio_start(self, t):
+        """Session time of the first audio sample in the stream."""
+        self.audio_start = t
+
+    def mark_audio_gap(self, t, samples):
+        self.audio_gaps.append((t, samples))
+
+    def add_anchor(self, t, samples):
+        """Record that `samples` audio samples had been captured at session time `t`."""
+        self.anchors.append((t, samples))
+
+    def drift_ratio(self):
+        """
+        Ratio of the sound card's real sample rate to the nominal one, from a
+        least-squares fit of the anchors; 1.0 when there is not enough data.
+        """
+        if self.audio_rate is None or len(self.anchors) < 2:
+            return 1.0
+        n = len(self.anchors)
+        mean_t = sum(t for t, _ in self.anchors) / n
+        mean_s = sum(s for _, s in self.anchors) / n
+        var = sum((t - mean_t) ** 2 for t, _ in self.anchors)
+        if var <= 0:
+            return 1.0
+        cov = sum((t - mean_t) * (s - mean_s) for t, s in self.anchors)
+        return (cov / var) / self.audio_rate
+
+    def audio_offset(self):
+        """Seconds the audio stream starts after the video stream (negative if before)."""
+        if self.audio_start is None or self.video_start is None:
+            return 0.0
+        return self.audio_start - self.video_start
+
+    def to_dict(self):
+        return {
+            'audio_rate': self.audio_rate,
+            'audio_start': self.audio_start,
+            'video_start': self.video_start,
+            'anchors': self.anchors,
+            'audio_gaps': self.audio_gaps,
+            'video_gaps': self.video_gaps,
+            'drift_ratio': self.drift_ratio(),
+        }
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            data = json.load(f)
+        track = cls(data.get('audio_rate'))
+        track.audio_start = data.get('audio_start')
+        track.video_start = data.get('video_start')
+        track.anchors = [tuple(a) for a in data.get('anchors', [])]
+        track.audio_gaps = [tuple(g) for g in data.get('audio_gaps', [])]
+        track.video_gaps = [tuple(g) for g in data.get('video_gaps', [])]
+        return track
+
+
+class AudioAligner:
+    """
+    Places captured audio chunks on the session timeline. The first chunk is
+    trimmed if it began before session start. With `pad_start` it is also
+    preceded by silence back to session start; otherwise the stream starts with
+    it and its start time goes to the SyncTrack. Samples the device reports
+    as lost (an input overflow) are filled with silence and recorded as a gap
+    however short; gaps only seen on the clock are filled once they exceed
+    `gap_threshold` seconds, as shorter ones are callback jitter. An anchor is
+    added to the SyncTrack every `anchor_interval` seconds.
+    """
+
+    def __init__(self, session, sync, rate, frame_bytes, gap_threshold=0.2, anchor_interval=1.0, pad_start=True):
+        self.session = session
+        self.sync = sync
+        self.rate = rate
+        self.frame_bytes = frame_bytes
+        self.gap_threshold = gap_threshold
+        self.anchor_interval = anchor_interval
+        self.pad_start = pad_start
+        # Session sample at which the stream starts
+        self.origin = 0
+        self.written = 0
+        self.gaps = 0
+        self._started = False
+        self._next_anchor = 0.0
+
+    def process(self, data, latency=0.0, lost=0):
+        """
+        Return the byte strings to write for `data`, a chunk whose read just
+        returned, after `lost` samples the device dropped before it.
+        """
+        end_time = self.session.now() - latency
+        samples = len(data) // self.frame_bytes
+        start_sample = int(round(end_time * self.rate)) - samples
+        pad = 0
+        if not self._started:
+            if start_sample < 0:
+                trim = min(-start_sample, samples)
+                data = data[trim * self.frame_bytes:]
+                samples -= trim
+                if not samples:
+                    return []
+                start_sample = 0
+            if self.pad_start:
+                pad = start_sample
+            else:
+                self.origin = start_sample
+            self._started = True
+            if self.sync is not None:
+                self.sync.mark_audio_start(self.origin / self.rate)
+        elif lost or start_sample - self.origin - self.written > self.gap_threshold * self.rate:
+            pad = max(lost, start_sample - self.origin - self.written)
+            self.gaps += 1
+            if self.sync is not None:
+                self.sync.mark_audio_gap((self.origin + self.written) / self.rate, pad)
+
+        blocks = []
+        if pad:
+            blocks.append(bytes(pad * self.frame_bytes))
+        blocks.append(data)
+        self.written += pad + samples
+        if self.sync is not None and end_time >= self._next_anchor:
+            self.sync.add_anchor(end_time, self.origin + self.written)
+            self._next_anchor = end_time + self.anchor_interval
+        return blocks
+
+
+def sync_filename(video_file):
+    return video_file.rsplit('.', 1)[0] + '.sync.json'
@@ -0,0 +1,302 @@
+"""
+Batch muxing of the separate audio and video files that interrupted
+recordings leave behind.
+
+find_pairs() knows the names both recorders use. The window writes
+output_<timestamp>.mp4 with output_<timestamp>.<audio extension>, muxed into
+combined_<timestamp>.mp4 as the window itself does; the two are matched on
+their timestamps, up to `tolerance` seconds apart. The command line writes
+<name>.video.mp4 with <name>.audio.m4a (one audio file for all regions of a
+multi-region recording, <name>.<n>.video.mp4), muxed into <name>.mp4 or
+<name>.<n>.mp4. A sync sidecar next to the output is used for the offset and
+drift corrections, as after a normal recording.
+
+remux_all() runs the jobs in a bounded process pool. Every job is one ffmpeg
+run from muxing.build_mux_command(), an argument list without a shell, into a
+temporary file that is renamed once complete. A manifest keeps the size and
+modification time of every finished job's inputs and output and the options
+used. On the next run a job whose files and options still match is skipped,
+and failed jobs are retried.
+"""
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import re
+import signal
+import subprocess
+import time
+
+from av_sync import SyncTrack, sync_filename
+from muxing import build_mux_command, sync_corrections
+from recording_index import read_mp4_keyframes
+
+AUDIO_EXTENSIONS = ('.m4a', '.mp3', '.wav', '.aac', '.flac', '.ogg')
+MANIFEST_NAME = 'remux_manifest.json'
+MANIFEST_VERSION = 1
+
+WINDOW_NAME = re.compile(r'^output_(\d{8}_\d{6})$')
+TIMESTAMP_FORMAT = '%Y%m%d_%H%M%S'
+REGION_NAME = re.compile(r'^(.*)\.\d+$')
+
+
+class RemuxJob:
+    """One video/audio pair, the file it is muxed into and the sync sidecar to correct it with, if any."""
+
+    def __init__(self, video, audio, output, sync=None):
+        self.video = video
+        self.audio = audio
+        self.output = output
+        self.sync = sync
+
+
+def _signature(path):
+    """[size, mtime in ns] of `path`, None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _sync_file(*candidates):
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def find_pairs(directory, recursive=False, output_dir=None, tolerance=2.0):
+    """RemuxJobs for every video/audio pair under `directory`, sorted by output name."""
+    jobs = []
+    walk = os.walk(directory) if recursive else [next(os.walk(directory))]
+    for root, _, files in walk:
+        target = output_dir or root
+        stems = {}
+        for name in files:
+            stem, extension = os.path.splitext(name)
+            stems.setdefault(stem, {})[extension.lower()] = os.path.join(root, name)
+
+        # The window's output_<timestamp> files, matched on the nearest timestamp
+        videos, audios = [], []
+        for stem, by_extension in stems.items():
+            match = WINDOW_NAME.match(stem)
+            if match is None:
+                continue
+            when = datetime.datetime.strptime(match.group(1), TIMESTAMP_FORMAT)
+            if '.mp4' in by_extension:
+                videos.append((when, match.group(1), by_extension['.mp4']))
+            audio = next((by_extension[e] for e in AUDIO_EXTENSIONS if e in by_extension), None)
+            if audio is not None:
+                audios.append((when, audio))
+        for when, timestamp, video in sorted(videos):
+            candidates = [(abs((a_when - when).total_seconds()), n) for n, (a_when, _) in enumerate(audios)]
+            candidates = [c for c in candidates if c[0] <= tolerance]
+            if not candidates:
+                continue
+            _, n = min(candidates)
+            audio = audios.pop(n)[1]
+            output = os.path.join(target, f"combined_{timestamp}.mp4")
+            jobs.append(RemuxJob(video, audio, output, _sync_file(sync_filename(output))))
+
+        # The command line's <name>.video.mp4 and <name>.audio.<ext>
+        for stem, by_extension in stems.items():
+            if not stem.endswith('.video') or '.mp4' not in by_extension:
+                continue
+            name = stem[:-len('.video')]
+            region = REGION_NAME.match(name)
+            base = region.group(1) if region else name
+            audio = None
+            for audio_stem in (f"{name}.audio", f"{base}.audio"):
+                audio = next((stems[audio_stem][e] for e in AUDIO_EXTENSIONS if e in stems.get(audio_stem, {})),
+                             None)
+                if audio is not None:
+                    break
+            if audio is None:
+                continue
+            output = os.path.join(target, f"{os.path.basename(name)}.mp4")
+            sync = _sync_file(sync_filename(output), os.path.join(root, f"{os.path.basename(base)}.sync.json"))
+            jobs.append(RemuxJob(by_extension['.mp4'], audio, output, sync))
+    return sorted(jobs, key=lambda job: job.output)
+
+
+def load_manifest(filename):
+    try:
+        with open(filename) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('entries', {})
+
+
+def save_manifest(filename, entries):
+    # Written to a temporary file first, so an interrupted batch never leaves a truncated manifest
+    partial = f"{filename}.partial"
+    with open(partial, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'entries': entries}, f, indent=1, sort_keys=True)
+    os.replace(partial, filename)
+
+
+def _manifest_entry(job, options):
+    return {
+        'video': _signature(job.video),
+        'audio': _signature(job.audio),
+        'sync': _signature(job.sync) if job.sync else None,
+        'output': _signature(job.output),
+        'options': options,
+    }
+
+
+def is_up_to_date(job, entry, options):
+    if not entry or _signature(job.output) is None:
+        return False
+    current = _manifest_entry(job, options)
+    return all(entry.get(key) == current[key] for key in ('video', 'audio', 'sync', 'output', 'options'))
+
+
+def _manifest_key(job, manifest_file):
+    return os.path.relpath(os.path.abspath(job.output), os.path.dirname(os.path.abspath(manifest_file)))
+
+
+def split_up_to_date(jobs, manifest_file, options, force=False):
+    """(jobs to run, jobs the manifest shows as up to date); with `force` every job runs."""
+    entries = load_manifest(manifest_file) if manifest_file and not force else {}
+    pending, current = [], []
+    for job in jobs:
+        if entries and is_up_to_date(job, entries.get(_manifest_key(job, manifest_file)), options):
+            current.append(job)
+        else:
+            pending.append(job)
+    return pending, current
+
+
+def _ignore_sigint():
+    # Ctrl+C reaches the whole process group; the batch finishes or cancels its jobs itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run_job(video, audio, output, sync_file, options, ffmpeg):
+    sync = SyncTrack.load(sync_file) if sync_file else None
+    audio_offset, audio_tempo = sync_corrections(sync)
+    video_options = []
+    if options['video_codec'] != 'copy':
+        video_options += ['-preset', options['preset']]
+        if options['video_codec'] in ('libx264', 'libx265'):
+            video_options += ['-crf', str(options['crf'])]
+        video_options += ['-pix_fmt', 'yuv420p']
+    root, extension = os.path.splitext(output)
+    partial = f"{root}.partial{extension}"
+    command = build_mux_command(video, audio, partial, options['audio_codec'], audio_offset, audio_tempo, ffmpeg,
+                                options['video_codec'], video_options)
+    start = time.perf_counter()
+    result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            text=True)
+    seconds = time.perf_counter() - start
+    if result.returncode != 0:
+        if os.path.exists(partial):
+            os.remove(partial)
+        message = result.stderr.strip().splitlines()
+        return {'error': message[-1] if message else f"ffmpeg exited with code {result.returncode}"}
+    os.replace(partial, output)
+    try:
+        duration = read_mp4_keyframes(output)['duration']
+    except (OSError, ValueError, KeyError):
+        duration = None
+    return {
+        'seconds': seconds,
+        'bytes_in': os.path.getsize(video) + os.path.getsize(audio),
+        'bytes_out': os.path.getsize(output),
+        'duration': duration,
+    }
+
+
+def format_result(job, outcome):
+    name = os.path.basename(job.output)
+    if outcome.get('skipped'):
+        return f"skipped {name}: up to date"
+    if 'error' in outcome:
+        return f"FAILED  {name}: {outcome['error']}"
+    megabytes = outcome['bytes_in'] / 1e6
+    seconds = max(outcome['seconds'], 1e-6)
+    line = f"muxed   {name}: {megabytes:.1f} MB in {seconds:.2f} s ({megabytes / seconds:.1f} MB/s"
+    if outcome.get('duration'):
+        line += f", {outcome['duration'] / seconds:.0f}x real time"
+    return line + ")"
+
+
+def remux_options(video_codec='copy', preset='veryfast', crf=23, audio_codec=None):
+    """The options a manifest entry is only valid for."""
+    return {'video_codec': video_codec, 'preset': preset, 'crf': crf, 'audio_codec': audio_codec}
+
+
+def remux_all(jobs, manifest_file=None, workers=None, video_codec='copy', preset='veryfast', crf=23,
+              audio_codec=None, force=False, delete_inputs=False, ffmpeg='ffmpeg', report=print):
+    """
+    Mux `jobs` in up to `workers` processes (default: one per core), skipping
+    those the manifest shows as up to date unless `force`. Every outcome is
+    passed to `report` as a line as it comes in. Returns a summary dict.
+    """
+    options = remux_options(video_codec, preset, crf, audio_codec)
+    entries = load_manifest(manifest_file) if manifest_file else {}
+    pending, current = split_up_to_date(jobs, manifest_file, options, force)
+    for job in current:
+        report(format_result(job, {'skipped': True}))
+    summary = {'muxed': 0, 'skipped': len(current), 'failed': [], 'bytes_in': 0, 'bytes_out': 0}
+
+    start = time.perf_counter()
+    finished = []
+    if pending:
+        # Spawned, not forked, like the other worker pools
+        with concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count() or 1,
+                                                    mp_context=multiprocessing.get_context('spawn'),
+                                                    initializer=_ignore_sigint) as pool:
+            futures = {pool.submit(_run_job, job.video, job.audio, job.output, job.sync, options, ffmpeg): job
+                       for job in pending}
+            for future in concurrent.futures.as_completed(futures):
+                job = futures[future]
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    outcome = {'error': str(e)}
+                report(format_result(job, outcome))
+                if 'error' in outcome:
+                    summary['failed'].append(job.output)
+                else:
+                    summary['muxed'] += 1
+                    summary['bytes_in'] += outcome['bytes_in']
+                    summary['bytes_out'] += outcome['bytes_out']
+                    finished.append(job)
+                if manifest_file:
+                    key = _manifest_key(job, manifest_file)
+                    if 'error' in outcome:
+                        entries.pop(key, None)
+                    else:
+                        entries[key] = dict(_manifest_entry(job, options), seconds=round(outcome['seconds'], 3))
+                    save_manifest(manifest_file, entries)
+    summary['seconds'] = time.perf_counter() - start
+
+    if delete_inputs:
+        # An input goes once every job reading it is muxed or was already up to date, so an
+        # audio file shared by several regions stays while any of them failed; sync sidecars
+        # belong to the outputs and are kept
+        done = {job.output for job in finished + current}
+        readers = {}
+        for job in jobs:
+            for file in (job.video, job.audio):
+                readers.setdefault(file, []).append(job.output)
+        for file, outputs in readers.items():
+            if all(output in done for output in outputs):
+                os.remove(file)
+    return summary
+
+
+def format_summary(summary):
+    megabytes = summary['bytes_in'] / 1e6
+    line = (f"{summary['muxed']} muxed, {summary['skipped']} up to date, {len(summary['failed'])} failed; "
+            f"{megabytes:.1f} MB in {summary['seconds']:.1f} s")
+    if summary['seconds'] > 0 and summary['muxed']:
+        line += f" ({megabytes / summary['seconds']:.1f} MB/s)"
+    return line
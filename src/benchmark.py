@@ -0,0 +1,580 @@
+"""
+Headless benchmark suite for the recording pipeline.
+
+Frames come from SyntheticFrameSource and audio from fake_audio devices,
+so every number is reproducible without a display or sound card; real capture
+backends are measured too when a display is available (or an Xvfb server can
+be started). Results are written as JSON, and two result files can be compared
+to spot regressions between commits:
+
+    python src/cli.py benchmark -o before.json
+    python src/cli.py benchmark -o after.json --compare before.json
+"""
+import contextlib
+import datetime
+import functools
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import fake_audio
+from adaptive import PRESET_COST, AdaptiveController
+from audio_recorder import AudioRecorder
+from av_sync import AudioAligner, SessionClock, SyncTrack
+from camera_overlay import CameraCapture, CameraOverlay, SyntheticCamera
+from chunked_encoder import ChunkedEncoder
+from encoder_probe import is_opencv, make_encoder_factory
+from frame_pipeline import FramePipeline, _resize_into
+from frame_sources import FRAME_SOURCES, SyntheticFrameSource, invalidate_display_geometry
+from muxing import mux_audio_video, sync_corrections
+from screen_recorder import ScreenRecorder
+from video_encoders import OpenCVVideoEncoder, SegmentedEncoder
+
+DEFAULT_RESOLUTIONS = ((1280, 720), (1920, 1080), (2560, 1440))
+# An OpenCV fourcc ('mp4v') is the OpenCV writer plus a mux after stop, anything else codec:preset for ffmpeg
+DEFAULT_CODECS = ('mp4v', 'libx264:ultrafast', 'libx264:veryfast')
+
+
+def percentiles(samples):
+    """p50/p95/p99/max in milliseconds of durations given in seconds."""
+    if not len(samples):
+        return None
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'max': float(ms.max())}
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallow the recorders' progress prints while a benchmark runs."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextlib.contextmanager
+def xvfb(size=(1920, 1080), display=':99'):
+    """
+    Run an Xvfb server for the duration of the block when there is no display
+    and Xvfb is installed; yields the DISPLAY in use, or None.
+    """
+    if os.environ.get('DISPLAY') or sys.platform != 'linux' or shutil.which('Xvfb') is None:
+        yield os.environ.get('DISPLAY')
+        return
+    server = subprocess.Popen(['Xvfb', display, '-screen', '0', f'{size[0]}x{size[1]}x24', '-nolisten', 'tcp'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ['DISPLAY'] = display
+    invalidate_display_geometry()
+    time.sleep(1.0)  # Let the server accept connections
+    try:
+        yield display
+    finally:
+        del os.environ['DISPLAY']
+        invalidate_display_geometry()
+        server.terminate()
+        server.wait()
+
+
+def bench_capture(name, frames=60):
+    """Grab latency and throughput of one frame source into a preallocated array."""
+    try:
+        source = FRAME_SOURCES[name]()
+    except Exception as e:
+        return {'error': str(e)}
+    try:
+        width, height = source.size
+        dst = np.empty((height, width, 3), dtype=np.uint8)
+        source.grab_into(dst)
+        times = []
+        start = time.perf_counter()
+        for _ in range(frames):
+            t0 = time.perf_counter()
+            source.grab_into(dst)
+            times.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - start
+    finally:
+        source.close()
+    return {'size': [width, height], 'fps': frames / elapsed, 'latency_ms': percentiles(times)}
+
+
+def bench_convert(src_size, dst_size, frames=60):
+    """Scaling cost from capture size to output size, into a preallocated slot."""
+    src = SyntheticFrameSource((0, 0) + tuple(src_size)).grab().copy()
+    dst = np.empty((dst_size[1], dst_size[0], 3), dtype=np.uint8)
+    times = []
+    for _ in range(frames):
+        t0 = time.perf_counter()
+        _resize_into(src, dst)
+        times.append(time.perf_counter() - t0)
+    return {'from': list(src_size), 'to': list(dst_size), 'latency_ms': percentiles(times)}
+
+
+def bench_encode(codec, size, fps, frames, directory):
+    """Encode throughput with frames offered as fast as the encoder takes them."""
+    source = SyntheticFrameSource((0, 0) + tuple(size))
+    # A handful of distinct frames, so the encoder cannot coast on identical input
+    clips = [source.grab().copy() for _ in range(8)]
+    filename = os.path.join(directory, f"encode_{codec.replace(':', '_')}_{size[0]}x{size[1]}.mp4")
+    try:
+        encoder = make_encoder_factory(codec)(filename, fps, size)
+    except Exception as e:
+        return {'error': str(e)}
+    times = []
+    start = time.perf_counter()
+    for i in range(frames):
+        t0 = time.perf_counter()
+        encoder.write(clips[i % len(clips)])
+        times.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    encoder.release()
+    release = time.perf_counter() - t0
+    elapsed = time.perf_counter() - start
+    return {'fps': frames / elapsed, 'write_ms': percentiles(times), 'release_ms': release * 1000.0,
+            'bytes': os.path.getsize(filename) if os.path.exists(filename) else 0}
+
+
+def worker_counts(limit=None):
+    """1, 2, 4, ... up to the number of cores (which is always included)."""
+    limit = limit or os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 < limit:
+        counts.append(counts[-1] * 2)
+    if limit > 1:
+        counts.append(limit)
+    return counts
+
+
+def bench_chunked(codec, size, fps, directory, workers=None, chunk_seconds=1.0, chunks=8):
+    """
+    ChunkedEncoder throughput, frames offered as fast as it takes them, for
+    every worker count, with the speedup over one worker. x264 gets the cores
+    divided between the workers.
+    """
+    source = SyntheticFrameSource((0, 0) + tuple(size))
+    clips = [source.grab().copy() for _ in range(8)]
+    frames = chunks * max(1, round(chunk_seconds * fps))
+    cores = os.cpu_count() or 1
+    results = {}
+    for count in workers or worker_counts():
+        inner = make_encoder_factory(codec, threads=max(1, cores // count))
+        filename = os.path.join(directory, f"chunked_{codec.replace(':', '_')}_{size[0]}x{size[1]}_{count}.mp4")
+        try:
+            encoder = ChunkedEncoder(filename, fps, size, workers=count, chunk_seconds=chunk_seconds,
+                                     encoder_factory=inner)
+        except Exception as e:
+            return {'error': str(e)}
+        start = time.perf_counter()
+        for i in range(frames):
+            encoder.write(clips[i % len(clips)])
+        with quiet():
+            result = encoder.release()
+        elapsed = time.perf_counter() - start
+        if result != 0:
+            return {'error': f"chunked encode failed with code {result}"}
+        results[count] = {'fps': frames / elapsed, 'stalled_ms': encoder.stalled_seconds * 1000.0,
+                          'bytes': os.path.getsize(filename)}
+    base = results[min(results)]['fps']
+    for result in results.values():
+        result['speedup'] = result['fps'] / base
+    return results
+
+
+class _NullEncoder:
+    def __init__(self, *args):
+        pass
+
+    def write(self, frame):
+        pass
+
+    def release(self):
+        pass
+
+
+def bench_allocations(size, frames=100, warmup=20):
+    """Python heap allocated per frame by capture -> ring -> encoder in the steady state."""
+    width, height = size
+    source = SyntheticFrameSource((0, 0, width, height))
+    pipeline = FramePipeline(_NullEncoder(), (height, width, 3), capacity=4)
+    pipeline.start()
+
+    def step():
+        index = pipeline.acquire()
+        if index is None:
+            pipeline.discard()
+            return
+        pipeline.capture(index, source)
+        pipeline.commit(index)
+
+    try:
+        for _ in range(warmup):
+            step()
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(frames):
+            step()
+        after, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        pipeline.close()
+    return {'frames': frames, 'bytes_per_frame': max(0, after - before) / frames, 'peak_kb': peak / 1024,
+            'frame_kb': width * height * 3 / 1024}
+
+
+def bench_overlay(size, frames=120, camera_size=(640, 480), camera_fps=30):
+    """Capture throughput with and without a webcam picture-in-picture fed by a synthetic camera."""
+    width, height = size
+    source = SyntheticFrameSource((0, 0, width, height))
+    camera = CameraCapture(SyntheticCamera(camera_size, camera_fps))
+    camera.start()
+    try:
+        # The overlay draws nothing until the camera has delivered a frame
+        camera.slot.wait(timeout=5.0)
+        overlay = CameraOverlay(camera.slot)
+        results = {}
+        for key, frame_overlay in (('plain', None), ('overlay', overlay)):
+            pipeline = FramePipeline(_NullEncoder(), (height, width, 3), capacity=4)
+            pipeline.start()
+            try:
+                start = time.perf_counter()
+                for _ in range(frames):
+                    index = pipeline.acquire()
+                    if index is None:
+                        pipeline.discard()
+                        continue
+                    pipeline.capture(index, source, overlay=frame_overlay)
+                    pipeline.commit(index)
+                results[f'{key}_fps'] = frames / (time.perf_counter() - start)
+            finally:
+                pipeline.close()
+    finally:
+        camera.stop()
+        camera.join()
+    results.update(overlay.summary())
+    return results
+
+
+def bench_av_drift(seconds=3600.0, drift_ppm=80.0, rate=44100, chunk=1024):
+    """
+    Simulates `seconds` of audio from a sound card whose clock runs `drift_ppm`
+    fast, on a virtual clock, through AudioAligner and SyncTrack. Reports how
+    far audio ends up from video without correction and after the tempo
+    correction the mux would apply.
+    """
+    now = [0.0]
+    session = SessionClock(clock=lambda: now[0])
+    session.start()
+    sync = SyncTrack(rate)
+    aligner = AudioAligner(session, sync, rate, frame_bytes=4)
+    data = bytes(chunk * 4)
+    true_rate = rate * (1 + drift_ppm / 1e6)
+    captured = 0
+    while now[0] < seconds:
+        captured += chunk
+        now[0] = captured / true_rate
+        aligner.process(data)
+    _, tempo = sync_corrections(sync)
+    audio_duration = aligner.written / rate
+    return {
+        'seconds': seconds,
+        'true_ratio': true_rate / rate,
+        'estimated_ratio': sync.drift_ratio(),
+        'uncorrected_drift_ms': (audio_duration - seconds) * 1000.0,
+        'corrected_drift_ms': (audio_duration / tempo - seconds) * 1000.0,
+    }
+
+
+def bench_recording(codec, size, fps, seconds, directory, audio_devices=((0, 1.0), (1, 0.7)),
+                    encoder_process=False):
+    """
+    A full recording with audio from fake_audio (by default a mono 44.1 kHz
+    microphone mixed with a stereo 48 kHz monitor): sustained fps, frame pacing,
+    drops, audio mixer health, and the time from stop() until the final file is
+    on disk.
+    """
+    suffix = '_process' if encoder_process else ''
+    base = os.path.join(directory, f"record_{codec.replace(':', '_')}_{size[0]}x{size[1]}{suffix}")
+    streaming = not is_opencv(codec)
+    video_file = f"{base}.mp4" if streaming else f"{base}.video.mp4"
+    audio_file = f"{base}.audio.m4a"
+    output_file = f"{base}.mp4"
+    session = SessionClock()
+    sync = SyncTrack(44100)
+    encoder_factory = make_encoder_factory(codec, audio_rate=44100 if streaming else None)
+    with quiet():
+        try:
+            recorder = ScreenRecorder(None, fps, video_file, frame_source=SyntheticFrameSource((0, 0) + tuple(size)),
+                                      encoder_factory=encoder_factory,
+                                      session=session, sync=sync, encoder_process=encoder_process)
+        except Exception as e:
+            return {'error': str(e)}
+        sink = recorder.out.audio_sink if streaming else None
+        audio = AudioRecorder(fake_audio.paInt16, 2, 44100, 1024, audio_file, sink=sink, devices=audio_devices,
+                              backend=fake_audio, session=session, sync=sync, metrics=recorder.metrics)
+        session.start()
+        audio.start()
+        recorder.start()
+        time.sleep(seconds)
+
+        stop = time.perf_counter()
+        audio.stop()
+        recorder.stop()
+        audio.join()
+        recorder.join()
+        if not streaming:
+            result = mux_audio_video(video_file, audio_file, output_file, sync=sync)
+            if result != 0:
+                return {'error': f"mux failed with code {result}"}
+        stop_to_file = time.perf_counter() - stop
+
+    pacing = recorder.scheduler.report()
+    stats = recorder.pipeline.stats()
+    metrics = recorder.metrics.snapshot()
+    results = {
+        'fps': pacing['achieved_fps'],
+        'jitter_ms': pacing.get('jitter_ms'),
+        'captured': stats['captured'],
+        'dropped': stats['dropped'],
+        'duplicated': stats['duplicated'],
+        'audio_mixer_underruns': metrics.get('audio_mixer_underruns_total'),
+        'audio_gaps': metrics.get('audio_gaps_total'),
+        'stop_to_file_ms': stop_to_file * 1000.0,
+        'bytes': os.path.getsize(output_file) if os.path.exists(output_file) else 0,
+    }
+    latency = metrics.get('frame_latency_seconds')
+    if latency:
+        results['frame_latency_ms'] = {q: latency[q] * 1000.0 for q in ('p50', 'p95', 'p99') if latency[q] is not None}
+    return results
+
+
+def shared_memory_segments():
+    """Names of the multiprocessing shared memory blocks that exist; None where they cannot be listed."""
+    if not os.path.isdir('/dev/shm'):
+        return None
+    return {name for name in os.listdir('/dev/shm') if name.startswith(('psm_', 'wnsm_'))}
+
+
+def bench_encoder_process(codec, size, fps, seconds, directory):
+    """
+    bench_recording with the encoder in its own process fed through shared
+    memory, plus the number of shared memory blocks left behind afterwards.
+    """
+    before = shared_memory_segments()
+    results = bench_recording(codec, size, fps, seconds, directory, encoder_process=True)
+    after = shared_memory_segments()
+    if before is not None and after is not None:
+        results['leaked_segments'] = len(after - before)
+    return results
+
+
+class EncoderLoad:
+    """How hard SlowEncoder finds its frames; one instance is shared by the encoders of a run and changed during it."""
+
+    def __init__(self, value=1.0):
+        self.value = value
+
+
+class SlowEncoder:
+    """
+    Stands in for an encoder the machine cannot keep up with: every new frame
+    costs `seconds_per_megapixel` times the preset's cost relative to ultrafast
+    (times `load.value`) before the OpenCV writer gets it. A repeated frame is
+    free, as x264 codes it as skip blocks. Takes the preset and output_size
+    options of FFmpegPipeEncoder, so SegmentedEncoder and AdaptiveController
+    treat it the same way.
+    """
+
+    def __init__(self, filename, fps, size, preset='medium', output_size=None, seconds_per_megapixel=0.02,
+                 load=None):
+        self.delay = seconds_per_megapixel * PRESET_COST.get(preset, 1.0) * size[0] * size[1] / 1e6
+        self.load = load if load is not None else EncoderLoad()
+        self.output_size = tuple(output_size) if output_size is not None else None
+        self.encoder = OpenCVVideoEncoder(filename, fps, self.output_size or size)
+        self._last = None
+
+    def write(self, frame):
+        if frame is not self._last:
+            time.sleep(self.delay * self.load.value)
+            self._last = frame
+        if self.output_size is not None and (frame.shape[1], frame.shape[0]) != self.output_size:
+            frame = cv2.resize(frame, self.output_size, interpolation=cv2.INTER_LINEAR)
+        self.encoder.write(frame)
+
+    def release(self):
+        self.encoder.release()
+
+
+def bench_adaptive(size, fps, seconds, directory, seconds_per_megapixel=0.02, min_scale=0.5):
+    """
+    AdaptiveController against SlowEncoder: overloaded at the 'medium' preset
+    for the first half of the run, lightly loaded for the second. Reports how
+    fast quality stepped down, whether it came back up, and the frames lost.
+    """
+    filename = os.path.join(directory, f"adaptive_{size[0]}x{size[1]}.mp4")
+    load = EncoderLoad()
+    inner = functools.partial(SlowEncoder, preset='medium', seconds_per_megapixel=seconds_per_megapixel, load=load)
+    factory = functools.partial(SegmentedEncoder, segment_seconds=None, encoder_factory=inner)
+    with quiet():
+        recorder = ScreenRecorder(None, fps, filename, frame_source=SyntheticFrameSource((0, 0) + tuple(size)),
+                                  encoder_factory=factory)
+        controller = AdaptiveController(recorder, min_fps=fps / 2, min_scale=min_scale, preset='medium',
+                                        interval=0.5, patience=3, log=lambda message: None)
+        recorder.start()
+        controller.start()
+        time.sleep(seconds / 2)
+        lowest = controller.level
+        load.value = 0.2
+        time.sleep(seconds / 2)
+        controller.stop()
+        recorder.stop()
+        recorder.join()
+
+    stats = recorder.pipeline.stats()
+    downs = [a for a in controller.adjustments if a['direction'] == 'down']
+    return {
+        'levels': len(controller.ladder),
+        'adjustments': len(controller.adjustments),
+        'steps_down': len(downs),
+        'steps_up': len(controller.adjustments) - len(downs),
+        'first_adjustment_s': controller.adjustments[0]['time'] if controller.adjustments else None,
+        'lowest_level': lowest,
+        'final_level': controller.level,
+        'captured': stats['captured'],
+        'dropped': stats['dropped'],
+        'duplicated': stats['duplicated'],
+        'skipped': stats['skipped'],
+        'fps': recorder.scheduler.report()['achieved_fps'],
+        'bytes': os.path.getsize(filename) if os.path.exists(filename) else 0,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_suite(resolutions=DEFAULT_RESOLUTIONS, codecs=DEFAULT_CODECS, fps=30, seconds=5.0, frames=60,
+              drift_seconds=3600.0, use_xvfb=True, log=print):
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'fps': fps,
+            'seconds': seconds,
+            'frames': frames,
+        },
+        'capture': {},
+        'convert': {},
+        'encode': {},
+        'allocations': {},
+        'overlay': {},
+        'recording': {},
+        'encoder_process': {},
+        'adaptive': {},
+        'chunked': {},
+    }
+
+    display_context = xvfb() if use_xvfb else contextlib.nullcontext(os.environ.get('DISPLAY'))
+    with display_context as display:
+        results['meta']['display'] = display
+        for name in FRAME_SOURCES:
+            log(f"capture {name}")
+            with quiet():
+                results['capture'][name] = bench_capture(name, frames)
+
+    largest = max(resolutions)
+    for size in resolutions:
+        key = f"{size[0]}x{size[1]}"
+        if size != largest:
+            log(f"convert {largest[0]}x{largest[1]} -> {key}")
+            results['convert'][key] = bench_convert(largest, size, frames)
+        log(f"allocations {key}")
+        results['allocations'][key] = bench_allocations(size)
+        log(f"overlay {key}")
+        results['overlay'][key] = bench_overlay(size, frames)
+
+    with tempfile.TemporaryDirectory(prefix='screenrecorder-bench-') as directory:
+        for codec in codecs:
+            results['encode'][codec] = {}
+            results['recording'][codec] = {}
+            for size in resolutions:
+                key = f"{size[0]}x{size[1]}"
+                log(f"encode {codec} {key}")
+                results['encode'][codec][key] = bench_encode(codec, size, fps, frames, directory)
+                log(f"recording {codec} {key}")
+                results['recording'][codec][key] = bench_recording(codec, size, fps, seconds, directory)
+            key = f"{largest[0]}x{largest[1]}"
+            log(f"recording {codec} {key}, encoder process")
+            results['encoder_process'][codec] = {key: bench_encoder_process(codec, largest, fps, seconds, directory)}
+            log(f"chunked encode {codec} {key}")
+            results['chunked'][codec] = {key: bench_chunked(codec, largest, fps, directory)}
+        size = min(resolutions)
+        key = f"{size[0]}x{size[1]}"
+        log(f"adaptive quality {key}")
+        results['adaptive'][key] = bench_adaptive(size, fps, max(seconds, 10.0), directory)
+
+    log("a/v drift")
+    results['av_drift'] = bench_av_drift(drift_seconds)
+    results['meta']['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def _flatten(data, prefix=''):
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(old, new, threshold=0.1):
+    """[(metric, old, new, relative change)] for metrics that moved more than `threshold`."""
+    old_flat = _flatten({k: v for k, v in old.items() if k != 'meta'})
+    new_flat = _flatten({k: v for k, v in new.items() if k != 'meta'})
+    changes = []
+    for name in sorted(old_flat.keys() & new_flat.keys()):
+        before, after = old_flat[name], new_flat[name]
+        if before == 0:
+            continue
+        change = (after - before) / abs(before)
+        if abs(change) > threshold:
+            changes.append((name, before, after, change))
+    return changes
+
+
+def save_results(results, filename):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(filename):
+    with open(filename) as f:
+        return json.load(f)
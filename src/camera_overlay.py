@@ -0,0 +1,193 @@
+"""
+Webcam picture-in-picture for ScreenRecorder.
+
+A CameraCapture thread blocks on the camera and drops every frame into a
+LatestFrame slot; nobody polls. CameraOverlay runs on the capture thread for
+each screen frame: it resizes the camera frame into a preallocated buffer only
+when a new one has arrived, and blends that buffer into a corner of the screen
+frame in place.
+"""
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from frame_pipeline import _resize_into
+
+CORNERS = ('top-left', 'top-right', 'bottom-left', 'bottom-right')
+
+
+class LatestFrame:
+    """
+    Single-value handoff between a producer and any number of readers. Only the
+    newest frame is kept; a version number tells readers whether it changed.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._version = 0
+        self._closed = False
+
+    def put(self, frame):
+        with self._cond:
+            self._frame = frame
+            self._version += 1
+            self._cond.notify_all()
+
+    def get(self):
+        """Return (version, frame) without waiting; version 0 means no frame yet."""
+        with self._cond:
+            return self._version, self._frame
+
+    def wait(self, after_version=0, timeout=None):
+        """Block until a frame newer than `after_version` arrives; (version, frame), or None on timeout/close."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._version > after_version or self._closed, timeout):
+                return None
+            if self._version <= after_version:
+                return None
+            return self._version, self._frame
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class SyntheticCamera:
+    """
+    Stand-in for cv2.VideoCapture producing a moving test pattern at `fps`, so
+    the overlay cost can be measured without a webcam.
+    """
+
+    def __init__(self, size=(640, 480), fps=30):
+        width, height = size
+        self.interval = 1.0 / fps
+        self._frames = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(2)]
+        self._index = 0
+        self._next = time.monotonic()
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._next = max(self._next + self.interval, time.monotonic())
+        # Alternate between two buffers, a reader may still be resizing the last one
+        frame = self._frames[self._index % 2]
+        frame[:] = (self._index * 4) % 256
+        frame[:, (self._index * 8) % frame.shape[1]] = 255
+        self._index += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+
+class CameraCapture(threading.Thread):
+    """
+    Reads `capture` (a cv2.VideoCapture or anything with read/release) as fast
+    as the camera delivers and publishes each frame to `slot`.
+    """
+
+    def __init__(self, capture, slot=None, retry_interval=0.5):
+        threading.Thread.__init__(self, daemon=True)
+        self.capture = capture
+        self.slot = slot or LatestFrame()
+        self.retry_interval = retry_interval
+        self.running = False
+        self.frames = 0
+
+    @classmethod
+    def open(cls, camera_index=0, **kwargs):
+        return cls(cv2.VideoCapture(camera_index), **kwargs)
+
+    def run(self):
+        self.running = True
+        try:
+            while self.running:
+                # read() blocks until the camera has a frame, which paces the loop
+                ret, frame = self.capture.read()
+                if not ret:
+                    # Camera missing or unplugged: back off instead of spinning
+                    time.sleep(self.retry_interval)
+                    continue
+                self.frames += 1
+                self.slot.put(frame)
+        finally:
+            self.capture.release()
+            self.slot.close()
+
+    def stop(self):
+        self.running = False
+
+
+class CameraOverlay:
+    """
+    Blends the newest camera frame into screen frames. `size` is the overlay
+    width as a fraction of the screen width (the camera's aspect ratio is
+    kept), `margin` the gap to the screen edges in pixels.
+    """
+
+    def __init__(self, slot, corner='bottom-right', size=0.25, margin=16, opacity=1.0):
+        if corner not in CORNERS:
+            raise ValueError(f"Unknown corner: {corner}")
+        self.slot = slot
+        self.corner = corner
+        self.size = size
+        self.margin = margin
+        self.opacity = opacity
+        self._version = 0
+        self._buffer = None
+        self._frame_shape = None
+        self._camera_shape = None
+        self._rect = None
+        self.frames = 0
+        self.resizes = 0
+        self.seconds = 0.0
+
+    def _layout(self, frame_shape, camera_shape):
+        frame_height, frame_width = frame_shape[:2]
+        camera_height, camera_width = camera_shape[:2]
+        width = max(2, min(frame_width - 2 * self.margin, int(frame_width * self.size)))
+        height = max(2, min(frame_height - 2 * self.margin, int(width * camera_height / camera_width)))
+        left = self.margin if self.corner.endswith('left') else frame_width - width - self.margin
+        top = self.margin if self.corner.startswith('top') else frame_height - height - self.margin
+        self._rect = (max(0, left), max(0, top), width, height)
+        self._buffer = np.empty((height, width, 3), dtype=np.uint8)
+        self._frame_shape = frame_shape
+        self._camera_shape = camera_shape
+        self._version = 0
+
+    def apply(self, frame):
+        """Draw the overlay into `frame` in place and return it."""
+        version, camera = self.slot.get()
+        if camera is None:
+            return frame
+        start = time.perf_counter()
+        if frame.shape != self._frame_shape or camera.shape != self._camera_shape:
+            self._layout(frame.shape, camera.shape)
+        if version != self._version:
+            _resize_into(camera, self._buffer)
+            self._version = version
+            self.resizes += 1
+        left, top, width, height = self._rect
+        roi = frame[top:top + height, left:left + width]
+        if self.opacity >= 1.0:
+            np.copyto(roi, self._buffer)
+        else:
+            cv2.addWeighted(self._buffer, self.opacity, roi, 1.0 - self.opacity, 0.0, dst=roi)
+        self.frames += 1
+        self.seconds += time.perf_counter() - start
+        return frame
+
+    def summary(self):
+        return {
+            'frames': self.frames,
+            'resizes': self.resizes,
+            'mean_ms': self.seconds / self.frames * 1000.0 if self.frames else 0.0,
+        }
@@ -0,0 +1,177 @@
+"""
+Parallel encoding of one frame stream in independent chunks.
+
+A single encoder, the OpenCV writer in particular, runs on one core. At 4K or
+at high frame rates that core is the bottleneck, however many others the
+machine has. ChunkedEncoder cuts the stream into chunks of `chunk_seconds`.
+Each chunk is encoded by its own inner encoder, so it is a closed GOP that
+starts with a keyframe and references nothing outside itself. Up to
+`workers` chunks are encoded at once in a process pool. On release() the
+finished chunks are joined in capture order with a stream copy, so nothing
+is encoded twice and the output does not depend on which worker finished
+first.
+
+The frames of a chunk are copied into a shared memory block, and the worker
+encodes straight from it; pixel data is never pickled. There are at most
+`max_in_flight` blocks, the one being filled included. When all of them are
+taken, write() waits for the oldest chunk to finish. Memory is therefore
+capped at max_in_flight * chunk frames * frame size, and back pressure
+reaches the pipeline's ring and its drop policy.
+"""
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import shutil
+import signal
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from muxing import concat_segments
+from video_encoders import OpenCVVideoEncoder, segment_directory
+
+
+def _ignore_sigint():
+    # Ctrl+C reaches the whole process group; the recording process decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _encode_chunk(encoder_factory, memory_name, count, shape, filename, fps, size):
+    memory = shared_memory.SharedMemory(name=memory_name)
+    frames = frame = None
+    try:
+        frames = np.ndarray((count, *shape), dtype=np.uint8, buffer=memory.buf)
+        encoder = encoder_factory(filename, fps, size)
+        try:
+            for frame in frames:
+                encoder.write(frame)
+        finally:
+            result = encoder.release()
+    finally:
+        # Views into the block have to go before it can be closed
+        frames = frame = None
+        memory.close()
+    if result:
+        raise OSError(f"encoder exited with code {result}")
+    return filename
+
+
+class ChunkedEncoder:
+    """
+    Encodes chunks of `chunk_seconds` in `workers` processes (default: one
+    per core) with `encoder_factory` (OpenCVVideoEncoder by default) and joins
+    them into `filename` (see the module docstring). `max_in_flight` defaults
+    to one chunk per worker plus the one being filled.
+
+    `encoder_factory` is called in the workers and therefore has to be
+    picklable: an encoder class or a functools.partial of one. An encoder that
+    is multi-threaded itself (x264) should be limited to a share of the cores.
+    """
+
+    def __init__(self, filename, fps, size, workers=None, chunk_seconds=1.0, max_in_flight=None,
+                 encoder_factory=OpenCVVideoEncoder):
+        self.filename = filename
+        self.fps = fps
+        self.size = size
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max(2, max_in_flight or self.workers + 1)
+        self.chunk_frames = max(1, round(chunk_seconds * fps))
+        self.encoder_factory = encoder_factory
+        self.chunk_dir = segment_directory(filename)
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        self.chunks = []
+        self.failed = []
+        # Seconds write() spent waiting for a free block
+        self.stalled_seconds = 0.0
+        self._shape = (size[1], size[0], 3)
+        self._extension = os.path.splitext(filename)[1] or '.mp4'
+        self._blocks = []
+        self._free = collections.deque()
+        self._pending = collections.deque()
+        self._block = None
+        self._view = None
+        self._frames = 0
+        self._index = 0
+        # Spawned, not forked: the recording process has threads and an X connection
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=_ignore_sigint)
+
+    @property
+    def in_flight(self):
+        """Chunks submitted and not finished yet."""
+        return len(self._pending)
+
+    def write(self, frame):
+        if self._block is None:
+            self._block = self._take_block()
+            self._view = np.ndarray((self.chunk_frames, *self._shape), dtype=np.uint8, buffer=self._block.buf)
+        if not isinstance(frame, np.ndarray):
+            frame = np.frombuffer(frame, dtype=np.uint8)
+        self._view[self._frames] = frame.reshape(self._shape)
+        self._frames += 1
+        if self._frames == self.chunk_frames:
+            self._submit()
+
+    def _take_block(self):
+        while self._pending and self._pending[0][0].done():
+            self._finish_oldest()
+        if not self._free:
+            if len(self._blocks) < self.max_in_flight:
+                frame_bytes = self._shape[0] * self._shape[1] * 3
+                block = shared_memory.SharedMemory(create=True, size=self.chunk_frames * frame_bytes)
+                self._blocks.append(block)
+                return block
+            start = time.perf_counter()
+            self._finish_oldest()
+            self.stalled_seconds += time.perf_counter() - start
+        return self._free.popleft()
+
+    def _submit(self):
+        filename = os.path.join(self.chunk_dir, f'chunk_{self._index:05d}{self._extension}')
+        future = self._pool.submit(_encode_chunk, self.encoder_factory, self._block.name, self._frames,
+                                   self._shape, filename, self.fps, self.size)
+        self._pending.append((future, self._block, filename))
+        self._view = None
+        self._block = None
+        self._frames = 0
+        self._index += 1
+
+    def _finish_oldest(self):
+        future, block, filename = self._pending.popleft()
+        try:
+            self.chunks.append(future.result())
+        except Exception as e:
+            print(f"Encoding {filename} failed: {e}")
+            self.failed.append(filename)
+        finally:
+            self._free.append(block)
+
+    def release(self):
+        if self._frames:
+            self._submit()
+        self._view = None
+        try:
+            while self._pending:
+                self._finish_oldest()
+        finally:
+            self._pool.shutdown()
+            for block in self._blocks:
+                block.close()
+                block.unlink()
+        if self.failed:
+            print(f"{len(self.failed)} chunks failed, the others are kept in {self.chunk_dir}")
+            return 1
+        result = 0
+        if self.chunks:
+            try:
+                result = concat_segments(self.chunks, self.filename)
+            except OSError as e:
+                print(f"Could not run ffmpeg to join chunks: {e}")
+                result = 1
+            if result != 0:
+                print(f"Joining chunks failed with code {result}, they are kept in {self.chunk_dir}")
+                return result
+        shutil.rmtree(self.chunk_dir, ignore_errors=True)
+        return result
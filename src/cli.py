@@ -0,0 +1,673 @@
+"""
+Command line entry point: `screen_audio_recorder record` records without Qt
+(servers, CI, scripts), `list-devices` prints the audio inputs, `benchmark`
+measures the pipeline and `gui`, the default, opens the window.
+
+Only argparse and the standard library are imported at startup. Qt, PyAudio,
+OpenCV and NumPy are imported by the subcommand that needs them, so --help
+and a cached `list-devices` return immediately.
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+from app_cache import cache_dir
+
+DEVICE_CACHE_MAX_AGE = 300  # seconds
+
+
+def cached_audio_devices(refresh=False, max_age=DEVICE_CACHE_MAX_AGE):
+    """
+    [(index, name), ...] of the audio devices. PortAudio scans every host API
+    when it starts, which takes up to seconds, so the list is kept on disk for
+    `max_age` seconds.
+    """
+    cache_file = os.path.join(cache_dir(), 'audio_devices.json')
+    if not refresh:
+        try:
+            if time.time() - os.path.getmtime(cache_file) < max_age:
+                with open(cache_file) as f:
+                    return [tuple(device) for device in json.load(f)]
+        except (OSError, ValueError):
+            pass
+
+    from audio_recorder import AudioRecorder
+    devices = AudioRecorder.list_audio_devices()
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file, 'w') as f:
+            json.dump(devices, f)
+    except OSError:
+        pass  # Read-only home, the cache is only an optimisation
+    return devices
+
+
+def parse_size(value):
+    try:
+        width, height = map(int, value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got '{value}'")
+    return width, height
+
+
+def parse_device(value):
+    """INDEX or INDEX:GAIN."""
+    index, _, gain = value.partition(':')
+    try:
+        return int(index), float(gain) if gain else 1.0
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected INDEX or INDEX:GAIN, got '{value}'")
+
+
+def parse_region(value):
+    """X,Y,WIDTH,HEIGHT on the command line, a (left, top, right, bottom) bbox internally."""
+    try:
+        x, y, width, height = map(int, value.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected X,Y,WIDTH,HEIGHT, got '{value}'")
+    return x, y, x + width, y + height
+
+
+def parse_time(value):
+    """Seconds, MM:SS or HH:MM:SS, with optional fractions."""
+    try:
+        seconds = 0.0
+        for part in value.split(':'):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected SECONDS, MM:SS or HH:MM:SS, got '{value}'")
+    return seconds
+
+
+def add_audio_processing_arguments(parser):
+    parser.add_argument('--normalize', choices=('peak', 'rms'), help='normalize the audio level')
+    parser.add_argument('--target-db', type=float, help='normalization target in dBFS (default: -1 peak, -20 rms)')
+    parser.add_argument('--noise-gate', type=float, metavar='DB', help='mute audio below this level (dBFS)')
+    parser.add_argument('--mono', action='store_true', help='downmix the audio to mono')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='screen_audio_recorder', description='Screen and audio recorder.')
+    commands = parser.add_subparsers(dest='command')
+
+    commands.add_parser('gui', help='open the recorder window (default)')
+
+    devices = commands.add_parser('list-devices', help='list audio input devices')
+    devices.add_argument('--refresh', action='store_true', help='ignore the cached device list')
+
+    commands.add_parser('list-monitors', help='list monitors and their positions on the desktop')
+
+    record = commands.add_parser('record', help='record without a window until stopped',
+                                 description='Record the screen (and audio) until --duration has passed '
+                                             'or SIGINT/SIGTERM is received.')
+    record.add_argument('-o', '--output', help='output file (default: recording_<timestamp>.mp4)')
+    record.add_argument('-d', '--duration', type=float, help='stop after this many seconds')
+    record.add_argument('--fps', type=int, default=20)
+    record.add_argument('--region', type=parse_region, action='append', metavar='X,Y,WIDTH,HEIGHT',
+                        help='capture only this part of the screen; repeat to record several regions at once')
+    record.add_argument('--monitor', type=int, action='append', metavar='INDEX',
+                        help='capture this monitor (see list-monitors); repeat to record several')
+    record.add_argument('--all-monitors', action='store_true', help='capture every monitor')
+    record.add_argument('--tile', action='store_true',
+                        help='with several regions, stack them into one video as laid out on the desktop '
+                             '(default: one file per region, OUTPUT.N.mp4)')
+    record.add_argument('--resolution', type=parse_size, metavar='WIDTHxHEIGHT',
+                        help='scale frames to fit this size (default: capture size)')
+    record.add_argument('--codec', default='auto',
+                        help="ffmpeg video codec for single-pass encoding, an OpenCV fourcc (mp4v, avc1, H264, "
+                             "XVID, MJPG) for the OpenCV writer followed by a mux, or 'auto' for the fastest "
+                             "encoder measured on this machine that keeps up with the recording at --min-psnr "
+                             "(see probe-encoders; default: auto)")
+    record.add_argument('--preset', help='ffmpeg encoder preset (default: the measured one with --codec auto, '
+                                         'otherwise ultrafast)')
+    record.add_argument('--min-psnr', type=float, help='quality --codec auto has to reach, in dB (default: 35)')
+    record.add_argument('--crf', type=int, default=23)
+    record.add_argument('--vfr', action='store_true', help='drop unchanged frames (variable frame rate)')
+    record.add_argument('--encoder-process', action='store_true',
+                        help='encode in a separate process fed through shared memory')
+    record.add_argument('--chunk-workers', type=int, metavar='N',
+                        help='encode independent chunks in N processes in parallel, for 4K or high frame rates')
+    record.add_argument('--chunk-seconds', type=float, default=1.0,
+                        help='length of each --chunk-workers chunk, which is also the keyframe interval')
+    record.add_argument('--adaptive', action='store_true',
+                        help='lower the preset, frame rate and capture scale while the machine cannot keep up, '
+                             'and raise them again when it can')
+    record.add_argument('--fastest-preset', default='ultrafast', help='fastest preset --adaptive may switch to')
+    record.add_argument('--min-fps', type=float, help='lowest capture rate --adaptive may use (default: --fps)')
+    record.add_argument('--min-scale', type=float, default=1.0,
+                        help='smallest capture scale --adaptive may use, e.g. 0.5 (default: 1)')
+    record.add_argument('--source', help='frame source: xshm, mss, imagegrab or synthetic (default: fastest)')
+    record.add_argument('--audio-device', type=parse_device, action='append', metavar='INDEX[:GAIN]',
+                        help='audio input device (see list-devices); repeat to mix several, e.g. a '
+                             'microphone and a monitor of the speakers')
+    record.add_argument('--fake-audio', action='store_true', help='debugging: record generated tones instead of a sound card')
+    add_audio_processing_arguments(record)
+    record.add_argument('--no-audio', action='store_true', help='record video only')
+    record.add_argument('--pid-file', help='write the process id here while recording')
+    record.add_argument('--metrics-file', help='dump metrics here periodically, Prometheus text for .prom, '
+                                               'JSON otherwise')
+    record.add_argument('--metrics-interval', type=float, default=1.0, help='seconds between metrics dumps')
+    record.add_argument('--quiet', action='store_true', help='no live status line')
+    record.add_argument('--index', action='store_true',
+                        help='write a keyframe/scene index and a thumbnail strip next to the recording')
+
+    process = commands.add_parser('process-audio', help='clean up a finished audio file in one streaming pass')
+    process.add_argument('input')
+    process.add_argument('output', help='.wav, .m4a, .mp3, .flac, ...')
+    process.add_argument('--rate', type=int, default=44100)
+    add_audio_processing_arguments(process)
+    process.add_argument('--trim-silence', type=float, metavar='DB',
+                         help='drop leading and trailing audio below this level (dBFS)')
+
+    index = commands.add_parser('index', help='write the keyframe/scene index and thumbnail strip of a recording')
+    index.add_argument('input')
+    index.add_argument('--thumbnails', type=int, default=10, help='thumbnails in the strip, 0 for none')
+    index.add_argument('--scene-threshold', type=float, default=0.3,
+                       help='histogram difference (0-1) that counts as a scene change')
+    index.add_argument('--sample-fps', type=float,
+                       help='look for scene changes in this many frames per second (default: keyframes only)')
+
+    trim = commands.add_parser('trim', help='cut a clip out of a recording without re-encoding')
+    trim.add_argument('input')
+    trim.add_argument('output')
+    trim.add_argument('--start', type=parse_time, default=0.0, help='SECONDS or [HH:]MM:SS')
+    end = trim.add_mutually_exclusive_group()
+    end.add_argument('--end', type=parse_time, help='SECONDS or [HH:]MM:SS (default: end of the recording)')
+    end.add_argument('--duration', type=parse_time)
+    trim.add_argument('--snap', choices=('before', 'after'), default='before',
+                      help='start at the keyframe before --start (keeps everything asked for) or after it')
+
+    remux = commands.add_parser('remux', help='mux the audio and video files left by interrupted recordings')
+    remux.add_argument('directory')
+    remux.add_argument('-r', '--recursive', action='store_true', help='look in subdirectories too')
+    remux.add_argument('--output-dir', help='write the muxed files here (default: next to their inputs)')
+    remux.add_argument('-j', '--jobs', type=int, help='ffmpeg runs at a time (default: one per core)')
+    remux.add_argument('--video-codec', default='copy', help='re-encode the video with this codec (default: copy)')
+    remux.add_argument('--preset', default='veryfast', help='preset when re-encoding the video')
+    remux.add_argument('--crf', type=int, default=23)
+    remux.add_argument('--audio-codec', help='default: copy compressed audio, encode WAV to AAC')
+    remux.add_argument('--manifest', help='manifest of finished files (default: DIRECTORY/remux_manifest.json)')
+    remux.add_argument('--force', action='store_true', help='redo files the manifest shows as up to date')
+    remux.add_argument('--delete-inputs', action='store_true', help='remove the inputs of every muxed file')
+    remux.add_argument('-n', '--dry-run', action='store_true', help='only list what would be muxed')
+
+    probe = commands.add_parser('probe-encoders', help='measure the encoders available here and show the one '
+                                                       '--codec auto picks')
+    probe.add_argument('--refresh', action='store_true', help='measure again instead of using the cached results')
+    probe.add_argument('--resolution', type=parse_size, default=(1920, 1080), metavar='WIDTHxHEIGHT',
+                       help='recording size to pick an encoder for (default: 1920x1080)')
+    probe.add_argument('--fps', type=int, default=20)
+    probe.add_argument('--min-psnr', type=float, help='quality the encoder has to reach, in dB (default: 35)')
+
+    bench = commands.add_parser('benchmark', help='measure capture, encode and mux performance headless')
+    bench.add_argument('-o', '--output', default='benchmark.json', help='JSON results file')
+    bench.add_argument('--compare', metavar='JSON', help='report metrics that changed against earlier results')
+    bench.add_argument('--threshold', type=float, default=0.1, help='relative change worth reporting')
+    bench.add_argument('--resolutions', type=lambda v: [parse_size(s) for s in v.split(',')],
+                       help='comma separated WIDTHxHEIGHT list (default: 1280x720,1920x1080,2560x1440)')
+    bench.add_argument('--codecs', type=lambda v: v.split(','),
+                       help='comma separated, mp4v or ffmpeg codec:preset (default: mp4v,libx264:ultrafast,'
+                            'libx264:veryfast)')
+    bench.add_argument('--fps', type=int, default=30)
+    bench.add_argument('--seconds', type=float, default=5.0, help='length of each full recording')
+    bench.add_argument('--frames', type=int, default=60, help='frames per capture/convert/encode run')
+    bench.add_argument('--drift-seconds', type=float, default=3600.0, help='simulated length of the A/V drift run')
+    bench.add_argument('--no-xvfb', action='store_true', help='do not start Xvfb when there is no display')
+    return parser
+
+
+def list_devices(args):
+    for index, name in cached_audio_devices(refresh=args.refresh):
+        print(f"{index}\t{name}")
+    return 0
+
+
+def install_stop_handlers(stop_event):
+    def handler(signum, frame):
+        print(f"Received signal {signum}, stopping...", file=sys.stderr)
+        stop_event.set()
+
+    for name in ('SIGINT', 'SIGTERM', 'SIGBREAK', 'SIGHUP'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), handler)
+
+
+def list_monitors(args):
+    from frame_sources import list_monitors
+
+    for index, (left, top, right, bottom) in enumerate(list_monitors()):
+        print(f"{index}: {right - left}x{bottom - top} at {left},{top}")
+    return 0
+
+
+def record_bboxes(args):
+    """Every bbox asked for with --region, --monitor and --all-monitors."""
+    bboxes = list(args.region or [])
+    if args.monitor or args.all_monitors:
+        from frame_sources import list_monitors
+
+        monitors = list_monitors()
+        indexes = range(len(monitors)) if args.all_monitors else args.monitor
+        for index in indexes:
+            if not 0 <= index < len(monitors):
+                raise ValueError(f"there is no monitor {index} (found {len(monitors)})")
+            bboxes.append(monitors[index])
+    return bboxes
+
+
+def capture_sizes(args, bboxes):
+    """Frame sizes the recording will encode, one per region."""
+    from frame_sources import display_geometry, fit_resolution
+
+    if not bboxes:
+        try:
+            bboxes = [display_geometry()]
+        except Exception:
+            bboxes = [(0, 0, 1920, 1080)]  # No display; the synthetic source's size
+    return [fit_resolution((right - left, bottom - top), args.resolution) for left, top, right, bottom in bboxes]
+
+
+def resolve_codec(args, bboxes):
+    """Replace --codec auto with the encoder the probe picks for this recording, and fill in --preset."""
+    if args.codec != 'auto':
+        if args.preset is None:
+            args.preset = 'ultrafast'
+        return
+    from encoder_probe import DEFAULT_MIN_PSNR, load_probe, parse_encoder, select_encoder
+
+    results = load_probe(log=lambda message: print(message, file=sys.stderr))
+    pixel_rate = sum(width * height for width, height in capture_sizes(args, bboxes)) * args.fps
+    name = select_encoder(results, pixel_rate, args.min_psnr or DEFAULT_MIN_PSNR) or 'libx264:ultrafast'
+    args.codec, preset = parse_encoder(name)
+    # An explicit --preset is kept where it means the same thing
+    if args.preset is None or args.codec not in ('libx264', 'libx265'):
+        args.preset = preset
+    print(f"Encoder: {name}, picked for {pixel_rate / 1e6:.0f} Mpx/s from the encoders measured here",
+          file=sys.stderr)
+
+
+def record(args):
+    import datetime
+    import functools
+
+    from av_sync import SessionClock, SyncTrack, sync_filename
+    from encoder_probe import is_opencv
+    from metrics import MetricsDumper, MetricsRegistry, format_status
+    from muxing import mux_audio_video
+    from screen_recorder import ScreenRecorder
+    from video_encoders import FFmpegPipeEncoder, OpenCVVideoEncoder, SegmentedEncoder
+
+    if args.output is None:
+        args.output = f"recording_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.mp4"
+    base = args.output.rsplit('.', 1)[0]
+    with_audio = not args.no_audio
+    try:
+        bboxes = record_bboxes(args)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    resolve_codec(args, bboxes)
+    streaming = not is_opencv(args.codec)
+    writer = functools.partial(OpenCVVideoEncoder, fourcc=args.codec) if not streaming else None
+    multi = len(bboxes) > 1
+    region = bboxes[0] if bboxes else None
+    if (args.adaptive or args.chunk_workers) and multi:
+        print("--adaptive and --chunk-workers record a single region", file=sys.stderr)
+        return 1
+    # Preset and scale changes start a new encoder part, so adaptive recordings
+    # are encoded in parts (joined on release), as are chunked ones; the audio
+    # is muxed in afterwards
+    segmented = args.adaptive and not args.encoder_process
+    chunked = args.chunk_workers is not None
+    if segmented or chunked:
+        streaming = False
+
+    frame_source = None
+    if not multi:
+        from frame_sources import select_frame_source
+        try:
+            frame_source = select_frame_source(bbox=region, candidates=(args.source,) if args.source else None)
+        except OSError as e:
+            print(e, file=sys.stderr)
+            return 1
+
+    session = SessionClock()
+    sync = SyncTrack(44100) if with_audio else SyncTrack()
+    metrics = MetricsRegistry()
+    sync_args = {'session': session, 'sync': sync, 'metrics': metrics}
+    video_file = args.output if streaming or not with_audio else f"{base}.video.mp4"
+    audio_file = f"{base}.audio.m4a"
+
+    if multi:
+        # Every region is encoded on its own; audio goes to a file and is muxed in afterwards
+        from multi_capture import CaptureRegion, MultiRegionRecorder, tile_layout
+        if args.tile:
+            sizes = [(width, height) for _, _, width, height in tile_layout(bboxes, args.resolution)]
+        else:
+            sizes = [args.resolution] * len(bboxes)
+        regions = [CaptureRegion(bbox, f"{base}.{n}.video.mp4" if with_audio or args.tile else f"{base}.{n}.mp4",
+                                 size) for n, (bbox, size) in enumerate(zip(bboxes, sizes))]
+        encoder_factory = writer
+        if streaming:
+            encoder_factory = functools.partial(FFmpegPipeEncoder, codec=args.codec, preset=args.preset,
+                                                crf=args.crf, vfr=args.vfr)
+        screen_recorder = MultiRegionRecorder(regions, args.fps, source=args.source, encoder_factory=encoder_factory,
+                                              detect_damage=args.vfr, session=session, metrics=metrics)
+        streaming = False
+    else:
+        if streaming:
+            encoder_factory = functools.partial(FFmpegPipeEncoder, codec=args.codec, preset=args.preset,
+                                                crf=args.crf, vfr=args.vfr, audio_rate=44100 if with_audio else None,
+                                                audio_channels=1 if args.mono else 2)
+        elif segmented or chunked:
+            inner = writer
+            if inner is None:
+                # x264 threads itself; with chunks in parallel every worker gets a share of the cores
+                threads = max(1, (os.cpu_count() or 1) // args.chunk_workers) if chunked else None
+                inner = functools.partial(FFmpegPipeEncoder, codec=args.codec, preset=args.preset, crf=args.crf,
+                                          vfr=args.vfr, threads=threads)
+            if chunked:
+                from chunked_encoder import ChunkedEncoder
+                inner = functools.partial(ChunkedEncoder, workers=args.chunk_workers,
+                                          chunk_seconds=args.chunk_seconds, encoder_factory=inner)
+            encoder_factory = inner
+            if segmented:
+                encoder_factory = functools.partial(SegmentedEncoder, segment_seconds=None, encoder_factory=inner)
+        else:
+            encoder_factory = writer
+        screen_recorder = ScreenRecorder(args.resolution, args.fps, video_file, frame_source=frame_source,
+                                         encoder_factory=encoder_factory, detect_damage=args.vfr,
+                                         region=region, encoder_process=args.encoder_process, **sync_args)
+    controller = None
+    if args.adaptive:
+        from adaptive import AdaptiveController
+        controller = AdaptiveController(screen_recorder, min_fps=args.min_fps, min_scale=args.min_scale,
+                                        preset=args.preset, fastest_preset=args.fastest_preset,
+                                        log=lambda message: print(message, file=sys.stderr))
+
+    audio_recorder = None
+    if with_audio:
+        if args.fake_audio:
+            import fake_audio as backend
+        else:
+            import pyaudio as backend
+        from audio_recorder import AudioRecorder
+        processor = None
+        if args.normalize or args.noise_gate is not None or args.mono:
+            from audio_processing import AudioProcessor
+            processor = AudioProcessor(44100, 2, normalize=args.normalize, target_db=args.target_db,
+                                       noise_gate_db=args.noise_gate, out_channels=1 if args.mono else None)
+        sink = screen_recorder.out.audio_sink if streaming else None
+        audio_recorder = AudioRecorder(backend.paInt16, 2, 44100, 1024, audio_file, sink=sink,
+                                       devices=args.audio_device, backend=backend, processor=processor,
+                                       **sync_args)
+
+    stop_event = threading.Event()
+    install_stop_handlers(stop_event)
+    if args.pid_file:
+        with open(args.pid_file, 'w') as f:
+            f.write(f"{os.getpid()}\n")
+
+    dumper = MetricsDumper(metrics, args.metrics_file, args.metrics_interval) if args.metrics_file else None
+    show_status = not args.quiet and sys.stderr.isatty()
+    try:
+        if multi:
+            # Starts the session clock once every region is open
+            try:
+                screen_recorder.start()
+            except RuntimeError as e:
+                print(e, file=sys.stderr)
+                return 1
+            if audio_recorder is not None:
+                audio_recorder.start()
+        else:
+            session.start()
+            if audio_recorder is not None:
+                audio_recorder.start()
+            screen_recorder.start()
+        if controller is not None:
+            controller.start()
+        if dumper is not None:
+            dumper.start()
+        print(f"Recording to {args.output}; press Ctrl+C or send SIGTERM to stop", file=sys.stderr)
+        previous, next_status = None, time.monotonic() + 1.0
+        # Waiting on the event (not join) keeps the main thread free to run signal handlers
+        while not stop_event.wait(0.25):
+            if args.duration is not None and session.now() >= args.duration:
+                break
+            if multi:
+                screen_recorder.poll()
+            if not screen_recorder.is_alive():
+                break
+            if show_status and time.monotonic() >= next_status:
+                snapshot = metrics.snapshot()
+                print(f"\r\033[K{format_status(snapshot, previous)}", end='', file=sys.stderr, flush=True)
+                previous, next_status = snapshot, next_status + 1.0
+        if show_status:
+            print(file=sys.stderr)
+    finally:
+        if controller is not None:
+            controller.stop()
+        if audio_recorder is not None:
+            audio_recorder.stop()
+        screen_recorder.stop()
+        if audio_recorder is not None:
+            audio_recorder.join()
+        screen_recorder.join()
+        if dumper is not None:
+            dumper.stop()
+            dumper.join()
+        if args.pid_file:
+            os.remove(args.pid_file)
+
+    if multi:
+        # One audio track for all regions, which share the frame grid
+        sync.mark_video_start(screen_recorder.video_start())
+    sync.save(sync_filename(args.output))
+    if controller is not None:
+        print(controller.format_summary())
+    if multi:
+        print(screen_recorder.format_stats())
+        return finish_regions(args, regions, audio_file if with_audio else None, sync)
+    if not screen_recorder.succeeded or not os.path.exists(video_file):
+        kept = f"; the audio is kept in {audio_file}" if with_audio and not streaming else ""
+        print(f"Recording failed, {video_file} was not written{kept}", file=sys.stderr)
+        return 1
+    if streaming or not with_audio:
+        print(f"Recording saved as {args.output}")
+        return finish_index(args)
+
+    result = mux_audio_video(video_file, audio_file, args.output, sync=sync)
+    if result != 0:
+        print(f"Combining audio and video failed with code {result}; kept {video_file} and {audio_file}",
+              file=sys.stderr)
+        return 1
+    for file in (video_file, audio_file):
+        os.remove(file)
+    print(f"Recording saved as {args.output}")
+    return finish_index(args)
+
+
+def finish_index(args, files=None):
+    """Index the finished recordings if --index asked for it; a failed index does not fail the recording."""
+    if args.index:
+        for file in files or [args.output]:
+            index_recording(argparse.Namespace(input=file, thumbnails=10, scene_threshold=0.3, sample_fps=None))
+    return 0
+
+
+def finish_regions(args, regions, audio_file, sync):
+    """Tile the region videos into the output, or mux the audio into each of them."""
+    from encoder_probe import is_opencv
+    from muxing import mux_audio_video, tile_videos
+    from multi_capture import tile_layout
+
+    video_files = [region.filename for region in regions]
+    base = args.output.rsplit('.', 1)[0]
+    if args.tile:
+        positions = [(x, y) for x, y, _, _ in tile_layout([region.bbox for region in regions], args.resolution)]
+        codec = args.codec if not is_opencv(args.codec) else 'libx264'
+        result = tile_videos(video_files, positions, args.output, audio_file, sync=sync, codec=codec,
+                             preset=args.preset, crf=args.crf)
+        if result != 0:
+            print(f"Tiling failed with code {result}; kept {', '.join(video_files)}", file=sys.stderr)
+            return 1
+        outputs = [args.output]
+    elif audio_file is not None:
+        outputs = []
+        for n, video_file in enumerate(video_files):
+            output = f"{base}.{n}.mp4"
+            result = mux_audio_video(video_file, audio_file, output, sync=sync)
+            if result != 0:
+                print(f"Combining audio and video failed with code {result}; kept {video_file} and {audio_file}",
+                      file=sys.stderr)
+                return 1
+            outputs.append(output)
+    else:
+        print(f"Recordings saved as {', '.join(video_files)}")
+        return finish_index(args, video_files)
+    for file in video_files + ([audio_file] if audio_file else []):
+        os.remove(file)
+    print(f"Recording{'s' if len(outputs) > 1 else ''} saved as {', '.join(outputs)}")
+    return finish_index(args, outputs)
+
+
+def process_audio(args):
+    from audio_processing import process_audio_file
+
+    process_audio_file(args.input, args.output, rate=args.rate, normalize=args.normalize,
+                       target_db=args.target_db, noise_gate_db=args.noise_gate,
+                       trim_silence_db=args.trim_silence, out_channels=1 if args.mono else None)
+    print(f"Processed audio saved as {args.output}")
+    return 0
+
+
+def index_recording(args):
+    from recording_index import build_index, index_filename
+
+    try:
+        index = build_index(args.input, thumbnails=args.thumbnails, scene_threshold=args.scene_threshold,
+                            sample_fps=args.sample_fps)
+    except (OSError, ValueError) as e:
+        print(f"Indexing {args.input} failed: {e}", file=sys.stderr)
+        return 1
+    print(f"{len(index['keyframes'])} keyframes, {len(index['scenes'])} scene changes; "
+          f"index saved as {index_filename(args.input)}")
+    return 0
+
+
+def trim(args):
+    from recording_index import trim as trim_recording
+
+    end = args.start + args.duration if args.duration is not None else args.end
+    try:
+        result, start = trim_recording(args.input, args.output, args.start, end, snap=args.snap)
+    except (OSError, ValueError) as e:
+        print(f"Trimming {args.input} failed: {e}", file=sys.stderr)
+        return 1
+    if result != 0:
+        print(f"Trimming failed with code {result}", file=sys.stderr)
+        return 1
+    print(f"Clip from {start:.3f} s saved as {args.output}")
+    return 0
+
+
+def remux(args):
+    from batch_remux import MANIFEST_NAME, find_pairs, format_summary, remux_all, remux_options, split_up_to_date
+
+    if not os.path.isdir(args.directory):
+        print(f"{args.directory} is not a directory", file=sys.stderr)
+        return 1
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    jobs = find_pairs(args.directory, recursive=args.recursive, output_dir=args.output_dir)
+    if not jobs:
+        print(f"No audio/video pairs found in {args.directory}")
+        return 0
+    manifest = args.manifest or os.path.join(args.directory, MANIFEST_NAME)
+    if args.dry_run:
+        options = remux_options(args.video_codec, args.preset, args.crf, args.audio_codec)
+        _, current = split_up_to_date(jobs, manifest, options, args.force)
+        for job in jobs:
+            state = 'up to date' if job in current else 'to mux'
+            print(f"{job.video} + {job.audio} -> {job.output} ({state})")
+        return 0
+    summary = remux_all(jobs, manifest, workers=args.jobs, video_codec=args.video_codec, preset=args.preset,
+                        crf=args.crf, audio_codec=args.audio_codec, force=args.force,
+                        delete_inputs=args.delete_inputs)
+    print(format_summary(summary))
+    return 1 if summary['failed'] else 0
+
+
+def benchmark(args):
+    import benchmark as bench
+
+    options = {}
+    if args.resolutions:
+        options['resolutions'] = args.resolutions
+    if args.codecs:
+        options['codecs'] = args.codecs
+    log = lambda message: print(message, file=sys.stderr)
+    results = bench.run_suite(fps=args.fps, seconds=args.seconds, frames=args.frames,
+                              drift_seconds=args.drift_seconds, use_xvfb=not args.no_xvfb, log=log, **options)
+    bench.save_results(results, args.output)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        changes = bench.compare(bench.load_results(args.compare), results, args.threshold)
+        for name, before, after, change in changes:
+            print(f"{name}: {before:.4g} -> {after:.4g} ({change:+.0%})")
+        if not changes:
+            print(f"No metric changed by more than {args.threshold:.0%}")
+    return 0
+
+
+def probe_encoders(args):
+    from encoder_probe import DEFAULT_MIN_PSNR, format_result, load_probe, select_encoder
+
+    results = None if args.refresh else load_probe(probe=False)
+    if results is None:
+        print("Measuring the encoders available here...", file=sys.stderr)
+        results = load_probe(refresh=True, log=None)
+    # Fastest first, unavailable ones last
+    for name in sorted(results, key=lambda name: -results[name].get('pixels_per_second', 0.0)):
+        print(format_result(name, results[name]))
+    width, height = args.resolution
+    selected = select_encoder(results, width * height * args.fps, args.min_psnr or DEFAULT_MIN_PSNR)
+    if selected is None:
+        print("No encoder works here", file=sys.stderr)
+        return 1
+    print(f"--codec auto picks {selected} for {width}x{height} at {args.fps} fps")
+    return 0
+
+
+def gui(args):
+    import main as gui_main
+    gui_main.main()
+
+
+COMMANDS = {
+    None: gui,
+    'gui': gui,
+    'list-devices': list_devices,
+    'list-monitors': list_monitors,
+    'record': record,
+    'process-audio': process_audio,
+    'index': index_recording,
+    'trim': trim,
+    'remux': remux,
+    'probe-encoders': probe_encoders,
+    'benchmark': benchmark,
+}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return COMMANDS[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Damage detection: which parts of the screen changed since the previous frame.
+
+Rows are compared as packed 64-bit words (every `stride`-th row, all rows by
+default) and the per-word differences are reduced to a grid of tiles, all in
+NumPy, so the check costs a small fraction of an encode.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+DamageStats = namedtuple('DamageStats', ['changed', 'dirty_tiles', 'total_tiles', 'dirty_fraction', 'bbox'])
+
+
+class DamageDetector:
+    def __init__(self, tile_size=64, stride=1):
+        if tile_size % 8 or tile_size % stride:
+            raise ValueError("tile_size must be a multiple of 8 and of stride")
+        self.tile_size = tile_size
+        self.stride = stride
+        self._previous = None
+        self._mask = None
+        self._rows = self._cols = None
+        self._tile_rows = None
+        self._tiles = None
+        self.frames = 0
+        self.unchanged = 0
+        self.dirty_sum = 0.0
+        self.last = None
+
+    def reset(self):
+        self._previous = None
+
+    def _words(self, frame):
+        rows = frame[::self.stride]
+        packed = rows.reshape(rows.shape[0], -1)
+        # Compare 8 bytes at a time when the row length allows it
+        if packed.shape[1] % 8 == 0 and packed.strides[1] == 1:
+            return packed.view(np.uint64), 8
+        return packed, 1
+
+    def update(self, frame):
+        """Compare `frame` with the previous one and return a DamageStats."""
+        words, word_size = self._words(frame)
+        if self._previous is None or self._previous.shape != words.shape:
+            # (Re)allocate every working buffer once per frame size
+            channels = frame.shape[2] if frame.ndim == 3 else 1
+            self._rows = np.arange(0, words.shape[0], self.tile_size // self.stride)
+            self._cols = np.arange(0, words.shape[1], self.tile_size * channels // word_size)
+            self._previous = words.copy()
+            self._mask = np.empty(words.shape, dtype=bool)
+            self._tile_rows = np.empty((len(self._rows), words.shape[1]), dtype=bool)
+            self._tiles = np.empty((len(self._rows), len(self._cols)), dtype=bool)
+            total = self._tiles.size
+            stats = DamageStats(True, total, total, 1.0, (0, 0, frame.shape[1], frame.shape[0]))
+            return self._record(stats)
+
+        total = self._tiles.size
+        np.not_equal(words, self._previous, out=self._mask)
+        np.logical_or.reduceat(self._mask, self._rows, axis=0, out=self._tile_rows)
+        tiles = np.logical_or.reduceat(self._tile_rows, self._cols, axis=1, out=self._tiles)
+        dirty = int(np.count_nonzero(tiles))
+        if not dirty:
+            return self._record(DamageStats(False, 0, total, 0.0, None))
+
+        np.copyto(self._previous, words)
+        dirty_rows = np.flatnonzero(tiles.any(axis=1))
+        dirty_cols = np.flatnonzero(tiles.any(axis=0))
+        bbox = (int(dirty_cols[0]) * self.tile_size, int(dirty_rows[0]) * self.tile_size,
+                min(frame.shape[1], (int(dirty_cols[-1]) + 1) * self.tile_size),
+                min(frame.shape[0], (int(dirty_rows[-1]) + 1) * self.tile_size))
+        return self._record(DamageStats(True, dirty, total, dirty / total, bbox))
+
+    def _record(self, stats):
+        self.frames += 1
+        if not stats.changed:
+            self.unchanged += 1
+        self.dirty_sum += stats.dirty_fraction
+        self.last = stats
+        return stats
+
+    def summary(self):
+        return {
+            'frames': self.frames,
+            'unchanged': self.unchanged,
+            'mean_dirty_fraction': self.dirty_sum / self.frames if self.frames else 0.0,
+        }
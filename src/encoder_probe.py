@@ -0,0 +1,334 @@
+"""
+Encoder capability probe.
+
+Which encoders work differs from one machine to the next. OpenCV's writer
+depends on how OpenCV was built. ffmpeg's depend on the binary's
+configuration and on the hardware: static builds list h264_nvenc, but it
+only opens with an NVIDIA GPU. probe_encoders() takes the candidates that
+are present and encodes a short clip of synthetic screen content with each:
+text scrolling over a gradient. It measures the encode rate and the quality,
+as PSNR against the source frames after decoding the clip back with OpenCV.
+An ffmpeg encoder that fails to open or to encode is recorded with its
+error. OpenCV's fourccs (mp4v, avc1, H264, XVID, MJPG) depend on how OpenCV
+was built and on the container: for an .mp4 OpenCV quietly writes mp4v in
+place of a tag the container does not take, whatever the codec. The probe
+reads the tag back from the clip's sample description, and a fourcc that
+fails or was replaced is left out of the results.
+
+The results are cached on disk. The key combines the ffmpeg binary's
+SHA-256, the OpenCV version and the CPU, so the probe runs once per machine
+and again whenever ffmpeg is replaced. The binary is only hashed again when
+its size or modification time changes.
+
+select_encoder() picks the fastest encoder that reaches a minimum PSNR and
+encodes the recording's pixel rate with headroom to spare. Encoders are
+named as in the benchmark: the fourcc (e.g. 'mp4v') for the OpenCV writer,
+'codec:preset' (or just 'codec') for ffmpeg.
+"""
+import functools
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from app_cache import cache_dir
+
+CACHE_VERSION = 3
+
+# Fourccs of the OpenCV writer worth trying; mp4v works with every build
+OPENCV_FOURCCS = ('mp4v', 'avc1', 'H264', 'XVID', 'MJPG')
+
+# Probed in this order, which also breaks ties. VAAPI and QSV encoders are left
+# out: they need frames uploaded to the GPU, which the pipe encoder does not do.
+CANDIDATES = (
+    'libx264:ultrafast',
+    'libx264:superfast',
+    'libx264:veryfast',
+    'h264_nvenc:p1',
+    'h264_amf',
+    'h264_videotoolbox',
+    'mpeg4',
+) + OPENCV_FOURCCS
+
+PROBE_SIZE = (1280, 720)
+PROBE_FRAMES = 60
+DEFAULT_MIN_PSNR = 35.0  # dB
+# The encoder gets at most this share of the time; capture and audio need the rest
+DEFAULT_HEADROOM = 1.5
+
+
+def parse_encoder(name):
+    """(codec, preset) of an encoder name; the preset is None when not given."""
+    codec, _, preset = name.partition(':')
+    return codec, preset or None
+
+
+def is_opencv(name):
+    """Whether `name` is an OpenCV writer fourcc rather than an ffmpeg encoder."""
+    return name in OPENCV_FOURCCS
+
+
+def make_encoder_factory(name, **options):
+    """
+    encoder_factory(filename, fps, size) for the encoder called `name`; a
+    partial rather than a closure, so it can be sent to an encoder process.
+    `options` go to FFmpegPipeEncoder and are ignored for the OpenCV writer.
+    """
+    from video_encoders import FFmpegPipeEncoder, OpenCVVideoEncoder
+    if is_opencv(name):
+        return functools.partial(OpenCVVideoEncoder, fourcc=name)
+    codec, preset = parse_encoder(name)
+    return functools.partial(FFmpegPipeEncoder, codec=codec, preset=preset, **options)
+
+
+def ffmpeg_encoders(ffmpeg='ffmpeg'):
+    """Names of the video encoders `ffmpeg` was built with; empty if it cannot be run."""
+    try:
+        result = subprocess.run([ffmpeg, '-hide_banner', '-encoders'], stdin=subprocess.DEVNULL,
+                                capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return set()
+    encoders = set()
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        # ' V....D libx264   libx264 H.264 ...', after a legend that ends with ' ------'
+        if len(fields) >= 2 and len(fields[0]) == 6 and fields[0].startswith('V'):
+            encoders.add(fields[1])
+    return encoders
+
+
+def _cpu_name():
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/cpuinfo') as f:
+                for line in f:
+                    if line.startswith('model name'):
+                        return line.split(':', 1)[1].strip()
+        except OSError:
+            pass
+    elif sys.platform == 'darwin':
+        try:
+            return subprocess.run(['sysctl', '-n', 'machdep.cpu.brand_string'], capture_output=True,
+                                  text=True).stdout.strip()
+        except OSError:
+            pass
+    return platform.processor() or platform.machine()
+
+
+def binary_hash(path, known=None):
+    """
+    SHA-256 of the file at `path`. `known` maps paths to earlier results with
+    the file's size and mtime, and is updated; the file is only read again
+    when those changed.
+    """
+    stat = os.stat(path)
+    signature = [stat.st_size, stat.st_mtime_ns]
+    if known is not None and known.get(path, {}).get('signature') == signature:
+        return known[path]['sha256']
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    if known is not None:
+        known[path] = {'signature': signature, 'sha256': digest.hexdigest()}
+    return digest.hexdigest()
+
+
+def probe_key(ffmpeg='ffmpeg', known=None):
+    """Cache key of the probe results: ffmpeg binary, OpenCV version and CPU."""
+    import cv2
+    path = shutil.which(ffmpeg)
+    binary = binary_hash(os.path.realpath(path), known) if path else 'no ffmpeg'
+    return f"{binary} opencv-{cv2.__version__} {_cpu_name()} x{os.cpu_count()}"
+
+
+def probe_frames(size, count=8):
+    """`count` frames of text scrolling over a gradient, closer to a screen than a plain test pattern."""
+    import cv2
+    from frame_sources import SyntheticFrameSource
+    width, height = size
+    background = SyntheticFrameSource((0, 0, width, height)).grab().copy()
+    # An editor-like panel over the left two thirds
+    background[:, :width * 2 // 3] = (40, 40, 40)
+    line_height = 20
+    frames = []
+    for n in range(count):
+        frame = background.copy()
+        offset = n * 6
+        for row in range(-1, height // line_height + 1):
+            y = row * line_height - offset % line_height + line_height
+            line = row + offset // line_height
+            text = f"{line:4d}  def encode(frame, preset='ultrafast', crf=23):  # {line * 7919 % 1000:03d}"
+            cv2.putText(frame, text, (8, y), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (230, 230, 230), 1, cv2.LINE_AA)
+        frames.append(frame)
+    return frames
+
+
+def _decoded_psnr(filename, clips, frames):
+    """Mean PSNR of the first `frames` decoded frames against the clips they were encoded from."""
+    import cv2
+    capture = cv2.VideoCapture(filename)
+    values = []
+    try:
+        for n in range(frames):
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if frame.shape != clips[0].shape:
+                return None
+            values.append(cv2.PSNR(frame, clips[n % len(clips)]))
+    finally:
+        capture.release()
+    return sum(values) / len(values) if values else None
+
+
+def written_fourcc(filename):
+    """
+    The sample entry tag of the first track in the MP4/MOV file `filename`
+    (e.g. 'mp4v' or 'avc1'), or None if there is no sample description.
+    OpenCV's CAP_PROP_FOURCC names the decoder instead, so it cannot tell.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    # 'stsd', version and flags, entry count, size of the first entry, then its tag
+    index = data.find(b'stsd')
+    if index < 0 or len(data) < index + 20:
+        return None
+    return data[index + 16:index + 20].decode('latin-1')
+
+
+def measure_encoder(name, directory, size=PROBE_SIZE, frames=PROBE_FRAMES, fps=30, ffmpeg='ffmpeg', clips=None):
+    """Encode rate and quality of one encoder, or {'error': ...} if it does not work here."""
+    clips = clips or probe_frames(size)
+    filename = os.path.join(directory, f"probe_{name.replace(':', '_')}.mp4")
+    start = time.perf_counter()
+    try:
+        encoder = make_encoder_factory(name, ffmpeg=ffmpeg)(filename, fps, size)
+    except Exception as e:
+        return {'error': str(e) or type(e).__name__}
+    error = None
+    try:
+        for n in range(frames):
+            encoder.write(clips[n % len(clips)])
+    except OSError as e:
+        # Usually a broken pipe: ffmpeg could not open the encoder, and its exit code says more
+        error = str(e)
+    finally:
+        result = encoder.release()
+    elapsed = time.perf_counter() - start
+    if result:
+        return {'error': f"encoder exited with code {result}"}
+    if error is not None:
+        return {'error': error}
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        return {'error': 'no output written'}
+    if is_opencv(name) and written_fourcc(filename) != name:
+        return {'error': f"OpenCV wrote '{written_fourcc(filename)}' in its place"}
+    psnr = _decoded_psnr(filename, clips, frames)
+    return {
+        'fps': frames / elapsed,
+        'pixels_per_second': frames * size[0] * size[1] / elapsed,
+        'psnr': round(psnr, 2) if psnr is not None else None,
+        'bytes': os.path.getsize(filename),
+    }
+
+
+def probe_encoders(ffmpeg='ffmpeg', candidates=CANDIDATES, progress=None, log=print):
+    """
+    {name: measure_encoder() result} for the candidates present in OpenCV and
+    `ffmpeg`. OpenCV fourccs that fail are left out.
+    """
+    available = ffmpeg_encoders(ffmpeg)
+    present = [name for name in candidates if is_opencv(name) or parse_encoder(name)[0] in available]
+    clips = probe_frames(PROBE_SIZE)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='encoder_probe_') as directory:
+        for n, name in enumerate(present):
+            result = measure_encoder(name, directory, ffmpeg=ffmpeg, clips=clips)
+            if 'error' not in result or not is_opencv(name):
+                results[name] = result
+            if log is not None:
+                log(format_result(name, result))
+            if progress is not None:
+                progress((n + 1) / len(present))
+    return results
+
+
+def cache_file():
+    return os.path.join(cache_dir(), 'encoders.json')
+
+
+def _load_cache(filename):
+    try:
+        with open(filename) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if cache.get('version') == CACHE_VERSION else {}
+
+
+def _save_cache(filename, cache):
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        partial = f"{filename}.partial"
+        with open(partial, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.replace(partial, filename)
+    except OSError:
+        pass  # Read-only home, the cache is only an optimisation
+
+
+def load_probe(ffmpeg='ffmpeg', refresh=False, probe=True, filename=None, progress=None, log=print):
+    """
+    Probe results for the current ffmpeg binary and CPU, from the cache when
+    they are there. Otherwise (or with `refresh`) the encoders are probed and
+    the results cached, unless `probe` is False, which returns None instead.
+    """
+    filename = filename or cache_file()
+    cache = _load_cache(filename)
+    binaries = cache.setdefault('binaries', {})
+    key = probe_key(ffmpeg, binaries)
+    probes = cache.setdefault('probes', {})
+    if not refresh and key in probes:
+        return probes[key]['results']
+    if not probe:
+        _save_cache(filename, dict(cache, version=CACHE_VERSION))
+        return None
+    if log is not None:
+        log(f"Measuring encoders for {key}")
+    results = probe_encoders(ffmpeg, progress=progress, log=log)
+    probes[key] = {'time': time.time(), 'ffmpeg': shutil.which(ffmpeg), 'results': results}
+    _save_cache(filename, dict(cache, version=CACHE_VERSION))
+    return results
+
+
+def select_encoder(results, pixel_rate, min_psnr=DEFAULT_MIN_PSNR, headroom=DEFAULT_HEADROOM):
+    """
+    Name of the fastest encoder in `results` that reaches `min_psnr` and
+    encodes `pixel_rate` (width * height * fps of the recording) `headroom`
+    times over. If none qualifies, the fastest one that is quick enough, and
+    failing that the fastest one; None if no encoder works at all.
+    """
+    working = {name: result for name, result in results.items() if 'error' not in result}
+    if not working:
+        return None
+
+    def fastest(names):
+        return max(names, key=lambda name: working[name]['pixels_per_second'], default=None)
+
+    quick = [name for name, result in working.items() if result['pixels_per_second'] >= pixel_rate * headroom]
+    good = [name for name in quick if (working[name]['psnr'] or 0.0) >= min_psnr]
+    return fastest(good) or fastest(quick) or fastest(working)
+
+
+def format_result(name, result):
+    if 'error' in result:
+        return f"{name:20} unavailable: {result['error']}"
+    psnr = f"{result['psnr']:.1f} dB" if result['psnr'] is not None else 'quality unknown'
+    return (f"{name:20} {result['fps']:6.0f} fps at {PROBE_SIZE[0]}x{PROBE_SIZE[1]} "
+            f"({result['pixels_per_second'] / 1e6:.0f} Mpx/s), {psnr}, {result['bytes'] / 1e3:.0f} kB")
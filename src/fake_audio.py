@@ -0,0 +1,160 @@
+"""
+Stand-in for the `pyaudio` module: the same constants and the parts of the
+PyAudio/Stream API the recorder uses, backed by tone generators instead of a
+sound card. Pass it as AudioRecorder(backend=fake_audio) to record, test or
+benchmark audio on machines without PyAudio or audio hardware.
+
+Streams opened with a stream_callback are driven by a thread at real-time pace,
+like PortAudio's callback thread; every `overflow_every`-th callback carries
+the paInputOverflow flag and skips a buffer, as an overrunning device would,
+and every `underflow_every`-th one carries paInputUnderflow. After `lost_after`
+callbacks the device stops delivering, as if it had been unplugged.
+"""
+import threading
+import time
+
+import numpy as np
+
+paFloat32 = 1
+paInt32 = 2
+paInt16 = 8
+
+paContinue = 0
+paComplete = 1
+
+paInputUnderflow = 1
+paInputOverflow = 2
+
+_SAMPLE_SIZES = {paFloat32: 4, paInt32: 4, paInt16: 2}
+
+
+def get_sample_size(format):
+    return _SAMPLE_SIZES[format]
+
+
+class FakeDevice:
+    def __init__(self, name, rate=44100, channels=2, frequency=440.0, amplitude=0.25, overflow_every=None,
+                 underflow_every=None, lost_after=None):
+        self.name = name
+        self.rate = rate
+        self.channels = channels
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.overflow_every = overflow_every
+        self.underflow_every = underflow_every
+        self.lost_after = lost_after
+
+    def info(self, index):
+        return {
+            'index': index,
+            'name': self.name,
+            'maxInputChannels': self.channels,
+            'maxOutputChannels': 0,
+            'defaultSampleRate': float(self.rate),
+            'defaultLowInputLatency': 0.01,
+        }
+
+
+# The devices every FakePyAudio() sees unless it is given its own list
+DEFAULT_DEVICES = [
+    FakeDevice('Fake Microphone', rate=44100, channels=1, frequency=440.0),
+    FakeDevice('Fake Monitor of Speakers', rate=48000, channels=2, frequency=660.0),
+]
+
+
+class FakeStream:
+    def __init__(self, device, format, channels, rate, frames_per_buffer, stream_callback=None):
+        if format != paInt16:
+            raise ValueError("The fake device only produces paInt16")
+        self.device = device
+        self.channels = channels
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+        self.callback = stream_callback
+        self._position = 0
+        self._calls = 0
+        self._active = False
+        self._thread = None
+        if stream_callback is not None:
+            self.start_stream()
+
+    def _generate(self, frames):
+        t = (self._position + np.arange(frames)) / self.rate
+        self._position += frames
+        tone = np.sin(2 * np.pi * self.device.frequency * t) * (self.device.amplitude * 32767)
+        return np.repeat(tone.astype(np.int16)[:, None], self.channels, axis=1).tobytes()
+
+    def _run(self):
+        interval = self.frames_per_buffer / self.rate
+        deadline = time.monotonic()
+        while self._active:
+            deadline += interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if self.device.lost_after is not None and self._calls >= self.device.lost_after:
+                # Unplugged: PortAudio stops calling back and the stream goes inactive
+                self._active = False
+                break
+            self._calls += 1
+            status = 0
+            if self.device.overflow_every and self._calls % self.device.overflow_every == 0:
+                self._generate(self.frames_per_buffer)  # The lost buffer
+                status = paInputOverflow
+            if self.device.underflow_every and self._calls % self.device.underflow_every == 0:
+                status |= paInputUnderflow
+            data = self._generate(self.frames_per_buffer)
+            _, flag = self.callback(data, self.frames_per_buffer, {'current_time': time.monotonic()}, status)
+            if flag != paContinue:
+                self._active = False
+
+    def read(self, num_frames, exception_on_overflow=True):
+        time.sleep(num_frames / self.rate)
+        return self._generate(num_frames)
+
+    def get_read_available(self):
+        return 0
+
+    def get_input_latency(self):
+        return 0.01
+
+    def is_active(self):
+        return self._active
+
+    def start_stream(self):
+        if self.callback is None or self._active:
+            return
+        self._active = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop_stream(self):
+        self._active = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop_stream()
+
+
+class PyAudio:
+    def __init__(self, devices=None):
+        self.devices = list(DEFAULT_DEVICES if devices is None else devices)
+
+    def get_device_count(self):
+        return len(self.devices)
+
+    def get_device_info_by_index(self, index):
+        return self.devices[index].info(index)
+
+    def get_default_input_device_info(self):
+        return self.get_device_info_by_index(0)
+
+    def open(self, rate, channels, format, input=False, output=False, input_device_index=None,
+             frames_per_buffer=1024, stream_callback=None, **kwargs):
+        device = self.devices[input_device_index or 0]
+        return FakeStream(device, format, channels, rate, frames_per_buffer, stream_callback)
+
+    def terminate(self):
+        pass
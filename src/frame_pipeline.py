@@ -0,0 +1,369 @@
+"""
+Capture/encode pipeline for ScreenRecorder.
+
+The capture thread grabs each frame straight into one of a bounded ring of
+preallocated slots and one or more encoder workers drain it, so a slow
+encode no longer eats into the capture interval. In the steady state no
+frame-sized buffer is allocated anywhere between grab and encoder.
+"""
+import collections
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from metrics import MetricsRegistry
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+def _resize_into(src, dst):
+    height, width = dst.shape[:2]
+    # Linear is fine (and several times faster) down to half size, beyond that
+    # only INTER_AREA keeps text from aliasing
+    interpolation = cv2.INTER_AREA if width * 2 < src.shape[1] else cv2.INTER_LINEAR
+    cv2.resize(src, (width, height), dst=dst, interpolation=interpolation)
+
+
+class FrameRing:
+    """
+    Fixed number of preallocated frame slots cycling between three states:
+    free (capture may fill it), ready (waiting for an encoder) and taken
+    (being encoded). Every ready entry carries how many output frames it
+    stands for, so dropping a frame never shortens the recording. An entry
+    whose index is None repeats the last frame that was written.
+    """
+
+    def __init__(self, capacity, shape, dtype=np.uint8, policy=DROP_OLDEST):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {policy}")
+        if capacity < 2:
+            raise ValueError("A frame ring needs at least two slots")
+        self.policy = policy
+        self.slots = [np.empty(shape, dtype=dtype) for _ in range(capacity)]
+        self._free = collections.deque(range(capacity))
+        self._ready = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._carry = 0
+        self._next_seq = 0
+        self.dropped = 0
+
+    @property
+    def depth(self):
+        return len(self._ready)
+
+    def acquire(self):
+        """Return a free slot index, or None when the incoming frame has to be dropped."""
+        with self._cond:
+            while not self._free:
+                if self._closed:
+                    return None
+                if self.policy == BLOCK:
+                    self._cond.wait()
+                elif self.policy == DROP_OLDEST and len(self._ready) > 1:
+                    # Keep the frame's duration by handing it to the next ready frame
+                    index, repeat = self._ready.popleft()
+                    next_index, next_repeat = self._ready[0]
+                    self._ready[0] = (next_index, next_repeat + repeat)
+                    if index is not None:
+                        self._free.append(index)
+                        self.dropped += 1
+                else:
+                    return None
+            return self._free.popleft()
+
+    def discard(self, repeat=1):
+        """Account for a frame that could not get a slot; its duration goes to the next one."""
+        with self._cond:
+            self._carry += repeat
+            self.dropped += 1
+
+    def publish(self, index, repeat=1):
+        with self._cond:
+            self._ready.append((index, repeat + self._carry))
+            self._carry = 0
+            self._cond.notify_all()
+
+    def extend(self, repeat=1):
+        """Show the most recent frame for `repeat` more output frames without copying it."""
+        with self._cond:
+            repeat += self._carry
+            self._carry = 0
+            if self._ready:
+                index, previous = self._ready[-1]
+                self._ready[-1] = (index, previous + repeat)
+            else:
+                self._ready.append((None, repeat))
+                self._cond.notify_all()
+
+    def take(self):
+        """
+        Block until a frame is ready and return (index, seq, repeat), or None once
+        the ring is closed and drained. Sequence numbers are handed out here so
+        they stay gap free whatever the drop policy discarded.
+        """
+        with self._cond:
+            while not self._ready:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            index, repeat = self._ready.popleft()
+            seq = self._next_seq
+            self._next_seq += 1
+            return index, seq, repeat
+
+    def release(self, index):
+        if index is None:
+            return
+        with self._cond:
+            self._free.append(index)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class CapturePipeline:
+    """
+    Capture side of a pipeline: slots are reserved from `ring`, grabbed into
+    (scaled through a scratch buffer when the capture size differs from the
+    frame shape) and committed with the number of output frames they cover.
+    Subclasses drain the ring into an encoder and provide start() and close().
+    """
+    # Whether set_scale() may be used
+    scalable = True
+
+    def __init__(self, ring, frame_shape, capture_shape=None, metrics=None):
+        self.ring = ring
+        self.frame_shape = tuple(frame_shape)
+        self._capture_shape = tuple(capture_shape) if capture_shape is not None else self.frame_shape
+        # Frames captured at another size than the output land here and are
+        # resized into the slot
+        self._scratch = None
+        if self._capture_shape != self.frame_shape:
+            self._scratch = np.empty(self._capture_shape, dtype=np.uint8)
+        # Shape of the frames being captured now, and the view of every slot in use
+        self._shape = self.frame_shape
+        self._slot_views = {}
+        # Output frames each capture is meant to cover (see set_step)
+        self.step = 1
+        self.captured = 0
+        self.duplicated = 0
+        self.skipped = 0
+        self.unchanged = 0
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self._register_metrics()
+
+    def set_step(self, step):
+        """
+        Frames are captured for every `step`-th output frame from now on; the
+        repeats that fill the gaps count as skipped rather than duplicated.
+        """
+        self.step = max(1, int(step))
+
+    def set_scale(self, scale):
+        """
+        Capture into the slots at `scale` times the frame shape (rounded to even
+        sizes) from the next frame on. The encoder then receives smaller frames
+        and has to cope with the size change, as SegmentedEncoder does.
+        """
+        height, width = self.frame_shape[:2]
+        if scale >= 1.0:
+            shape = self.frame_shape
+        else:
+            shape = (max(2, int(height * scale) // 2 * 2), max(2, int(width * scale) // 2 * 2), 3)
+        # The capture thread may be running: the scratch buffer has to exist
+        # before it sees the new shape
+        if shape != self.frame_shape and self._scratch is None:
+            self._scratch = np.empty(self._capture_shape, dtype=np.uint8)
+        self._shape = shape
+
+    def _slot(self, index):
+        """Slot `index` viewed at the current capture shape (a contiguous prefix of the slot)."""
+        slot = self.ring.slots[index]
+        if self._shape != self.frame_shape:
+            slot = slot.reshape(-1)[:int(np.prod(self._shape))].reshape(self._shape)
+        self._slot_views[index] = slot
+        return slot
+
+    def _count(self, repeat):
+        self.captured += 1
+        planned = min(repeat, self.step)
+        self.skipped += planned - 1
+        self.duplicated += repeat - planned
+
+    def _register_metrics(self):
+        self._grab_time = self.metrics.histogram('grab_seconds', 'Time to grab one frame from the source')
+        self._convert_time = self.metrics.histogram('convert_seconds', 'Time to scale one frame to the output size')
+        self._encode_time = self.metrics.histogram('encode_seconds', 'Time the encoder takes to accept one frame')
+        # Counts the pipeline keeps anyway are only read when a snapshot is taken
+        for name, help, read in (
+                ('frames_captured_total', 'Frames the capture loop produced', lambda: self.captured),
+                ('frames_encoded_total', 'Frames written to the encoder', lambda: self.encoded),
+                ('frames_dropped_total', 'Frames dropped because the ring was full', lambda: self.ring.dropped),
+                ('frames_duplicated_total', 'Extra frames written for missed capture ticks',
+                 lambda: self.duplicated),
+                ('frames_skipped_total', 'Frames repeated because the capture rate was lowered',
+                 lambda: self.skipped),
+                ('frames_unchanged_total', 'Frames repeated because the screen did not change',
+                 lambda: self.unchanged)):
+            self.metrics.counter(name, help, function=read)
+        self.metrics.gauge('queue_depth', 'Frames waiting for an encoder', function=lambda: self.ring.depth)
+
+    def acquire(self):
+        """Reserve a slot to capture into; None means the frame is dropped (see discard)."""
+        return self.ring.acquire()
+
+    def capture(self, index, source, overlay=None):
+        """
+        Grab from `source` into slot `index` (through the scratch buffer when the
+        output is scaled) and return the full-size captured frame. `overlay` is
+        drawn into the frame before it is scaled.
+        """
+        slot = self._slot(index)
+        start = time.perf_counter()
+        if self._scratch is None or self._scratch.shape == slot.shape:
+            source.grab_into(slot)
+            self._grab_time.observe(time.perf_counter() - start)
+            if overlay is not None:
+                overlay.apply(slot)
+            return slot
+        source.grab_into(self._scratch)
+        grabbed = time.perf_counter()
+        self._grab_time.observe(grabbed - start)
+        if overlay is not None:
+            overlay.apply(self._scratch)
+            grabbed = time.perf_counter()
+        _resize_into(self._scratch, slot)
+        self._convert_time.observe(time.perf_counter() - grabbed)
+        return self._scratch
+
+    def commit(self, index, repeat=1):
+        """Hand slot `index` to the encoders for `repeat` output frames."""
+        self._count(repeat)
+        self.ring.publish(index, repeat)
+
+    def cancel(self, index):
+        """Give back a slot that was acquired but not committed."""
+        self.ring.release(index)
+
+    def discard(self, repeat=1):
+        """Account for a frame dropped because no slot was free."""
+        self._count(repeat)
+        self.ring.discard(repeat)
+
+    def push(self, frame, repeat=1):
+        """
+        Copy an already grabbed `frame` in for `repeat` output frames. Returns
+        False when the frame was dropped by the ring's policy.
+        """
+        index = self.ring.acquire()
+        if index is None:
+            self.discard(repeat)
+            return False
+        slot = self._slot(index)
+        if frame.shape == slot.shape:
+            np.copyto(slot, frame)
+        else:
+            _resize_into(frame, slot)
+        self.commit(index, repeat)
+        return True
+
+    def push_unchanged(self, repeat=1):
+        """Record a frame identical to the previous one; nothing is copied."""
+        self._count(repeat)
+        self.unchanged += 1
+        self.ring.extend(repeat)
+
+    def stats(self):
+        return {
+            'captured': self.captured,
+            'encoded': self.encoded,
+            'dropped': self.ring.dropped,
+            'duplicated': self.duplicated,
+            'skipped': self.skipped,
+            'unchanged': self.unchanged,
+            'queue_depth': self.ring.depth,
+        }
+
+
+class FramePipeline(CapturePipeline):
+    """
+    Ring buffer plus encoder workers. Workers run `process(frame)` (if given)
+    in parallel and then write to `encoder` strictly in capture order. The slot
+    written last stays held until a newer frame is written, so unchanged frames
+    can be repeated from it.
+    """
+
+    def __init__(self, encoder, frame_shape, capacity=8, policy=DROP_OLDEST, workers=1, process=None,
+                 capture_shape=None, metrics=None):
+        self.encoder = encoder
+        self.process = process
+        self.encoded = 0
+        self._write_cond = threading.Condition()
+        self._next_write = 0
+        self._held = None
+        self._workers = [threading.Thread(target=self._encode_loop, name=f"encoder-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        super().__init__(FrameRing(capacity, frame_shape, policy=policy), frame_shape, capture_shape, metrics)
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def _encode_loop(self):
+        while True:
+            item = self.ring.take()
+            if item is None:
+                break
+            index, seq, repeat = item
+            frame = None
+            if index is not None:
+                frame = self._slot_views[index]
+                try:
+                    if self.process is not None:
+                        frame = self.process(frame)
+                except Exception as e:
+                    print(f"Error while processing frame {seq}: {e}")
+                    frame = None
+
+            release = index
+            with self._write_cond:
+                while self._next_write != seq:
+                    self._write_cond.wait()
+                try:
+                    if index is None and self._held is not None:
+                        frame = self._held[1]
+                    if frame is not None:
+                        for _ in range(repeat):
+                            start = time.perf_counter()
+                            self.encoder.write(frame)
+                            self._encode_time.observe(time.perf_counter() - start)
+                        self.encoded += repeat
+                        if index is not None:
+                            # Keep this slot for repeats and free the one held before it
+                            release = self._held[0] if self._held is not None else None
+                            self._held = (index, frame)
+                except Exception as e:
+                    print(f"Error while encoding frame {seq}: {e}")
+                finally:
+                    self._next_write = seq + 1
+                    self._write_cond.notify_all()
+            self.ring.release(release)
+
+    def close(self):
+        """Stop accepting frames, let the workers drain the ring and wait for them."""
+        self.ring.close()
+        for worker in self._workers:
+            worker.join()
+        if self._held is not None:
+            self.ring.release(self._held[0])
+            self._held = None
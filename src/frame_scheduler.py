@@ -0,0 +1,97 @@
+"""
+Frame pacing for ScreenRecorder.
+
+Deadlines are absolute (start + n / fps on the monotonic clock), so an
+overrun delays one frame instead of shifting every frame after it. Ticks a
+late frame could not be captured for are filled by repeating that frame,
+which keeps a constant-rate container in step with wall time and audio.
+With a `step` above 1 only every step-th tick is captured on purpose, which
+lowers the capture rate while the output keeps its frame rate.
+"""
+from array import array
+import time
+
+import numpy as np
+
+
+class FrameScheduler:
+    def __init__(self, fps, clock=time.monotonic, sleep=time.sleep):
+        self.fps = fps
+        self.interval = 1.0 / fps
+        self.clock = clock
+        self.sleep = sleep
+        self.start_time = None
+        self.tick = 0
+        self.step = 1
+        self.frames = 0
+        self.duplicated = 0
+        self.skipped = 0
+        # Capture time of every frame relative to start, and how late it was
+        self.timestamps = array('d')
+        self.lateness = array('d')
+
+    def start(self, start_time=None):
+        self.start_time = self.clock() if start_time is None else start_time
+        self.tick = 0
+
+    def set_step(self, step):
+        """Capture every `step`-th tick from the next frame on."""
+        self.step = max(1, int(step))
+
+    def deadline(self, tick):
+        return self.start_time + tick * self.interval
+
+    def wait(self):
+        """
+        Sleep until the current tick's deadline and return the frame's
+        presentation timestamp in seconds since start.
+        """
+        deadline = self.deadline(self.tick)
+        now = self.clock()
+        if now < deadline:
+            self.sleep(deadline - now)
+            now = self.clock()
+        self.frames += 1
+        self.timestamps.append(now - self.start_time)
+        self.lateness.append(max(0.0, now - deadline))
+        return now - self.start_time
+
+    def advance(self):
+        """
+        Move to the next tick to capture that has not passed yet and return how
+        many output frames the frame just captured has to cover. Of those, all
+        but `step` are duplicates forced by an overrun.
+        """
+        elapsed_ticks = int((self.clock() - self.start_time) / self.interval)
+        next_tick = max(self.tick + self.step, elapsed_ticks)
+        repeat = next_tick - self.tick
+        planned = min(repeat, self.step)
+        self.skipped += planned - 1
+        self.duplicated += repeat - planned
+        self.tick = next_tick
+        return repeat
+
+    def report(self):
+        elapsed = self.tick * self.interval
+        report = {
+            'target_fps': self.fps,
+            'achieved_fps': self.frames / elapsed if elapsed else 0.0,
+            'frames': self.frames,
+            'ticks': self.tick,
+            'duplicated': self.duplicated,
+            'skipped': self.skipped,
+        }
+        if self.lateness:
+            jitter = np.frombuffer(self.lateness, dtype=np.float64) * 1000.0
+            p50, p95, p99 = np.percentile(jitter, [50, 95, 99])
+            report['jitter_ms'] = {'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'max': float(jitter.max())}
+        return report
+
+    def format_report(self):
+        report = self.report()
+        summary = f"{report['achieved_fps']:.1f}/{report['target_fps']} fps achieved"
+        if 'jitter_ms' in report:
+            jitter = report['jitter_ms']
+            summary += (f", jitter p50 {jitter['p50']:.1f} ms, p95 {jitter['p95']:.1f} ms, "
+                        f"p99 {jitter['p99']:.1f} ms")
+        return summary
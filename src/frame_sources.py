@@ -0,0 +1,482 @@
+"""
+Frame sources used by ScreenRecorder.
+
+Every source hands out BGR frames as numpy arrays of shape (height, width, 3).
+Sources are free to reuse the same array for every call to grab(), so a caller
+that needs to keep a frame around has to copy it, or better, pass its own
+preallocated array to grab_into(), which the fast backends fill in place.
+"""
+import ctypes
+import ctypes.util
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class FrameSource:
+    name = 'base'
+
+    def __init__(self, bbox=None):
+        self.bbox = bbox
+
+    @property
+    def size(self):
+        left, top, right, bottom = self.bbox
+        return right - left, bottom - top
+
+    def grab(self):
+        raise NotImplementedError
+
+    def grab_into(self, dst):
+        """Capture into `dst` and return it."""
+        np.copyto(dst, self.grab())
+        return dst
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ('shmseg', ctypes.c_ulong),
+        ('shmid', ctypes.c_int),
+        ('shmaddr', ctypes.c_void_p),
+        ('readOnly', ctypes.c_int),
+    ]
+
+
+class _XImage(ctypes.Structure):
+    # Only the leading members of XImage are declared, we never touch the rest.
+    _fields_ = [
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('xoffset', ctypes.c_int),
+        ('format', ctypes.c_int),
+        ('data', ctypes.c_void_p),
+        ('byte_order', ctypes.c_int),
+        ('bitmap_unit', ctypes.c_int),
+        ('bitmap_bit_order', ctypes.c_int),
+        ('bitmap_pad', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('bytes_per_line', ctypes.c_int),
+        ('bits_per_pixel', ctypes.c_int),
+    ]
+
+
+_IPC_PRIVATE = 0
+_IPC_CREAT = 0o1000
+_IPC_RMID = 0
+_ZPIXMAP = 2
+_ALL_PLANES = ctypes.c_ulong(-1)
+
+
+def _load_library(name):
+    path = ctypes.util.find_library(name)
+    if path is None:
+        raise OSError(f"lib{name} is not available")
+    return ctypes.CDLL(path)
+
+
+_geometry_lock = threading.Lock()
+_geometry_cache = None
+
+
+def _query_display_geometry():
+    if os.name == 'nt':
+        user32 = ctypes.windll.user32
+        return 0, 0, user32.GetSystemMetrics(0), user32.GetSystemMetrics(1)
+    if os.environ.get('DISPLAY'):
+        x11 = _load_library('X11')
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        display = x11.XOpenDisplay(None)
+        if display:
+            try:
+                screen = x11.XDefaultScreen(display)
+                return 0, 0, x11.XDisplayWidth(display, screen), x11.XDisplayHeight(display, screen)
+            finally:
+                x11.XCloseDisplay(display)
+    # Last resort: a full screenshot, only to read its size
+    from PIL import ImageGrab
+    width, height = ImageGrab.grab().size
+    return 0, 0, width, height
+
+
+def display_geometry():
+    """
+    Bounding box (left, top, right, bottom) of the primary screen. It is queried
+    once and cached until invalidate_display_geometry() is called, e.g. when the
+    GUI sees the monitor layout change.
+    """
+    global _geometry_cache
+    with _geometry_lock:
+        if _geometry_cache is None:
+            _geometry_cache = _query_display_geometry()
+        return _geometry_cache
+
+
+def invalidate_display_geometry(*args):
+    global _geometry_cache
+    with _geometry_lock:
+        _geometry_cache = None
+
+
+class _XineramaScreenInfo(ctypes.Structure):
+    _fields_ = [
+        ('screen_number', ctypes.c_int),
+        ('x_org', ctypes.c_short),
+        ('y_org', ctypes.c_short),
+        ('width', ctypes.c_short),
+        ('height', ctypes.c_short),
+    ]
+
+
+def _query_xinerama_monitors():
+    x11 = _load_library('X11')
+    xinerama = _load_library('Xinerama')
+    x11.XOpenDisplay.restype = ctypes.c_void_p
+    x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+    x11.XFree.argtypes = [ctypes.c_void_p]
+    x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+    xinerama.XineramaIsActive.argtypes = [ctypes.c_void_p]
+    xinerama.XineramaQueryScreens.restype = ctypes.POINTER(_XineramaScreenInfo)
+    xinerama.XineramaQueryScreens.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int)]
+    display = x11.XOpenDisplay(None)
+    if not display:
+        raise OSError("Cannot open X display")
+    try:
+        if not xinerama.XineramaIsActive(display):
+            return []
+        count = ctypes.c_int()
+        screens = xinerama.XineramaQueryScreens(display, ctypes.byref(count))
+        if not screens:
+            return []
+        try:
+            return [(s.x_org, s.y_org, s.x_org + s.width, s.y_org + s.height)
+                    for s in (screens[i] for i in range(count.value))]
+        finally:
+            x11.XFree(screens)
+    finally:
+        x11.XCloseDisplay(display)
+
+
+def list_monitors():
+    """
+    Bounding boxes (left, top, right, bottom) of every monitor, in the desktop
+    coordinates the frame sources take, primary first when the platform says
+    which one that is. Falls back to the primary screen alone.
+    """
+    try:
+        import mss
+
+        with mss.mss() as sct:
+            return [(m['left'], m['top'], m['left'] + m['width'], m['top'] + m['height'])
+                    for m in sct.monitors[1:]]
+    except ImportError:
+        pass
+    if os.name != 'nt' and os.environ.get('DISPLAY'):
+        try:
+            monitors = _query_xinerama_monitors()
+            if monitors:
+                return monitors
+        except OSError:
+            pass
+    return [display_geometry()]
+
+
+def fit_resolution(size, resolution):
+    """
+    Largest size with the aspect ratio of `size` that fits in `resolution`,
+    rounded down to even dimensions as yuv420p encoders require. None keeps `size`.
+    """
+    if resolution is None:
+        return size
+    width, height = size
+    scale = min(resolution[0] / width, resolution[1] / height)
+    if abs(scale - 1.0) < 1e-9:
+        return size
+    return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+
+class XShmFrameSource(FrameSource):
+    """
+    X11 grabber built on the MIT-SHM extension.
+
+    The X server copies the screen straight into one shared memory segment that
+    is allocated once, so a grab costs a single memcpy on the server side and a
+    BGRA -> BGR conversion into a preallocated array on ours.
+    """
+    name = 'xshm'
+
+    def __init__(self, bbox=None):
+        super().__init__(bbox)
+        if not os.environ.get('DISPLAY'):
+            raise OSError("DISPLAY is not set")
+
+        self._x11 = _load_library('X11')
+        self._xext = _load_library('Xext')
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._declare_prototypes()
+
+        self._display = self._x11.XOpenDisplay(None)
+        if not self._display:
+            raise OSError("Cannot open X display")
+        self._image = None
+        self._shminfo = None
+        try:
+            if not self._xext.XShmQueryExtension(self._display):
+                raise OSError("X server does not support MIT-SHM")
+
+            screen = self._x11.XDefaultScreen(self._display)
+            self._root = self._x11.XDefaultRootWindow(self._display)
+            if self.bbox is None:
+                self.bbox = (0, 0, self._x11.XDisplayWidth(self._display, screen),
+                             self._x11.XDisplayHeight(self._display, screen))
+            width, height = self.size
+
+            self._shminfo = _XShmSegmentInfo()
+            self._image = self._xext.XShmCreateImage(
+                self._display, self._x11.XDefaultVisual(self._display, screen),
+                self._x11.XDefaultDepth(self._display, screen), _ZPIXMAP, None,
+                ctypes.byref(self._shminfo), width, height)
+            if not self._image:
+                raise OSError("XShmCreateImage failed")
+            image = self._image.contents
+            if image.bits_per_pixel != 32:
+                raise OSError(f"Unsupported pixel layout ({image.bits_per_pixel} bpp)")
+
+            buffer_size = image.bytes_per_line * height
+            self._shminfo.shmid = self._libc.shmget(_IPC_PRIVATE, buffer_size, _IPC_CREAT | 0o600)
+            if self._shminfo.shmid < 0:
+                raise OSError(ctypes.get_errno(), "shmget failed")
+            self._shminfo.shmaddr = self._libc.shmat(self._shminfo.shmid, None, 0)
+            if self._shminfo.shmaddr in (None, ctypes.c_void_p(-1).value):
+                raise OSError(ctypes.get_errno(), "shmat failed")
+            image.data = self._shminfo.shmaddr
+            self._shminfo.readOnly = 0
+            if not self._xext.XShmAttach(self._display, ctypes.byref(self._shminfo)):
+                raise OSError("XShmAttach failed")
+            self._x11.XSync(self._display, False)
+            # Mark the segment for removal now, it disappears once both sides detach
+            # even if we never get to close() cleanly.
+            self._libc.shmctl(self._shminfo.shmid, _IPC_RMID, None)
+
+            raw = (ctypes.c_ubyte * buffer_size).from_address(self._shminfo.shmaddr)
+            pixels = np.frombuffer(raw, dtype=np.uint8).reshape(height, image.bytes_per_line)
+            self._bgra = pixels[:, :width * 4].reshape(height, width, 4)
+            self._frame = np.empty((height, width, 3), dtype=np.uint8)
+        except Exception:
+            self.close()
+            raise
+
+    def _declare_prototypes(self):
+        x11, xext, libc = self._x11, self._xext, self._libc
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XDefaultRootWindow.restype = ctypes.c_ulong
+        x11.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        x11.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultVisual.restype = ctypes.c_void_p
+        x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XFree.argtypes = [ctypes.c_void_p]
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                         ctypes.c_char_p, ctypes.POINTER(_XShmSegmentInfo),
+                                         ctypes.c_uint, ctypes.c_uint]
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage),
+                                      ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+    def grab(self):
+        return self.grab_into(self._frame)
+
+    def grab_into(self, dst):
+        left, top = self.bbox[0], self.bbox[1]
+        if not self._xext.XShmGetImage(self._display, self._root, self._image, left, top, _ALL_PLANES):
+            raise OSError("XShmGetImage failed")
+        return cv2.cvtColor(self._bgra, cv2.COLOR_BGRA2BGR, dst=dst)
+
+    def close(self):
+        if self._display is None:
+            return
+        if self._shminfo is not None and self._shminfo.shmaddr:
+            self._xext.XShmDetach(self._display, ctypes.byref(self._shminfo))
+            self._x11.XSync(self._display, False)
+            self._libc.shmdt(self._shminfo.shmaddr)
+            self._shminfo.shmaddr = None
+        if self._image:
+            self._image.contents.data = None
+            self._x11.XFree(self._image)
+            self._image = None
+        self._x11.XCloseDisplay(self._display)
+        self._display = None
+
+
+class MSSFrameSource(FrameSource):
+    """Grabber backed by the optional `mss` package (Windows, macOS and X11)."""
+    name = 'mss'
+
+    def __init__(self, bbox=None):
+        import mss
+
+        super().__init__(bbox)
+        self._sct = mss.mss()
+        if self.bbox is None:
+            monitor = self._sct.monitors[1]
+            self.bbox = (monitor['left'], monitor['top'],
+                         monitor['left'] + monitor['width'], monitor['top'] + monitor['height'])
+        width, height = self.size
+        self._monitor = {'left': self.bbox[0], 'top': self.bbox[1], 'width': width, 'height': height}
+        self._frame = np.empty((height, width, 3), dtype=np.uint8)
+
+    def grab(self):
+        return self.grab_into(self._frame)
+
+    def grab_into(self, dst):
+        shot = self._sct.grab(self._monitor)
+        bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+        return cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR, dst=dst)
+
+    def close(self):
+        self._sct.close()
+
+
+class ImageGrabFrameSource(FrameSource):
+    """The original PIL.ImageGrab path, kept as the portable fallback."""
+    name = 'imagegrab'
+
+    def __init__(self, bbox=None):
+        from PIL import ImageGrab
+
+        # Ensure ImageGrab works in the current environment
+        if not hasattr(ImageGrab, 'grab'):
+            raise ImportError("PIL.ImageGrab module is not available in this environment.")
+        super().__init__(bbox)
+        self._image_grab = ImageGrab
+        if self.bbox is None:
+            self.bbox = display_geometry()
+
+    def grab(self):
+        img = self._image_grab.grab(bbox=self.bbox)
+        return cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)
+
+    def grab_into(self, dst):
+        # PIL always allocates the image itself; at least the conversion goes in place
+        img = self._image_grab.grab(bbox=self.bbox)
+        return cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR, dst=dst)
+
+
+class SyntheticFrameSource(FrameSource):
+    """
+    Generates frames with NumPy only, so recording works without any display
+    (CI, Xvfb-less containers, benchmarks).
+    """
+    name = 'synthetic'
+
+    def __init__(self, bbox=None):
+        super().__init__(bbox or (0, 0, 1920, 1080))
+        width, height = self.size
+        gradient = np.linspace(0, 255, width, dtype=np.float32)
+        self._background = np.empty((height, width, 3), dtype=np.uint8)
+        self._background[:, :, 0] = gradient.astype(np.uint8)
+        self._background[:, :, 1] = np.linspace(0, 255, height, dtype=np.float32).astype(np.uint8)[:, None]
+        self._background[:, :, 2] = 128
+        self._frame = np.empty_like(self._background)
+        self._index = 0
+
+    def grab(self):
+        return self.grab_into(self._frame)
+
+    def grab_into(self, dst):
+        width = self.size[0]
+        bar = max(1, width // 32)
+        x = (self._index * bar) % width
+        np.copyto(dst, self._background)
+        dst[:, x:x + bar] = 255
+        self._index += 1
+        return dst
+
+
+FRAME_SOURCES = {
+    XShmFrameSource.name: XShmFrameSource,
+    MSSFrameSource.name: MSSFrameSource,
+    ImageGrabFrameSource.name: ImageGrabFrameSource,
+    SyntheticFrameSource.name: SyntheticFrameSource,
+}
+
+DEFAULT_CANDIDATES = ('xshm', 'mss', 'imagegrab')
+
+
+def measure_throughput(source, frames=10):
+    """Return the number of frames per second `source` sustains."""
+    source.grab()  # Warm up, the first grab often pays for lazy setup
+    start = time.perf_counter()
+    for _ in range(frames):
+        source.grab()
+    elapsed = time.perf_counter() - start
+    return frames / elapsed if elapsed > 0 else float('inf')
+
+
+def select_frame_source(bbox=None, candidates=None, probe_frames=10):
+    """
+    Open every candidate backend, time a few grabs on each and keep the fastest.
+
+    The synthetic source is only used when it is listed in `candidates` or
+    requested through SCREENRECORDER_SOURCE. Raises OSError when none of the
+    candidates can be opened (e.g. no display at all), rather than recording
+    a test pattern.
+    """
+    forced = os.environ.get('SCREENRECORDER_SOURCE')
+    if forced:
+        candidates = (forced,)
+    elif candidates is None:
+        candidates = DEFAULT_CANDIDATES
+
+    best, best_fps = None, 0.0
+    for name in candidates:
+        source = None
+        try:
+            source = FRAME_SOURCES[name](bbox)
+            fps = measure_throughput(source, probe_frames)
+        except Exception as e:
+            print(f"Frame source '{name}' unavailable: {e}")
+            if source is not None:
+                source.close()
+            continue
+        print(f"Frame source '{name}' sustains {fps:.1f} fps")
+        if fps > best_fps:
+            if best is not None:
+                best.close()
+            best, best_fps = source, fps
+        else:
+            source.close()
+
+    if best is None:
+        raise OSError(f"No screen capture backend could be opened (tried {', '.join(candidates)})")
+    print(f"Using frame source '{best.name}'")
+    return best
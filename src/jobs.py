@@ -0,0 +1,88 @@
+"""
+Background jobs for work that must not block the GUI thread, such as
+finalizing a recording (joining the recorder threads and muxing with ffmpeg).
+
+Jobs run on a small thread pool; the heavy lifting happens in ffmpeg child
+processes, so threads are enough. Every state or progress change is reported
+through `on_update(job)`, called from the worker thread.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import threading
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Job:
+    def __init__(self, job_id, name):
+        self.id = job_id
+        self.name = name
+        self.state = PENDING
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+
+    @property
+    def finished(self):
+        return self.state in (DONE, FAILED)
+
+    def describe(self):
+        if self.state == RUNNING:
+            return f"{self.name}: {self.progress:.0%}"
+        if self.state == FAILED:
+            return f"{self.name} failed: {self.error}"
+        return f"{self.name}: {self.state}"
+
+
+class JobQueue:
+    def __init__(self, workers=1, on_update=None):
+        self.on_update = on_update
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._jobs = []
+
+    def submit(self, name, func, *args, **kwargs):
+        """
+        Queue func(*args, progress=callback, **kwargs) and return its Job. The
+        callback takes a fraction between 0 and 1; exceptions mark the job failed.
+        """
+        job = Job(next(self._ids), name)
+        with self._lock:
+            self._jobs.append(job)
+        self._notify(job)
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def _run(self, job, func, args, kwargs):
+        job.state = RUNNING
+        self._notify(job)
+
+        def progress(fraction):
+            job.progress = fraction
+            self._notify(job)
+
+        try:
+            job.result = func(*args, progress=progress, **kwargs)
+            job.progress = 1.0
+            job.state = DONE
+        except Exception as e:
+            job.error = e
+            job.state = FAILED
+        self._notify(job)
+
+    def _notify(self, job):
+        if self.on_update is not None:
+            self.on_update(job)
+
+    def active(self):
+        """Jobs that have not finished yet, oldest first."""
+        with self._lock:
+            self._jobs = [job for job in self._jobs if not job.finished]
+            return list(self._jobs)
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -1,18 +1,70 @@
 import sys
 import os
 import datetime
+import functools
 import pyaudio
-from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QVBoxLayout, QWidget, QFileDialog, QLabel, QComboBox, QMessageBox
+from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QVBoxLayout, QWidget, QFileDialog, QLabel, QComboBox, QMessageBox, QCheckBox
+from PyQt5.QtCore import QTimer, pyqtSignal
 from PyQt5.QtGui import QKeySequence
 from PyQt5.QtWidgets import QShortcut
+from adaptive import AdaptiveController
 from audio_recorder import AudioRecorder
+from av_sync import SessionClock, SyncTrack, sync_filename
 from screen_recorder import ScreenRecorder
+from encoder_probe import is_opencv, load_probe, parse_encoder, select_encoder
+from frame_sources import display_geometry, invalidate_display_geometry, select_frame_source
+from jobs import DONE, FAILED, JobQueue
+from metrics import MetricsRegistry, format_status
+from muxing import mux_audio_video
+from recording_index import build_index
+from video_encoders import FFmpegPipeEncoder, OpenCVVideoEncoder, SegmentedEncoder
+
+# Encoder choices offered in the UI. A fourcc string keeps the OpenCV writer followed
+# by an ffmpeg mux; the others stream audio and video into one ffmpeg process as
+# (codec, preset, variable frame rate). 'auto' takes the fastest encoder measured
+# on this machine that keeps up with the recording.
+ENCODER_MODES = {
+    'Automatic (fastest measured here)': 'auto',
+    'OpenCV mp4v (mux after stop)': 'mp4v',
+    'FFmpeg x264 ultrafast (single pass)': ('libx264', 'ultrafast', False),
+    'FFmpeg x264 veryfast (single pass)': ('libx264', 'veryfast', False),
+    'FFmpeg x264 ultrafast VFR (static screens)': ('libx264', 'ultrafast', True),
+}
+
+# How long the window has to sit idle before the encoders are measured
+PROBE_IDLE_DELAY_MS = 10000
+
+# Output layouts as (segment seconds, segments kept); None writes one file directly
+OUTPUT_MODES = {
+    'Single file': None,
+    'Segmented, crash-safe (1 minute segments)': (60, None),
+    'Replay buffer (last 5 minutes)': (30, 10),
+}
 
 class RecorderApp(QMainWindow):
+    # Carries Job updates from the worker threads to the GUI thread
+    job_updated = pyqtSignal(object)
+
     def __init__(self):
         super().__init__()
         self.initUI()
         self.is_recording = False  # Track recording state
+        # Stopped recordings are finalized here so the window stays responsive
+        # and the next recording can start right away
+        self.job_updated.connect(self.on_job_updated)
+        self.jobs = JobQueue(on_update=self.job_updated.emit)
+        # The automatic encoder needs the encoders measured once per ffmpeg binary.
+        # Even reading the cache hashes the binary when it is new, and a probe loads
+        # every core for a few seconds, so both wait until nothing is being recorded
+        # or finalized, on a job thread
+        self.encoder_results = None
+        self.probe_timer = QTimer(self)
+        self.probe_timer.setSingleShot(True)
+        self.probe_timer.timeout.connect(self.measure_encoders_when_idle)
+        self.probe_timer.start(PROBE_IDLE_DELAY_MS)
+        # Live status line while recording, from the recorders' shared metrics
+        self.status_timer = QTimer(self)
+        self.status_timer.timeout.connect(self.update_status)
 
     def initUI(self):
         self.setWindowTitle('Screen and Audio Recorder')
@@ -21,16 +73,35 @@ class RecorderApp(QMainWindow):
         self.start_button = QPushButton('Start Recording', self)
         self.stop_button = QPushButton('Stop Recording', self)
         self.file_label = QLabel('Output files will be saved in the selected directory.', self)
+        self.jobs_label = QLabel('', self)
 
         self.file_location_button = QPushButton('Select File Location', self)
         self.file_location_button.clicked.connect(self.select_file_location)
 
         self.resolution_combo = QComboBox(self)
-        self.resolution_combo.addItems(['1920x1080', '1280x720', '640x480'])
+        self.resolution_combo.addItems(['Native', '1920x1080', '1280x720', '640x480'])
 
         self.audio_device_combo = QComboBox(self)
         self.audio_device_combo.addItems(self.get_audio_devices())
 
+        # Optional second input mixed in, e.g. the monitor of the speakers for system audio
+        self.second_audio_device_combo = QComboBox(self)
+        self.second_audio_device_combo.addItems(['None'] + self.get_audio_devices())
+
+        self.encoder_combo = QComboBox(self)
+        self.encoder_combo.addItems(list(ENCODER_MODES))
+
+        self.output_mode_combo = QComboBox(self)
+        self.output_mode_combo.addItems(list(OUTPUT_MODES))
+
+        # Keeps encoding off the GIL shared with the audio thread and this event loop
+        self.encoder_process_checkbox = QCheckBox('Encode in a separate process', self)
+        # Lowers the capture rate (to half at most) while the machine cannot keep up
+        self.adaptive_checkbox = QCheckBox('Adapt quality to load', self)
+
+        self.save_replay_button = QPushButton('Save Replay', self)
+        self.save_replay_button.clicked.connect(self.save_replay)
+
         self.start_button.clicked.connect(self.start_recording)
         self.stop_button.clicked.connect(self.stop_recording)
 
@@ -40,9 +111,19 @@ class RecorderApp(QMainWindow):
         layout.addWidget(self.resolution_combo)
         layout.addWidget(QLabel('Select Audio Input Device:', self))
         layout.addWidget(self.audio_device_combo)
+        layout.addWidget(QLabel('Mix In Second Audio Device:', self))
+        layout.addWidget(self.second_audio_device_combo)
+        layout.addWidget(QLabel('Select Encoder:', self))
+        layout.addWidget(self.encoder_combo)
+        layout.addWidget(QLabel('Select Output Mode:', self))
+        layout.addWidget(self.output_mode_combo)
+        layout.addWidget(self.encoder_process_checkbox)
+        layout.addWidget(self.adaptive_checkbox)
         layout.addWidget(self.start_button)
         layout.addWidget(self.stop_button)
+        layout.addWidget(self.save_replay_button)
         layout.addWidget(self.file_label)
+        layout.addWidget(self.jobs_label)
 
         container = QWidget()
         container.setLayout(layout)
@@ -55,6 +136,9 @@ class RecorderApp(QMainWindow):
         self.stop_shortcut = QShortcut(QKeySequence('Ctrl+S'), self)
         self.stop_shortcut.activated.connect(self.stop_recording)
 
+        self.replay_shortcut = QShortcut(QKeySequence('Ctrl+Shift+S'), self)
+        self.replay_shortcut.activated.connect(self.save_replay)
+
     def get_audio_devices(self):
         devices = AudioRecorder.list_audio_devices()
         return [f"{name} (Index {index})" for index, name in devices]
@@ -73,51 +157,195 @@ class RecorderApp(QMainWindow):
             self.file_location = os.getcwd()
 
         resolution_str = self.resolution_combo.currentText()
-        width, height = map(int, resolution_str.split('x'))
-        resolution = (width, height)
+        resolution = None
+        if resolution_str != 'Native':
+            width, height = map(int, resolution_str.split('x'))
+            resolution = (width, height)
 
         timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        self.audio_filename = os.path.join(self.file_location, f"output_{timestamp}.mp3")
+        self.audio_filename = os.path.join(self.file_location, f"output_{timestamp}.m4a")
         self.screen_filename = os.path.join(self.file_location, f"output_{timestamp}.mp4")
         self.combined_filename = os.path.join(self.file_location, f"combined_{timestamp}.mp4")
 
         audio_device_index = self.audio_device_combo.currentIndex()
+        audio_devices = [(audio_device_index, 1.0)]
+        if self.second_audio_device_combo.currentIndex() > 0:
+            audio_devices.append((self.second_audio_device_combo.currentIndex() - 1, 1.0))
+
+        # One clock for both recorders; it starts right before their threads do
+        self.session = SessionClock()
+        self.sync = SyncTrack(44100)
+        self.metrics = MetricsRegistry()
+        self.last_snapshot = None
+        sync_args = {'session': self.session, 'sync': self.sync, 'metrics': self.metrics}
+        encoder_process = self.encoder_process_checkbox.isChecked()
+        try:
+            frame_source = select_frame_source()
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Cannot capture the screen: {e}")
+            return
+
+        encoder_mode = ENCODER_MODES[self.encoder_combo.currentText()]
+        if encoder_mode == 'auto':
+            encoder_mode = self.automatic_encoder_mode(resolution)
+        output_mode = OUTPUT_MODES[self.output_mode_combo.currentText()]
+        segment_args = {}
+        if output_mode is not None:
+            segment_args = {'segment_seconds': output_mode[0], 'max_segments': output_mode[1]}
+        self.is_replay = output_mode is not None and output_mode[1] is not None
+        if self.is_replay and not isinstance(encoder_mode, tuple):
+            # Replay clips need the audio inside the segments, which only the single-pass encoder does
+            encoder_mode = ENCODER_MODES['FFmpeg x264 ultrafast (single pass)']
+
+        self.is_streaming = isinstance(encoder_mode, tuple)
+        if self.is_streaming:
+            codec, preset, vfr = encoder_mode
+            encoder_factory = functools.partial(FFmpegPipeEncoder, codec=codec, preset=preset, vfr=vfr,
+                                                audio_rate=44100, audio_channels=2, **segment_args)
+            self.screen_recorder = ScreenRecorder(resolution, 20, self.combined_filename,
+                                                  frame_source=frame_source, encoder_factory=encoder_factory,
+                                                  detect_damage=vfr, encoder_process=encoder_process, **sync_args)
+            self.audio_recorder = AudioRecorder(pyaudio.paInt16, 2, 44100, 1024, self.audio_filename,
+                                                devices=audio_devices, sink=self.screen_recorder.out.audio_sink,
+                                                **sync_args)
+        else:
+            self.audio_recorder = AudioRecorder(pyaudio.paInt16, 2, 44100, 1024, self.audio_filename,
+                                                devices=audio_devices, **sync_args)
+            encoder_factory = functools.partial(OpenCVVideoEncoder, fourcc=encoder_mode)
+            if segment_args:
+                encoder_factory = functools.partial(SegmentedEncoder, encoder_factory=encoder_factory, **segment_args)
+            self.screen_recorder = ScreenRecorder(resolution, 20, self.screen_filename,
+                                                  frame_source=frame_source, encoder_factory=encoder_factory,
+                                                  encoder_process=encoder_process, **sync_args)
+
+        self.controller = None
+        if self.adaptive_checkbox.isChecked():
+            self.controller = AdaptiveController(self.screen_recorder, min_fps=10)
 
-        self.audio_recorder = AudioRecorder(pyaudio.paInt16, 2, 44100, 1024, self.audio_filename, device_index=audio_device_index)
-        self.screen_recorder = ScreenRecorder(resolution, 20, self.screen_filename)
+        self.session.start()
 
         self.audio_recorder.start()
         self.screen_recorder.start()
+        if self.controller is not None:
+            self.controller.start()
 
         self.file_label.setText("Recording...")
         self.is_recording = True  # Set recording state to True
+        self.status_timer.start(1000)
 
     def stop_recording(self):
         if self.is_recording:  # Check if recording is in progress
+            self.status_timer.stop()
+            if self.controller is not None:
+                self.controller.stop()
             self.audio_recorder.stop()
             self.screen_recorder.stop()
-            self.audio_recorder.join()
-            self.screen_recorder.join()
-            self.file_label.setText("Recording stopped. Combining files...")
+            # Joining the threads and muxing happen in the background; everything
+            # the job needs is passed in, as the next recording replaces these attributes
+            if self.is_replay:
+                name = "Discarding replay buffer"
+            else:
+                name = f"Finalizing {os.path.basename(self.combined_filename)}"
+            # ffmpeg already muxed everything while recording in the single-pass modes
+            self.jobs.submit(name, self.finalize_recording, self.audio_recorder, self.screen_recorder, self.sync,
+                             self.audio_filename, self.screen_filename, self.combined_filename,
+                             mux=not self.is_streaming)
+            self.file_label.setText("Recording stopped. Finalizing in the background...")
+            self.is_recording = False  # Reset recording state
+        else:
+            self.file_label.setText("No recording in progress.")
+
+    def update_status(self):
+        snapshot = self.metrics.snapshot()
+        self.file_label.setText(f"Recording: {format_status(snapshot, self.last_snapshot)}")
+        self.last_snapshot = snapshot
 
-            self.combine_audio_video(self.audio_filename, self.screen_filename, self.combined_filename)
+    def finalize_recording(self, audio_recorder, screen_recorder, sync, audio_file, video_file, output_file,
+                           mux=True, progress=None):
+        """Runs on a job thread; returns the finished file, or None if nothing was kept."""
+        audio_recorder.join()
+        screen_recorder.join()
+        sync.save(sync_filename(output_file))
+        if not screen_recorder.succeeded:
+            # Raised before muxing, so the audio file is kept
+            raise RuntimeError(f"screen recording failed: {screen_recorder.error or 'the encoder failed'}")
+        if not mux:
+            if not os.path.exists(output_file):
+                return None
+        else:
+            self.combine_audio_video(audio_file, video_file, output_file, sync, progress)
 
             # Remove temporary files
-            self.remove_temp_files(self.audio_filename, self.screen_filename)
+            self.remove_temp_files(audio_file, video_file)
+        self.index_recording(output_file)
+        return output_file
 
-            self.file_label.setText(f"Files combined and saved as: {self.combined_filename}")
-            self.is_recording = False  # Reset recording state
+    def measure_encoders_when_idle(self):
+        if self.is_recording or self.jobs.active():
+            self.probe_timer.start(PROBE_IDLE_DELAY_MS)
+            return
+        self.jobs.submit('Measuring encoders', self.measure_encoders)
+
+    def measure_encoders(self, progress):
+        """Runs on a job thread; the cached results, or new ones if this ffmpeg was not measured yet."""
+        self.encoder_results = load_probe(progress=progress, log=None)
+
+    def automatic_encoder_mode(self, resolution, fps=20):
+        """ENCODER_MODES value of the encoder the probe picks; x264 ultrafast until the encoders are measured."""
+        results = self.encoder_results
+        name = None
+        if results is not None:
+            if resolution is None:
+                left, top, right, bottom = display_geometry()
+                resolution = (right - left, bottom - top)
+            name = select_encoder(results, resolution[0] * resolution[1] * fps)
+        if name is None:
+            return ENCODER_MODES['FFmpeg x264 ultrafast (single pass)']
+        print(f"Automatic encoder: {name}")
+        if is_opencv(name):
+            return name
+        codec, preset = parse_encoder(name)
+        return codec, preset, False
+
+    def on_job_updated(self, job):
+        if job.state == DONE:
+            if job.result is not None:
+                self.file_label.setText(f"Recording saved as: {job.result}")
+            print(f"{job.name}: done")
+        elif job.state == FAILED:
+            print(f"{job.name} failed: {job.error}")
+            QMessageBox.critical(self, "Error", f"{job.name} failed: {job.error}")
+        active = self.jobs.active()
+        self.jobs_label.setText("\n".join(j.describe() for j in active))
+
+    def save_replay(self):
+        if not self.is_recording or not self.is_replay:
+            self.file_label.setText("Replay buffer is not running.")
+            return
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        replay_filename = os.path.join(self.file_location, f"replay_{timestamp}.mp4")
+        result = self.screen_recorder.out.save_replay(replay_filename)
+        if result is None:
+            self.file_label.setText("Replay buffer is still empty.")
+        elif result != 0:
+            QMessageBox.critical(self, "Error", f"Saving the replay failed with code {result}")
         else:
-            self.file_label.setText("No recording in progress.")
+            self.file_label.setText(f"Replay saved as: {replay_filename}")
 
-    def combine_audio_video(self, audio_file, video_file, output_file):
-        command = f'ffmpeg -i "{video_file}" -i "{audio_file}" -c:v copy -c:a aac -strict experimental "{output_file}"'
-        result = os.system(command)
+    def combine_audio_video(self, audio_file, video_file, output_file, sync=None, progress=None):
+        result = mux_audio_video(video_file, audio_file, output_file, sync=sync, progress=progress)
         if result != 0:
             print(f"FFmpeg command failed with result code {result}")
-            QMessageBox.critical(self, "Error", f"Combining audio and video failed with code {result}")
-        else:
-            print(f"Combined file saved as {output_file}")
+            raise RuntimeError(f"combining audio and video failed with code {result}")
+        print(f"Combined file saved as {output_file}")
+
+    def index_recording(self, output_file):
+        # Keyframes, scene changes and thumbnails for previews and fast trims; the recording is kept regardless
+        try:
+            index = build_index(output_file)
+            print(f"Indexed {output_file}: {len(index['keyframes'])} keyframes, {len(index['scenes'])} scenes")
+        except Exception as e:
+            print(f"Error indexing {output_file}: {e}")
 
     def remove_temp_files(self, *files):
         for file in files:
@@ -127,8 +355,20 @@ class RecorderApp(QMainWindow):
             except Exception as e:
                 print(f"Error removing temporary file {file}: {e}")
 
+    def closeEvent(self, event):
+        self.probe_timer.stop()
+        if self.is_recording:
+            self.stop_recording()
+        # Let recordings that are still being finalized finish before exiting
+        self.jobs.close(wait=True)
+        super().closeEvent(event)
+
 def main():
     app = QApplication(sys.argv)
+    # Screen geometry is cached by the capture code, drop it when the layout changes
+    app.screenAdded.connect(invalidate_display_geometry)
+    app.screenRemoved.connect(invalidate_display_geometry)
+    app.primaryScreen().geometryChanged.connect(invalidate_display_geometry)
     ex = RecorderApp()
     ex.show()
     sys.exit(app.exec_())
@@ -0,0 +1,236 @@
+"""
+Low-overhead metrics for the recording hot paths.
+
+Counters and histograms are plain Python objects updated inline by the thread
+that owns them (one writer per metric), which costs well under a microsecond
+per update. Values that already exist elsewhere, such as the pipeline's frame
+counts or the size of the output file, are registered as callbacks and only
+read when a snapshot is taken.
+
+A snapshot is a plain dict; it can be written as JSON or in the Prometheus
+text format, periodically by a MetricsDumper, and summarised in one status line.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+# Upper bounds in seconds, from 0.25 ms up to about 1 s
+DEFAULT_BUCKETS = tuple(0.00025 * 2 ** i for i in range(13))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help='', function=None):
+        self.name = name
+        self.help = help
+        self.function = function
+        self._value = 0
+
+    def inc(self, amount=1):
+        self._value += amount
+
+    @property
+    def value(self):
+        return self.function() if self.function is not None else self._value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value):
+        self._value = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help='', buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # One slot per bucket plus the overflow (+Inf) slot
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate of the q-quantile, interpolated within its bucket; None before any observation."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    @property
+    def value(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class MetricsRegistry:
+    def __init__(self, prefix='screenrecorder_'):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, help='', function=None):
+        return self._register(Counter, name, help, function)
+
+    def gauge(self, name, help='', function=None):
+        return self._register(Gauge, name, help, function)
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def snapshot(self):
+        """{name: value} of every metric, plus the time it was taken."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        values = {'time': time.time()}
+        for metric in metrics:
+            try:
+                values[metric.name] = metric.value
+            except Exception:
+                values[metric.name] = None  # e.g. the output file does not exist yet
+        return values
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            name = self.prefix + metric.name
+            if metric.help:
+                lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            if isinstance(metric, Histogram):
+                cumulative = 0
+                for bound, n in zip(metric.buckets, metric.counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{{le="{bound:g}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{le="+Inf"}} {metric.count}')
+                lines.append(f"{name}_sum {metric.sum}")
+                lines.append(f"{name}_count {metric.count}")
+                continue
+            try:
+                value = metric.value
+            except Exception:
+                continue
+            if value is not None:
+                lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, filename):
+        """Write a snapshot to `filename`, Prometheus text for .prom/.txt, JSON otherwise."""
+        if filename.endswith(('.prom', '.txt')):
+            text = self.to_prometheus()
+        else:
+            text = self.to_json()
+        # Replace atomically so a scraper never reads half a file
+        temp = f"{filename}.tmp"
+        with open(temp, 'w') as f:
+            f.write(text)
+        os.replace(temp, filename)
+
+
+class MetricsDumper(threading.Thread):
+    """Dumps `registry` to `filename` every `interval` seconds, and once more when stopped."""
+
+    def __init__(self, registry, filename, interval=1.0):
+        threading.Thread.__init__(self, daemon=True)
+        self.registry = registry
+        self.filename = filename
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self._dump()
+        self._dump()
+
+    def _dump(self):
+        try:
+            self.registry.dump(self.filename)
+        except OSError as e:
+            print(f"Could not write metrics to {self.filename}: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.1f}" if seconds is not None else '-'
+
+
+def format_status(snapshot, previous=None):
+    """One line summary of a snapshot; rates are computed against `previous`."""
+    parts = []
+    captured = snapshot.get('frames_captured_total')
+    if captured is not None:
+        if previous is not None and previous.get('frames_captured_total') is not None:
+            elapsed = snapshot['time'] - previous['time']
+            if elapsed > 0:
+                parts.append(f"{(captured - previous['frames_captured_total']) / elapsed:.1f} fps")
+        parts.append(f"{captured} frames")
+    for name, label in (('frames_dropped_total', 'dropped'), ('frames_duplicated_total', 'duplicated'),
+                        ('audio_overflows_total', 'audio overflows'), ('audio_gaps_total', 'audio gaps')):
+        if snapshot.get(name):
+            parts.append(f"{snapshot[name]} {label}")
+    for name, label in (('grab_seconds', 'grab'), ('encode_seconds', 'encode')):
+        histogram = snapshot.get(name)
+        if histogram and histogram['count']:
+            parts.append(f"{label} p95 {_ms(histogram['p95'])} ms")
+    if snapshot.get('queue_depth') is not None:
+        parts.append(f"queue {snapshot['queue_depth']}")
+    written = sum(snapshot.get(name) or 0 for name in ('output_bytes', 'audio_output_bytes'))
+    if written:
+        if previous is not None:
+            before = sum(previous.get(name) or 0 for name in ('output_bytes', 'audio_output_bytes'))
+            elapsed = snapshot['time'] - previous['time']
+            if elapsed > 0:
+                parts.append(f"{(written - before) / elapsed / 1e6:.2f} MB/s")
+        parts.append(f"{written / 1e6:.1f} MB written")
+    return ', '.join(parts)
+
+
+def path_size(path):
+    """Size of a file, or of every file in a directory; 0 if it does not exist."""
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
@@ -0,0 +1,240 @@
+"""
+Concurrent capture of several monitors or screen regions, one worker process
+per region.
+
+Every worker owns its frame source, pipeline and encoder, so grabbing, scaling
+and encoding of different regions run on different cores instead of taking
+turns on one GIL. Workers first open their source and encoder, then wait for
+the parent to pick the session start time and all start on it. The monotonic
+clock is system wide (CLOCK_MONOTONIC, QueryPerformanceCounter,
+mach_absolute_time), so the outputs share one frame grid and, like a single
+ScreenRecorder, have their first frame at session time zero; audio recorded
+in the parent against the same SessionClock lines up with all of them.
+
+The outputs are separate files, which tile_videos() can stack into one canvas
+afterwards at the positions tile_layout() computed.
+"""
+import multiprocessing
+import queue
+import signal
+import time
+
+from av_sync import SessionClock
+from metrics import MetricsRegistry
+
+# Totals the parent reports over all regions, from the workers' latest snapshots
+SUMMED_METRICS = (
+    ('frames_captured_total', 'counter', 'Frames the capture loops produced, all regions'),
+    ('frames_encoded_total', 'counter', 'Frames written to the encoders, all regions'),
+    ('frames_dropped_total', 'counter', 'Frames dropped because a ring was full, all regions'),
+    ('frames_duplicated_total', 'counter', 'Extra frames written for missed capture ticks, all regions'),
+    ('output_bytes', 'gauge', 'Bytes of video written to disk so far, all regions'),
+)
+
+
+class CaptureRegion:
+    """A monitor or region to record: its bbox, output file and optional output size."""
+
+    def __init__(self, bbox, filename, resolution=None):
+        self.bbox = bbox
+        self.filename = filename
+        self.resolution = resolution
+
+
+def tile_layout(bboxes, resolution=None):
+    """
+    (x, y, width, height) of every bbox on one canvas that keeps their
+    arrangement on the desktop, scaled as a whole to fit `resolution`. Offsets
+    and sizes are even, as yuv420p requires.
+    """
+    left = min(b[0] for b in bboxes)
+    top = min(b[1] for b in bboxes)
+    width = max(b[2] for b in bboxes) - left
+    height = max(b[3] for b in bboxes) - top
+    scale = 1.0 if resolution is None else min(resolution[0] / width, resolution[1] / height)
+    layout = []
+    for x0, y0, x1, y1 in bboxes:
+        layout.append((int((x0 - left) * scale) // 2 * 2, int((y0 - top) * scale) // 2 * 2,
+                       max(2, int((x1 - x0) * scale) // 2 * 2), max(2, int((y1 - y0) * scale) // 2 * 2)))
+    return layout
+
+
+def _parent_alive():
+    parent = multiprocessing.parent_process()
+    return parent is None or parent.is_alive()
+
+
+def _capture_worker(index, region, fps, source, encoder_factory, detect_damage, messages, start_time, go, stop,
+                    status_interval):
+    # Imported here so the spawned process only loads what it records with
+    from av_sync import SyncTrack
+    from frame_sources import select_frame_source
+    from screen_recorder import ScreenRecorder
+
+    # Ctrl+C reaches the whole process group; the parent decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        frame_source = select_frame_source(bbox=region.bbox, candidates=(source,) if source else None)
+        session = SessionClock()
+        recorder = ScreenRecorder(region.resolution, fps, region.filename, frame_source=frame_source,
+                                  encoder_factory=encoder_factory, detect_damage=detect_damage,
+                                  session=session, sync=SyncTrack())
+    except Exception as e:
+        messages.put(('error', index, str(e)))
+        return
+    messages.put(('ready', index, recorder.output_size))
+
+    while not go.wait(1.0):
+        if not _parent_alive():
+            stop.set()
+            break
+    if stop.is_set():
+        # Another region failed to open (or the parent died): nothing to record
+        recorder.out.release()
+        frame_source.close()
+        return
+
+    session.start_time = start_time.value
+    recorder.start()
+    while not stop.wait(status_interval):
+        messages.put(('metrics', index, recorder.metrics.snapshot()))
+        if not recorder.is_alive() or not _parent_alive():
+            break
+    recorder.stop()
+    recorder.join()
+    messages.put(('metrics', index, recorder.metrics.snapshot()))
+    messages.put(('done', index, {
+        'file': region.filename,
+        'size': recorder.output_size,
+        'stats': recorder.pipeline.stats(),
+        'pacing': recorder.scheduler.format_report(),
+        'video_gaps': recorder.sync.video_gaps,
+        'video_start': recorder.sync.video_start,
+    }))
+
+
+class MultiRegionRecorder:
+    """
+    Records `regions` (CaptureRegion) concurrently in worker processes. The
+    interface follows ScreenRecorder: start(), stop(), join(), is_alive(), and
+    `metrics`, which sums the workers' frame counts and output sizes.
+
+    `encoder_factory` is called in the workers and therefore has to be
+    picklable: an encoder class or a functools.partial of one.
+    """
+
+    def __init__(self, regions, fps, source=None, encoder_factory=None, detect_damage=False, session=None,
+                 metrics=None, status_interval=1.0):
+        self.regions = regions
+        self.fps = fps
+        self.source = source
+        self.encoder_factory = encoder_factory
+        self.detect_damage = detect_damage
+        self.session = session if session is not None else SessionClock()
+        self.status_interval = status_interval
+        self.output_sizes = [None] * len(regions)
+        self.snapshots = [None] * len(regions)
+        self.results = [None] * len(regions)
+        self.errors = {}
+        self.processes = []
+        # Spawned, not forked: the parent has threads (audio, Qt) and an X connection
+        self._context = multiprocessing.get_context('spawn')
+        self._messages = self._context.Queue()
+        self._go = self._context.Event()
+        self._stop = self._context.Event()
+        self._start_time = self._context.Value('d', 0.0)
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        for name, kind, help in SUMMED_METRICS:
+            register = self.metrics.counter if kind == 'counter' else self.metrics.gauge
+            register(name, help, function=lambda name=name: self._total(name))
+        self.metrics.gauge('regions_recording', 'Capture worker processes still running',
+                           function=lambda: sum(p.is_alive() for p in self.processes))
+
+    def _total(self, name):
+        return sum((snapshot or {}).get(name) or 0 for snapshot in self.snapshots)
+
+    def start(self, timeout=60.0):
+        """
+        Start the workers, wait until every region is open and start them all on
+        one session start time. Raises RuntimeError if a region cannot be opened.
+        """
+        for index, region in enumerate(self.regions):
+            process = self._context.Process(
+                target=_capture_worker, name=f'capture-{index}', daemon=True,
+                args=(index, region, self.fps, self.source, self.encoder_factory, self.detect_damage,
+                      self._messages, self._start_time, self._go, self._stop, self.status_interval))
+            process.start()
+            self.processes.append(process)
+
+        deadline = time.monotonic() + timeout
+        while None in self.output_sizes and not self.errors:
+            remaining = deadline - time.monotonic()
+            try:
+                self._handle(self._messages.get(timeout=max(0.0, remaining)))
+            except queue.Empty:
+                self.errors[-1] = f"regions did not open within {timeout:.0f} s"
+        if self.errors:
+            self._stop.set()
+            self._go.set()
+            self.join()
+            raise RuntimeError(f"Could not start capture: {'; '.join(self.errors.values())}")
+
+        self._start_time.value = self.session.start()
+        self._go.set()
+        print(f"Recording {len(self.regions)} regions in {len(self.processes)} processes")
+
+    def _handle(self, message):
+        kind, index, payload = message
+        if kind == 'ready':
+            self.output_sizes[index] = payload
+        elif kind == 'error':
+            self.errors[index] = f"region {index}: {payload}"
+        elif kind == 'metrics':
+            self.snapshots[index] = payload
+        elif kind == 'done':
+            self.results[index] = payload
+
+    def poll(self):
+        """Take in the workers' latest status; cheap, call it from the status loop."""
+        while True:
+            try:
+                self._handle(self._messages.get_nowait())
+            except queue.Empty:
+                return
+
+    def is_alive(self):
+        return any(p.is_alive() for p in self.processes)
+
+    def stop(self):
+        self._stop.set()
+        print("Stopping screen recording...")
+
+    def join(self, timeout=60.0):
+        # Keep draining: a worker cannot exit while its queued messages are unread
+        deadline = time.monotonic() + timeout
+        while self.is_alive() and time.monotonic() < deadline:
+            self.poll()
+            time.sleep(0.05)
+        for process in self.processes:
+            if process.is_alive():
+                print(f"{process.name} did not stop, terminating it")
+                process.terminate()
+            process.join()
+        self.poll()
+
+    def video_start(self):
+        """Mean video start (see ScreenRecorder.video_start) of the regions that finished; 0.0 if none did."""
+        starts = [result['video_start'] for result in self.results if result and result['video_start'] is not None]
+        return sum(starts) / len(starts) if starts else 0.0
+
+    def format_stats(self):
+        lines = []
+        for index, result in enumerate(self.results):
+            if result is None:
+                lines.append(f"region {index}: no result")
+                continue
+            stats = result['stats']
+            lines.append(f"region {index} -> {result['file']}: {stats['captured']} captured, "
+                         f"{stats['encoded']} encoded, {stats['dropped']} dropped, "
+                         f"{stats['duplicated']} duplicated; {result['pacing']}")
+        return '\n'.join(lines)
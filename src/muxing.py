@@ -0,0 +1,158 @@
+"""
+Muxing of separately recorded audio and video files with ffmpeg.
+"""
+import os
+import subprocess
+import tempfile
+
+from av_sync import DRIFT_TOLERANCE
+
+
+def pick_audio_codec(audio_file):
+    """Copy compressed audio as is; only PCM has to be encoded for an MP4 container."""
+    return 'aac' if audio_file.lower().endswith('.wav') else 'copy'
+
+
+def build_mux_command(video_file, audio_file, output_file, audio_codec=None, audio_offset=0.0,
+                      audio_tempo=1.0, ffmpeg='ffmpeg', video_codec='copy', video_options=()):
+    """
+    `audio_offset` shifts the audio by that many seconds (timestamps only, the
+    stream is still copied). An `audio_tempo` other than 1.0 stretches the audio
+    to undo sound card clock drift, which needs an audio encode. The video is
+    copied unless `video_codec` says otherwise; `video_options` (e.g. preset
+    and crf) follow it.
+    """
+    if audio_codec is None:
+        audio_codec = pick_audio_codec(audio_file)
+    if audio_tempo != 1.0 and audio_codec == 'copy':
+        audio_codec = 'aac'
+    command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-i', video_file]
+    if audio_offset:
+        command += ['-itsoffset', f'{audio_offset:.6f}']
+    command += ['-i', audio_file, '-map', '0:v', '-map', '1:a', '-c:v', video_codec, *video_options,
+                '-c:a', audio_codec]
+    if audio_tempo != 1.0:
+        command += ['-af', f'atempo={audio_tempo:.8f}']
+    command.append(output_file)
+    return command
+
+
+def sync_corrections(sync):
+    """Offset and tempo that line the audio up with the video for a SyncTrack."""
+    if sync is None:
+        return 0.0, 1.0
+    tempo = sync.drift_ratio()
+    if abs(tempo - 1.0) < DRIFT_TOLERANCE:
+        tempo = 1.0
+    return sync.audio_offset(), tempo
+
+
+def probe_duration(filename, ffprobe='ffprobe'):
+    """Container duration in seconds, or None if ffprobe cannot tell."""
+    command = [ffprobe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', filename]
+    try:
+        output = subprocess.run(command, capture_output=True, text=True).stdout
+        return float(output.strip())
+    except (OSError, ValueError):
+        return None
+
+
+def run_ffmpeg(command, duration=None, progress=None):
+    """
+    Run an ffmpeg command and return its exit code. With a `progress` callback,
+    ffmpeg's -progress output is followed and progress(fraction) is called as
+    output time advances through `duration` seconds, and once with 1.0 at the end.
+    """
+    if progress is None:
+        return subprocess.run(command).returncode
+    command = command[:1] + ['-progress', 'pipe:1', '-nostats'] + command[1:]
+    with subprocess.Popen(command, stdout=subprocess.PIPE, text=True) as process:
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            if key == 'out_time_us' and duration:
+                try:
+                    progress(min(1.0, max(0.0, int(value) / 1e6 / duration)))
+                except ValueError:
+                    pass  # N/A until the first packet is written
+            elif key == 'progress' and value == 'end':
+                progress(1.0)
+    return process.returncode
+
+
+def mux_audio_video(video_file, audio_file, output_file, audio_codec=None, sync=None, ffmpeg='ffmpeg',
+                    progress=None):
+    """Run the mux, correcting offset and drift from `sync` if given, and return ffmpeg's exit code."""
+    audio_offset, audio_tempo = sync_corrections(sync)
+    command = build_mux_command(video_file, audio_file, output_file, audio_codec, audio_offset, audio_tempo, ffmpeg)
+    duration = probe_duration(video_file) if progress is not None else None
+    return run_ffmpeg(command, duration, progress)
+
+
+def build_tile_command(video_files, positions, output_file, audio_file=None, audio_offset=0.0, audio_tempo=1.0,
+                       codec='libx264', preset='veryfast', crf=23, ffmpeg='ffmpeg'):
+    """
+    Stack `video_files` into one canvas, each with its top-left corner at the
+    matching (x, y) of `positions`; uncovered areas are black. The video has to
+    be re-encoded; audio is added as in build_mux_command.
+    """
+    command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y']
+    for video_file in video_files:
+        command += ['-i', video_file]
+    if audio_file is not None:
+        if audio_offset:
+            command += ['-itsoffset', f'{audio_offset:.6f}']
+        command += ['-i', audio_file]
+    inputs = ''.join(f'[{i}:v]' for i in range(len(video_files)))
+    layout = '|'.join(f'{x}_{y}' for x, y in positions)
+    command += ['-filter_complex', f'{inputs}xstack=inputs={len(video_files)}:layout={layout}:fill=black[v]',
+                '-map', '[v]', '-c:v', codec]
+    if preset:
+        command += ['-preset', preset]
+    if codec in ('libx264', 'libx265'):
+        command += ['-crf', str(crf)]
+    command += ['-pix_fmt', 'yuv420p']
+    if audio_file is not None:
+        command += ['-map', f'{len(video_files)}:a', '-c:a', 'aac']
+        if audio_tempo != 1.0:
+            command += ['-af', f'atempo={audio_tempo:.8f}']
+    command.append(output_file)
+    return command
+
+
+def tile_videos(video_files, positions, output_file, audio_file=None, sync=None, codec='libx264',
+                preset='veryfast', crf=23, ffmpeg='ffmpeg', progress=None):
+    """Run the tiling, correcting audio offset and drift from `sync` if given, and return ffmpeg's exit code."""
+    audio_offset, audio_tempo = sync_corrections(sync)
+    command = build_tile_command(video_files, positions, output_file, audio_file, audio_offset, audio_tempo,
+                                 codec, preset, crf, ffmpeg)
+    duration = probe_duration(video_files[0]) if progress is not None else None
+    return run_ffmpeg(command, duration, progress)
+
+
+def read_concat_list(list_file):
+    """Absolute paths of the files named in an ffconcat list."""
+    directory = os.path.dirname(os.path.abspath(list_file))
+    files = []
+    with open(list_file) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('file '):
+                name = line[5:].strip().strip("'")
+                files.append(os.path.join(directory, name))
+    return files
+
+
+def concat_segments(segment_files, output_file, ffmpeg='ffmpeg'):
+    """Join segments end to end without re-encoding and return ffmpeg's exit code."""
+    with tempfile.NamedTemporaryFile('w', suffix='.ffconcat', delete=False) as f:
+        f.write('ffconcat version 1.0\n')
+        for segment in segment_files:
+            escaped = os.path.abspath(segment).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+        list_file = f.name
+    try:
+        command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+                   '-f', 'concat', '-safe', '0', '-i', list_file, '-map', '0', '-c', 'copy', output_file]
+        return subprocess.run(command).returncode
+    finally:
+        os.remove(list_file)
@@ -0,0 +1,347 @@
+"""
+Sidecar index of a finished recording: keyframes, scene changes and a
+thumbnail strip, and lossless trimming on keyframe boundaries.
+
+Keyframe times and byte offsets are read from the MP4 sample tables (stss,
+stts, ctts, stsc, stsz, stco), so an hour-long file is indexed without
+decoding a single frame. Scene changes and thumbnails come from one ffmpeg
+pass that decodes only the keyframes (or, with `sample_fps`, frames at that
+rate) at thumbnail size. Consecutive frames are compared by their gray-level
+histograms on a grid of tiles, which is cheap and also catches a window
+moving across the same colours. x264 already places keyframes on cuts, so
+keyframes alone find most scene changes.
+
+trim() cuts a clip with a stream copy starting at a keyframe, so it takes as
+long as copying the clip's packets, not re-encoding them.
+"""
+import json
+import os
+import struct
+import subprocess
+
+import cv2
+import numpy as np
+
+INDEX_VERSION = 1
+MP4_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+
+THUMBNAIL_WIDTH = 160
+# Tiles per side and gray levels of the scene histograms
+SCENE_GRID = 4
+SCENE_BINS = 16
+
+
+def index_filename(video_file):
+    return video_file.rsplit('.', 1)[0] + '.index.json'
+
+
+def thumbnails_filename(video_file):
+    return video_file.rsplit('.', 1)[0] + '.thumbs.jpg'
+
+
+def _boxes(f, start, end):
+    """(type, payload start, payload end) of the MP4 boxes between start and end."""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header:
+            return
+        yield kind.decode('latin-1'), position + header, position + size
+        position += size
+
+
+def _children(f, start, end):
+    return {kind: (s, e) for kind, s, e in _boxes(f, start, end)}
+
+
+def _read(f, span):
+    f.seek(span[0])
+    return f.read(span[1] - span[0])
+
+
+def _table(data, columns, dtype='>u4', header=8):
+    """Entries of a full box table: version/flags, entry count, then `columns` values per entry."""
+    count = struct.unpack_from('>I', data, 4)[0]
+    values = np.frombuffer(data, dtype=dtype, count=count * columns, offset=header)
+    return values.reshape(count, columns).astype(np.int64)
+
+
+def read_mp4_keyframes(filename):
+    """
+    Keyframes of the first video track of an MP4/MOV file, from its sample
+    tables: {'width', 'height', 'frames', 'duration', 'keyframes': [{'time',
+    'offset'}]} with presentation times in seconds and byte offsets into the
+    file. Raises ValueError if the file has no such track.
+    """
+    with open(filename, 'rb') as f:
+        end = os.fstat(f.fileno()).st_size
+        top = _children(f, 0, end)
+        if 'moov' not in top:
+            raise ValueError(f"{filename} has no MP4 movie box (still being written?)")
+        for kind, start, stop in _boxes(f, *top['moov']):
+            if kind != 'trak':
+                continue
+            trak = _children(f, start, stop)
+            mdia = _children(f, *trak['mdia'])
+            if _read(f, mdia['hdlr'])[8:12] != b'vide':
+                continue
+            mdhd = _read(f, mdia['mdhd'])
+            timescale = struct.unpack_from('>I', mdhd, 20 if mdhd[0] == 1 else 12)[0]
+            tkhd = _read(f, trak['tkhd'])
+            width, height = (v >> 16 for v in struct.unpack_from('>II', tkhd, len(tkhd) - 8))
+            stbl = _children(f, *_children(f, *mdia['minf'])['stbl'])
+            return _keyframes(f, trak, stbl, timescale, width, height)
+    raise ValueError(f"{filename} has no video track")
+
+
+def _keyframes(f, trak, stbl, timescale, width, height):
+    # Decode times from the run-length coded sample durations
+    stts = _table(_read(f, stbl['stts']), 2)
+    deltas = np.repeat(stts[:, 1], stts[:, 0])
+    count = len(deltas)
+    dts = np.concatenate(([0], np.cumsum(deltas)[:-1])) if count else deltas
+    pts = dts
+    if 'ctts' in stbl:
+        data = _read(f, stbl['ctts'])
+        ctts = _table(data, 2, '>i4' if data[0] == 1 else '>u4')
+        pts = dts + np.repeat(ctts[:, 1], ctts[:, 0])[:count]
+    # An edit list moves presentation time zero to `media_time` (x264 B-frame delay)
+    if 'edts' in trak:
+        edts = _children(f, *trak['edts'])
+        if 'elst' in edts:
+            data = _read(f, edts['elst'])
+            if data[0] == 1:
+                entries = _table(data, 5, '>i4')  # u64 duration, i64 media time, rate as 32-bit halves
+                media_times = (entries[:, 2] << 32) | (entries[:, 3] & 0xFFFFFFFF)
+            else:
+                media_times = _table(data, 3, '>i4')[:, 1]
+            media_times = media_times[media_times >= 0]
+            if len(media_times):
+                pts = pts - media_times[0]
+
+    # Byte offsets: chunk offsets plus the sizes of the samples before it in the chunk
+    stsz = _read(f, stbl['stsz'])
+    sample_size, sample_count = struct.unpack_from('>II', stsz, 4)
+    sizes = (np.full(sample_count, sample_size, dtype=np.int64) if sample_size
+             else np.frombuffer(stsz, dtype='>u4', count=sample_count, offset=12).astype(np.int64))
+    if 'co64' in stbl:
+        chunk_offsets = _table(_read(f, stbl['co64']), 1, '>u8')[:, 0]
+    else:
+        chunk_offsets = _table(_read(f, stbl['stco']), 1)[:, 0]
+    stsc = _table(_read(f, stbl['stsc']), 3)
+    runs = np.diff(np.append(stsc[:, 0], len(chunk_offsets) + 1))
+    per_chunk = np.repeat(stsc[:, 1], runs)
+    chunk_of_sample = np.repeat(np.arange(len(per_chunk)), per_chunk)[:sample_count]
+    first_in_chunk = np.concatenate(([0], np.cumsum(per_chunk)[:-1]))
+    cumulative = np.concatenate(([0], np.cumsum(sizes)))
+    offsets = (chunk_offsets[chunk_of_sample] + cumulative[:sample_count]
+               - cumulative[first_in_chunk[chunk_of_sample]])
+
+    if 'stss' in stbl:
+        sync = _table(_read(f, stbl['stss']), 1)[:, 0] - 1
+    else:
+        sync = np.arange(count)  # Every sample is a keyframe
+    sync = sync[sync < min(count, sample_count)]
+    keyframes = [{'time': round(float(pts[i]) / timescale, 6), 'offset': int(offsets[i])} for i in sync]
+    keyframes.sort(key=lambda k: k['time'])
+    duration = float(dts[-1] + deltas[-1]) / timescale if count else 0.0
+    return {'width': width, 'height': height, 'frames': count, 'duration': duration, 'keyframes': keyframes}
+
+
+def probe_keyframes(filename, ffprobe='ffprobe'):
+    """read_mp4_keyframes for any container, through ffprobe's packet list (slower, reads the file)."""
+    command = [ffprobe, '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+               'stream=width,height:packet=pts_time,duration_time,pos,flags', '-of', 'json', filename]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True)
+    except OSError as e:
+        raise ValueError(f"cannot probe {filename}: {e}")
+    if result.returncode != 0:
+        raise ValueError(f"ffprobe failed on {filename}: {result.stderr.strip()}")
+    data = json.loads(result.stdout)
+    stream = (data.get('streams') or [{}])[0]
+    packets = [p for p in data.get('packets', []) if p.get('pts_time') not in (None, 'N/A')]
+    keyframes = sorted(({'time': float(p['pts_time']), 'offset': int(p.get('pos') or -1)}
+                        for p in packets if 'K' in p.get('flags', '')), key=lambda k: k['time'])
+    duration = max((float(p['pts_time']) + float(p.get('duration_time') or 0) for p in packets), default=0.0)
+    return {'width': stream.get('width'), 'height': stream.get('height'), 'frames': len(packets),
+            'duration': duration, 'keyframes': keyframes}
+
+
+def read_keyframes(filename, ffprobe='ffprobe'):
+    if filename.lower().endswith(MP4_EXTENSIONS):
+        return read_mp4_keyframes(filename)
+    return probe_keyframes(filename, ffprobe)
+
+
+def decode_thumbnails(filename, width, height, sample_fps=None, thumbnail_width=THUMBNAIL_WIDTH, ffmpeg='ffmpeg'):
+    """
+    Yield small BGR frames of the video: every keyframe, or `sample_fps`
+    frames per second. Only those frames are scaled and handed over.
+    """
+    thumb_height = max(2, round(height * thumbnail_width / width / 2) * 2)
+    command = [ffmpeg, '-hide_banner', '-loglevel', 'error']
+    scale = f'scale={thumbnail_width}:{thumb_height}'
+    if sample_fps is None:
+        command += ['-skip_frame', 'nokey', '-i', filename, '-map', '0:v:0', '-fps_mode', 'passthrough',
+                    '-vf', scale]
+    else:
+        command += ['-i', filename, '-map', '0:v:0', '-vf', f'fps={sample_fps},{scale}']
+    command += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1']
+    frame_bytes = thumbnail_width * thumb_height * 3
+    with subprocess.Popen(command, stdout=subprocess.PIPE) as process:
+        while True:
+            data = process.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                break
+            yield np.frombuffer(data, dtype=np.uint8).reshape(thumb_height, thumbnail_width, 3)
+    if process.returncode != 0:
+        raise OSError(f"ffmpeg could not decode {filename} (code {process.returncode})")
+
+
+def tile_histograms(frame, grid=SCENE_GRID, bins=SCENE_BINS):
+    """Normalized gray-level histogram of every tile of a grid x grid split, as one (tiles, bins) array."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    height, width = gray.shape
+    rows = np.minimum(np.arange(height) * grid // height, grid - 1)
+    cols = np.minimum(np.arange(width) * grid // width, grid - 1)
+    tiles = rows[:, None] * grid + cols[None, :]
+    levels = gray.astype(np.intp) * bins // 256
+    counts = np.bincount((tiles * bins + levels).ravel(), minlength=grid * grid * bins)
+    counts = counts.reshape(grid * grid, bins).astype(np.float32)
+    return counts / counts.sum(axis=1, keepdims=True)
+
+
+def scene_score(previous, current):
+    """Mean total variation distance between the tile histograms: 0 identical, 1 nothing in common."""
+    return float(np.abs(previous - current).sum(axis=1).mean() / 2.0)
+
+
+def build_index(filename, thumbnails=10, scene_threshold=0.3, sample_fps=None, ffmpeg='ffmpeg',
+                ffprobe='ffprobe'):
+    """
+    Index `filename` and write the sidecar index (and, with `thumbnails`, the
+    strip) next to it. Returns the index.
+    """
+    info = read_keyframes(filename, ffprobe)
+    stat = os.stat(filename)
+    index = {
+        'version': INDEX_VERSION,
+        'file': os.path.basename(filename),
+        'bytes': stat.st_size,
+        'mtime': stat.st_mtime,
+        'width': info['width'],
+        'height': info['height'],
+        'frames': info['frames'],
+        'duration': info['duration'],
+        'keyframes': info['keyframes'],
+        'scenes': [],
+    }
+
+    if thumbnails or scene_threshold is not None:
+        if sample_fps is None:
+            times = [k['time'] for k in info['keyframes']]
+        else:
+            times = None
+        frames = []
+        previous = None
+        for n, frame in enumerate(decode_thumbnails(filename, info['width'], info['height'], sample_fps,
+                                                    ffmpeg=ffmpeg)):
+            if times is not None and n >= len(times):
+                break
+            time = times[n] if times is not None else n / sample_fps
+            histograms = tile_histograms(frame)
+            if previous is not None and scene_threshold is not None:
+                score = scene_score(previous, histograms)
+                if score >= scene_threshold:
+                    index['scenes'].append({'time': time, 'score': round(score, 4)})
+            previous = histograms
+            frames.append((time, frame))
+
+        if thumbnails and frames:
+            # Evenly spaced over the recording, each the nearest decoded frame
+            duration = index['duration'] or frames[-1][0]
+            targets = [duration * (i + 0.5) / thumbnails for i in range(thumbnails)]
+            chosen = sorted({min(range(len(frames)), key=lambda i: abs(frames[i][0] - t)) for t in targets})
+            strip = cv2.hconcat([frames[i][1] for i in chosen])
+            strip_file = thumbnails_filename(filename)
+            cv2.imwrite(strip_file, strip)
+            index['thumbnails'] = {
+                'file': os.path.basename(strip_file),
+                'width': strip.shape[1] // len(chosen),
+                'height': strip.shape[0],
+                'times': [frames[i][0] for i in chosen],
+            }
+
+    with open(index_filename(filename), 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+def load_index(filename):
+    """The sidecar index of `filename`, or None if there is none or the file changed since."""
+    try:
+        with open(index_filename(filename)) as f:
+            index = json.load(f)
+        stat = os.stat(filename)
+    except (OSError, ValueError):
+        return None
+    if (index.get('version') != INDEX_VERSION or index.get('bytes') != stat.st_size
+            or index.get('mtime') != stat.st_mtime):
+        return None
+    return index
+
+
+def keyframe_at(keyframes, time, snap='before'):
+    """
+    Time of the keyframe at or before `time` ('before', never cuts off
+    anything asked for) or at or after it ('after', never includes anything
+    before it).
+    """
+    times = [k['time'] for k in keyframes]
+    if not times:
+        return 0.0
+    if snap == 'before':
+        candidates = [t for t in times if t <= time + 1e-6]
+        return candidates[-1] if candidates else times[0]
+    if snap == 'after':
+        candidates = [t for t in times if t >= time - 1e-6]
+        return candidates[0] if candidates else times[-1]
+    raise ValueError(f"Unknown snap mode: {snap}")
+
+
+def build_trim_command(input_file, output_file, start, end=None, ffmpeg='ffmpeg'):
+    # Seeking on the input lands on the keyframe at or before the position; a
+    # millisecond past `start` keeps rounding from picking the one before it
+    command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y']
+    if start > 0:
+        command += ['-ss', f'{start + 0.001:.6f}']
+    command += ['-i', input_file]
+    if end is not None:
+        command += ['-t', f'{end - start:.6f}']
+    command += ['-map', '0', '-c', 'copy', '-avoid_negative_ts', 'make_zero', output_file]
+    return command
+
+
+def trim(input_file, output_file, start=0.0, end=None, snap='before', ffmpeg='ffmpeg', ffprobe='ffprobe'):
+    """
+    Copy `start`..`end` seconds of `input_file` into `output_file` without
+    re-encoding. The start moves to a keyframe as `snap` says (see
+    keyframe_at); the end is exact to the frame. Keyframes come from the
+    sidecar index if it is current, otherwise from the sample tables. Returns
+    (ffmpeg exit code, actual start).
+    """
+    index = load_index(input_file)
+    keyframes = index['keyframes'] if index is not None else read_keyframes(input_file, ffprobe)['keyframes']
+    actual_start = keyframe_at(keyframes, start, snap)
+    if end is not None and end <= actual_start:
+        raise ValueError(f"The clip would be empty: it starts at the keyframe at {actual_start:.3f} s")
+    command = build_trim_command(input_file, output_file, actual_start, end, ffmpeg)
+    return subprocess.run(command).returncode, actual_start
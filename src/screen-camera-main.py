@@ -1,35 +1,17 @@
 import sys
 import os
 import datetime
-import cv2
-import numpy as np
-from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QVBoxLayout, QWidget, QFileDialog, QLabel, QComboBox, QAction, QMenu, QSystemTrayIcon, QStyle)
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QVBoxLayout, QWidget, QFileDialog, QLabel, QComboBox, QAction, QMenu, QSystemTrayIcon, QStyle, QShortcut)
 from PyQt5.QtGui import QIcon, QKeySequence
-from PyQt5.QtCore import QThread, pyqtSignal, QTimer
 import pyaudio
 from audio_recorder import AudioRecorder
+from camera_overlay import CORNERS, CameraCapture, CameraOverlay
+from frame_sources import select_frame_source
 from screen_recorder import ScreenRecorder
+from muxing import mux_audio_video
 
-class CameraFeedThread(QThread):
-    def __init__(self, camera_index=0):
-        super().__init__()
-        self.camera_index = camera_index
-        self.capture = cv2.VideoCapture(self.camera_index)
-        self.running = True
-        self.frame = None
-    
-    def run(self):
-        while self.running:
-            ret, frame = self.capture.read()
-            if ret:
-                self.frame = frame
-        self.capture.release()
-
-    def stop(self):
-        self.running = False
-
-    def get_frame(self):
-        return self.frame
+# Camera overlay width as a fraction of the screen width
+CAMERA_SIZES = {'Small': 0.15, 'Medium': 0.25, 'Large': 0.35}
 
 class RecorderApp(QMainWindow):
     def __init__(self):
@@ -72,6 +54,14 @@ class RecorderApp(QMainWindow):
 
         self.resolution_combo = QComboBox(self)
         self.resolution_combo.addItems(['1920x1080', '1280x720', '640x480'])
+
+        self.camera_corner_combo = QComboBox(self)
+        self.camera_corner_combo.addItems(list(CORNERS))
+        self.camera_corner_combo.setCurrentText('bottom-right')
+
+        self.camera_size_combo = QComboBox(self)
+        self.camera_size_combo.addItems(list(CAMERA_SIZES))
+        self.camera_size_combo.setCurrentText('Medium')
         
         self.start_button.clicked.connect(self.start_recording)
         self.stop_button.clicked.connect(self.stop_recording)
@@ -79,6 +69,10 @@ class RecorderApp(QMainWindow):
         layout = QVBoxLayout()
         layout.addWidget(self.file_location_button)
         layout.addWidget(self.resolution_combo)
+        layout.addWidget(QLabel('Camera Position:', self))
+        layout.addWidget(self.camera_corner_combo)
+        layout.addWidget(QLabel('Camera Size:', self))
+        layout.addWidget(self.camera_size_combo)
         layout.addWidget(self.start_button)
         layout.addWidget(self.stop_button)
         layout.addWidget(self.file_label)
@@ -96,11 +90,7 @@ class RecorderApp(QMainWindow):
         self.stop_shortcut = QShortcut(QKeySequence('Ctrl+S'), self)
         self.stop_shortcut.activated.connect(self.stop_recording)
 
-        # Initialize Camera Feed Thread
-        self.camera_thread = CameraFeedThread()
-        self.camera_feed = None
-        self.camera_timer = QTimer()
-        self.camera_timer.timeout.connect(self.update_camera_feed)
+        self.camera_thread = None
 
     def tray_icon_activated(self, reason):
         if reason == QSystemTrayIcon.Trigger:
@@ -124,20 +114,30 @@ class RecorderApp(QMainWindow):
         resolution = (width, height)
         
         timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        audio_filename = os.path.join(self.file_location, f"output_{timestamp}.mp3")
+        audio_filename = os.path.join(self.file_location, f"output_{timestamp}.m4a")
         screen_filename = os.path.join(self.file_location, f"output_{timestamp}.mp4")
         combined_filename = os.path.join(self.file_location, f"combined_{timestamp}.mp4")
+
+        try:
+            frame_source = select_frame_source()
+        except OSError as e:
+            self.file_label.setText(f"Error: {e}")
+            return
         
+        # The camera thread hands its newest frame to the overlay, which the screen
+        # recorder draws into every captured frame
+        self.camera_thread = CameraCapture.open(0)
+        overlay = CameraOverlay(self.camera_thread.slot, corner=self.camera_corner_combo.currentText(),
+                                size=CAMERA_SIZES[self.camera_size_combo.currentText()])
+
         self.audio_recorder = AudioRecorder(self.audio_format, self.audio_channels, self.audio_rate, self.audio_chunk, audio_filename)
-        self.screen_recorder = ScreenRecorder(resolution, self.fps, screen_filename)
+        self.screen_recorder = ScreenRecorder(resolution, self.fps, screen_filename, frame_source=frame_source,
+                                              overlay=overlay)
         
+        self.camera_thread.start()
         self.audio_recorder.start()
         self.screen_recorder.start()
         
-        # Start camera feed
-        self.camera_thread.start()
-        self.camera_timer.start(30)  # Update camera feed every 30 ms
-        
         self.file_label.setText("Recording...")
         self.hide()  # Minimize the main window to the taskbar
 
@@ -149,34 +149,40 @@ class RecorderApp(QMainWindow):
             self.audio_recorder.stop()
             self.screen_recorder.stop()
             self.camera_thread.stop()
-            self.camera_timer.stop()
+            self.audio_recorder.join()
+            self.screen_recorder.join()
+            # The camera is released on its own thread; wait for it so the device
+            # is free again before the files are combined. read() blocks for at
+            # most a frame, or the retry interval when the camera is gone
+            self.camera_thread.join(timeout=5)
             self.file_label.setText("Recording stopped. Combining files...")
 
             # Combine audio and video
-            self.combine_audio_video(self.audio_recorder.filename, self.screen_recorder.filename, self.combined_filename)
-            
-            self.file_label.setText(f"Files combined and saved as: {self.combined_filename}")
+            if not self.screen_recorder.succeeded:
+                self.file_label.setText(f"Error: screen recording failed, audio kept in {self.audio_recorder.filename}")
+            elif self.combine_audio_video(self.audio_recorder.filename, self.screen_recorder.filename,
+                                          self.combined_filename):
+                self.file_label.setText(f"Files combined and saved as: {self.combined_filename}")
+            else:
+                self.file_label.setText("Error: combining audio and video failed, the separate files are kept")
             self.restore_from_tray()  # Restore the main window after stopping
         except Exception as e:
             self.file_label.setText(f"Error: {e}")
             print(f"Error during stopping recording: {e}")
 
-    def update_camera_feed(self):
-        frame = self.camera_thread.get_frame()
-        if frame is not None:
-            # Resize and overlay camera feed
-            frame = cv2.resize(frame, (160, 120))  # Resize to small rectangle
-            # Use the OpenCV API to overlay the camera feed on the screen recording
-            # Implement as needed based on the screen recording setup
-
     def combine_audio_video(self, audio_file, video_file, output_file):
+        """Mux the two files into `output_file`; returns whether ffmpeg succeeded."""
         try:
-            # Command to combine audio and video using ffmpeg
-            command = f'ffmpeg -i "{video_file}" -i "{audio_file}" -c:v copy -c:a aac -strict experimental "{output_file}"'
-            os.system(command)
-            print(f"Combined file saved as: {output_file}")
+            # Audio is already AAC, both streams are copied
+            result = mux_audio_video(video_file, audio_file, output_file)
         except Exception as e:
             print(f"Error during combining audio and video: {e}")
+            return False
+        if result != 0:
+            print(f"Error during combining audio and video: ffmpeg exited with code {result}")
+            return False
+        print(f"Combined file saved as: {output_file}")
+        return True
 
     def restore_from_tray(self):
         self.show()  # Show the main window
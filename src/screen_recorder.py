@@ -1,50 +1,157 @@
-import cv2
-import numpy as np
-from PIL import ImageGrab
-import threading
-import time
-
-class ScreenRecorder(threading.Thread):
-    def __init__(self, resolution, fps, filename):
-        threading.Thread.__init__(self)
-        self.resolution = resolution
-        self.fps = fps
-        self.filename = filename
-        self.is_recording = False
-        self.out = cv2.VideoWriter(self.filename, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, self.get_screen_resolution())
-
-    def get_screen_resolution(self):
-        screen = ImageGrab.grab()
-        return screen.size
-
-    def run(self):
-        self.is_recording = True
-        screen_resolution = self.get_screen_resolution()
-        print(f"Screen recording started with resolution {screen_resolution}...")
-
-        try:
-            while self.is_recording:
-                start_time = time.time()
-                
-                img = ImageGrab.grab(bbox=(0, 0, screen_resolution[0], screen_resolution[1]))
-                frame = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-                self.out.write(frame)
-                print("Frame captured")  # Debug print to check frame capturing
-
-                elapsed_time = time.time() - start_time
-                sleep_time = (1.0 / self.fps) - elapsed_time
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-        except Exception as e:
-            print(f"Error during screen recording: {e}")
-        finally:
-            self.out.release()
-            print(f"Screen recording saved as {self.filename}")
-
-    def stop(self):
-        self.is_recording = False
-        print("Stopping screen recording...")
-
-# Ensure ImageGrab works in the current environment
-if not hasattr(ImageGrab, 'grab'):
-    raise ImportError("PIL.ImageGrab module is not available in this environment.")
+"""
+My Recorder App - A screen and audio recording application.
+"""
+import threading
+
+import numpy as np
+
+from damage import DamageDetector
+from frame_pipeline import FramePipeline, DROP_OLDEST
+from frame_scheduler import FrameScheduler
+from frame_sources import fit_resolution, select_frame_source
+from metrics import MetricsRegistry, path_size
+from shm_transport import ProcessFramePipeline
+from video_encoders import OpenCVVideoEncoder, segment_directory
+
+class ScreenRecorder(threading.Thread):
+    def __init__(self, resolution, fps, filename, frame_source=None,
+                 drop_policy=DROP_OLDEST, buffer_frames=8, encoder_workers=1, encoder_factory=None,
+                 detect_damage=False, session=None, sync=None, region=None, overlay=None,
+                 metrics=None, encoder_process=False):
+        threading.Thread.__init__(self)
+        self.resolution = resolution
+        self.fps = fps
+        self.filename = filename
+        self.is_recording = False
+        # Set once run() has finished: what the encoder's release() returned, and
+        # the exception that ended the capture or the release, if any
+        self.release_result = None
+        self.error = None
+        # `region` is a capture bbox (left, top, right, bottom); `resolution` the
+        # output size the frames are scaled to fit, None to keep the capture size
+        self.frame_source = frame_source or select_frame_source(bbox=region)
+        width, height = self.output_size = fit_resolution(self.get_screen_resolution(), resolution)
+        capture_width, capture_height = self.get_screen_resolution()
+        # Shared with AudioRecorder and the UI; the pipeline adds its timings and counts
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        # encoder_factory(filename, fps, size) lets callers swap in e.g. FFmpegPipeEncoder
+        encoder_factory = encoder_factory or OpenCVVideoEncoder
+        if encoder_process:
+            # The encoder runs in its own process and reads frames from shared memory;
+            # self.out is its handle (release, audio_sink and save_replay are forwarded)
+            self.pipeline = ProcessFramePipeline(encoder_factory, self.filename, self.fps, (width, height),
+                                                 capacity=buffer_frames, policy=drop_policy,
+                                                 capture_shape=(capture_height, capture_width, 3),
+                                                 metrics=self.metrics)
+            self.out = self.pipeline.encoder
+        else:
+            self.out = encoder_factory(self.filename, self.fps, (width, height))
+            self.pipeline = FramePipeline(self.out, (height, width, 3), capacity=buffer_frames,
+                                          policy=drop_policy, workers=encoder_workers,
+                                          capture_shape=(capture_height, capture_width, 3), metrics=self.metrics)
+        self.metrics.gauge('output_bytes', 'Bytes of video written to disk so far',
+                           function=lambda: path_size(self.filename) + path_size(segment_directory(self.filename)))
+        # Unchanged frames are not copied into the ring, the encoder repeats the last one
+        self.damage = DamageDetector() if detect_damage else None
+        # Optional stage drawn into every captured frame in place, e.g. a CameraOverlay
+        self.overlay = overlay
+        # With a shared SessionClock the first frame is stretched back to session start
+        self.session = session
+        self.sync = sync
+        self.scheduler = FrameScheduler(self.fps, clock=session.clock) if session else FrameScheduler(self.fps)
+
+    def get_screen_resolution(self):
+        return self.frame_source.size
+
+    def run(self):
+        self.is_recording = True
+        screen_resolution = self.get_screen_resolution()
+        print(f"Screen recording started with resolution {screen_resolution} -> {self.output_size} "
+              f"using '{self.frame_source.name}'...")
+
+        self.pipeline.start()
+        if self.session is not None:
+            self.scheduler.start(self.session.start_time)
+        else:
+            self.scheduler.start()
+        try:
+            while self.is_recording:
+                pts = self.scheduler.wait()
+                index = self.pipeline.acquire()
+                frame = self.pipeline.capture(index, self.frame_source, self.overlay) if index is not None else None
+                # A frame that overran its interval stands in for the ticks it missed
+                step = self.scheduler.step
+                repeat = self.scheduler.advance()
+                if repeat > step and self.sync is not None:
+                    self.sync.mark_video_gap(pts, repeat - step)
+                if index is None:
+                    self.pipeline.discard(repeat)
+                elif self.damage is not None and not self.damage.update(frame).changed:
+                    self.pipeline.cancel(index)
+                    self.pipeline.push_unchanged(repeat)
+                else:
+                    self.pipeline.commit(index, repeat)
+        except Exception as e:
+            print(f"Error during screen recording: {e}")
+            self.error = e
+        finally:
+            if self.sync is not None:
+                self.sync.mark_video_start(self.video_start())
+            try:
+                self.pipeline.close()
+                self.release_result = self.out.release()
+            except Exception as e:
+                print(f"Error finishing {self.filename}: {e}")
+                self.error = self.error or e
+            finally:
+                self.frame_source.close()
+            if self.succeeded:
+                print(f"Screen recording saved as {self.filename} ({self.format_stats()})")
+            else:
+                print(f"Screen recording to {self.filename} failed ({self.format_stats()})")
+            print(f"Frame pacing: {self.scheduler.format_report()}")
+
+    @property
+    def succeeded(self):
+        """Whether the capture and the encoder finished cleanly; only meaningful once run() returned."""
+        return self.error is None and not self.release_result
+
+    def video_start(self):
+        """
+        Session time of the content at video stream time zero: how far capture
+        runs behind the frame grid. The median lateness, because the first
+        frame, stretched back to session start, is usually late.
+        """
+        if not self.scheduler.lateness:
+            return 0.0
+        return float(np.median(np.frombuffer(self.scheduler.lateness, dtype=np.float64)))
+
+    def format_stats(self):
+        stats = self.pipeline.stats()
+        summary = (f"{stats['captured']} captured, {stats['encoded']} encoded, "
+                   f"{stats['dropped']} dropped, {stats['duplicated']} duplicated")
+        if stats['skipped']:
+            summary += f", {stats['skipped']} skipped at a lowered capture rate"
+        if self.damage is not None:
+            damage = self.damage.summary()
+            summary += (f", {damage['unchanged']} unchanged, "
+                        f"{damage['mean_dirty_fraction']:.0%} of the screen dirty on average")
+        if self.overlay is not None:
+            overlay = self.overlay.summary()
+            summary += f", overlay {overlay['mean_ms']:.2f} ms per frame"
+        return summary
+
+    def set_capture_step(self, step):
+        """Capture every `step`-th frame, repeating it in between; the output frame rate stays the same."""
+        self.scheduler.set_step(step)
+        self.pipeline.set_step(step)
+
+    def set_scale(self, scale):
+        """Capture at `scale` times the output size; only for pipelines that are `scalable`."""
+        if not self.pipeline.scalable:
+            raise ValueError("This pipeline cannot change the capture scale")
+        self.pipeline.set_scale(scale)
+
+    def stop(self):
+        self.is_recording = False
+        print("Stopping screen recording...")
@@ -0,0 +1,429 @@
+"""
+Shared-memory frame transport between the capture loop and an encoder process.
+
+In the default pipeline, frame conversion and the encoder's write() run on
+threads of the recording process and compete for the GIL with the audio
+thread and the Qt event loop. ProcessFramePipeline keeps the capture side of
+FramePipeline but moves the encoder into a separate process:
+
+- the frame slots live in one multiprocessing.shared_memory block that the
+  capture loop grabs into and the encoder process reads from;
+- only fixed-size messages cross the process boundary: (slot, repeat,
+  capture time) to the encoder, and (freed slot, frames written, encode time,
+  capture time) back. Pixel data is never pickled or copied between processes.
+
+The encoder process finishes its file when it is told to stop or when the
+recording process goes away (end of file on its pipe), so a crash of the
+recorder still leaves a playable file. The shared block is unlinked by the
+recording process on release(); if that process dies first, the
+multiprocessing resource tracker removes it once both sides have exited.
+"""
+import collections
+import multiprocessing
+import signal
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from frame_pipeline import BLOCK, DROP_OLDEST, DROP_POLICIES, CapturePipeline
+
+# Recording process -> encoder: slot (-1 repeats the last frame), repeat count, capture time
+FRAME = struct.Struct('<iid')
+# Encoder -> recording process, after b'A': freed slot (-1 for none), frames written,
+# seconds spent in write(), capture time of the message being acknowledged
+ACK = struct.Struct('<iidd')
+
+REPEAT_LAST = -1
+
+
+class SharedFrameRing:
+    """
+    Capture-side half of a FrameRing whose slots are in shared memory and whose
+    consumer is another process. acquire/publish/extend/discard/release behave
+    as in FrameRing, except that a published frame cannot be taken back, so a
+    full ring drops the incoming frame under DROP_OLDEST too (its duration
+    still goes to the next frame).
+    """
+
+    def __init__(self, capacity, shape, policy=DROP_OLDEST, context=None):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {policy}")
+        if capacity < 2:
+            raise ValueError("A frame ring needs at least two slots")
+        context = context or multiprocessing.get_context('spawn')
+        self.policy = policy
+        self.capacity = capacity
+        self.shape = tuple(shape)
+        frame_bytes = int(np.prod(self.shape))
+        self.memory = shared_memory.SharedMemory(create=True, size=capacity * frame_bytes)
+        self._block = np.ndarray((capacity, *self.shape), dtype=np.uint8, buffer=self.memory.buf)
+        self.slots = list(self._block)
+        self.reader, self._writer = context.Pipe(duplex=False)
+        self._free = collections.deque(range(capacity))
+        self._cond = threading.Condition()
+        self._closed = False
+        self.failed = False
+        self._carry = 0
+        self.sent = 0
+        self.completed = 0
+        self.encoded = 0
+        self.dropped = 0
+
+    @property
+    def depth(self):
+        """Messages the encoder process has not acknowledged yet."""
+        return self.sent - self.completed
+
+    def _send(self, index, repeat):
+        # Called with the lock held, so sends from different threads never interleave
+        try:
+            self._writer.send_bytes(FRAME.pack(index, repeat, time.monotonic()))
+        except OSError:
+            self._fail()
+            return
+        self.sent += 1
+
+    def _fail(self):
+        self.failed = True
+        self._closed = True
+        self._cond.notify_all()
+
+    def acquire(self):
+        """Return a free slot index, or None when the incoming frame has to be dropped."""
+        with self._cond:
+            while not self._free:
+                if self.failed:
+                    raise OSError("The encoder process exited")
+                if self._closed or self.policy != BLOCK:
+                    return None
+                self._cond.wait()
+            if self.failed:
+                raise OSError("The encoder process exited")
+            return self._free.popleft()
+
+    def discard(self, repeat=1):
+        with self._cond:
+            self._carry += repeat
+            self.dropped += 1
+
+    def publish(self, index, repeat=1):
+        with self._cond:
+            self._send(index, repeat + self._carry)
+            self._carry = 0
+
+    def extend(self, repeat=1):
+        with self._cond:
+            if self.depth >= 2 * self.capacity:
+                # The encoder is behind; fold the repeat into the next message
+                # instead of queueing one message per unchanged frame
+                self._carry += repeat
+                return
+            self._send(REPEAT_LAST, repeat + self._carry)
+            self._carry = 0
+
+    def release(self, index):
+        if index is None or index < 0:
+            return
+        with self._cond:
+            self._free.append(index)
+            self._cond.notify_all()
+
+    def acknowledge(self, index, frames):
+        with self._cond:
+            self.completed += 1
+            self.encoded += frames
+            if index >= 0:
+                self._free.append(index)
+            self._cond.notify_all()
+
+    def send_control(self, message):
+        """Send a control message (anything but a frame) to the encoder process."""
+        with self._cond:
+            try:
+                self._writer.send_bytes(message)
+            except OSError:
+                self._fail()
+                return False
+            return True
+
+    def close(self):
+        """Tell the encoder process to finish once it has written every frame sent so far."""
+        with self._cond:
+            if not self._closed:
+                if self._carry:
+                    # Dropped or folded repeats still owed to the last frame
+                    self._send(REPEAT_LAST, self._carry)
+                    self._carry = 0
+                try:
+                    self._writer.send_bytes(b'')
+                except OSError:
+                    pass
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.close()
+
+    def encoder_exited(self):
+        """The encoder process is gone; nothing will be freed any more."""
+        with self._cond:
+            if not self._closed:
+                print("Encoder process exited unexpectedly")
+                self._fail()
+
+    def unlink(self):
+        # The views have to go before the mapping can be closed
+        self.slots = []
+        self._block = None
+        self.memory.close()
+        try:
+            self.memory.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ProcessAudioSink:
+    """Audio sink that forwards PCM to the encoder process's own audio sink."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def write(self, data):
+        self.connection.send_bytes(data)
+
+    def close(self):
+        self.connection.close()
+
+
+def _forward_audio(connection, sink):
+    try:
+        while True:
+            sink.write(connection.recv_bytes())
+    except (EOFError, OSError):
+        pass
+    finally:
+        sink.close()
+
+
+def _encoder_main(memory_name, capacity, shape, encoder_factory, filename, fps, size, frames, acks, audio):
+    # Ctrl+C reaches the whole process group; the recording process decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    memory = shared_memory.SharedMemory(name=memory_name)
+    slots = np.ndarray((capacity, *shape), dtype=np.uint8, buffer=memory.buf)
+    try:
+        encoder = encoder_factory(filename, fps, size)
+    except Exception as e:
+        acks.send_bytes(b'E' + str(e).encode())
+        del slots
+        memory.close()
+        return
+    audio_thread = None
+    if getattr(encoder, 'audio_sink', None) is not None:
+        audio_thread = threading.Thread(target=_forward_audio, args=(audio, encoder.audio_sink), daemon=True)
+        audio_thread.start()
+    else:
+        audio.close()
+    acks.send_bytes(b'R1' if audio_thread is not None else b'R0')
+
+    acks_lock = threading.Lock()
+
+    def save_replay(output_file):
+        result = encoder.save_replay(output_file) if hasattr(encoder, 'save_replay') else None
+        with acks_lock:
+            acks.send_bytes(b'P' + (b'' if result is None else str(result).encode()))
+
+    held = None
+    frame = None
+    try:
+        while True:
+            try:
+                message = frames.recv_bytes()
+            except EOFError:
+                break  # The recording process is gone: finish the file with what we have
+            if not message:
+                break
+            if message[:1] == b'P':
+                threading.Thread(target=save_replay, args=(message[1:].decode(),), daemon=True).start()
+                continue
+            index, repeat, captured_at = FRAME.unpack(message)
+            frame = slots[index] if index >= 0 else (slots[held] if held is not None else None)
+            freed = index if index >= 0 else REPEAT_LAST
+            written = 0
+            start = time.perf_counter()
+            try:
+                if frame is not None:
+                    for _ in range(repeat):
+                        encoder.write(frame)
+                        written += 1
+                    if index >= 0:
+                        # Keep this slot for repeats and free the one held before it
+                        freed = held if held is not None else REPEAT_LAST
+                        held = index
+            except Exception as e:
+                print(f"Error while encoding in the encoder process: {e}")
+            with acks_lock:
+                acks.send_bytes(b'A' + ACK.pack(freed, written, time.perf_counter() - start, captured_at))
+    finally:
+        result = encoder.release()
+        if audio_thread is not None:
+            audio_thread.join()
+        del slots, frame
+        memory.close()
+        try:
+            with acks_lock:
+                acks.send_bytes(b'D' + str(result or 0).encode())
+        except OSError:
+            pass
+
+
+class EncoderProcess:
+    """
+    Runs `encoder_factory(filename, fps, size)` in a spawned process that reads
+    frames from `ring`. It stands in for the encoder in the recording process:
+    `audio_sink` (when the encoder has one) and save_replay() are forwarded,
+    and release() waits for the process and returns the encoder's result.
+
+    `encoder_factory` has to be picklable: an encoder class or a
+    functools.partial of one.
+    """
+
+    def __init__(self, ring, encoder_factory, filename, fps, size, on_ack=None, timeout=30.0, context=None):
+        context = context or multiprocessing.get_context('spawn')
+        self.ring = ring
+        self.filename = filename
+        self.on_ack = on_ack
+        self.result = None
+        acks_reader, acks_writer = context.Pipe(duplex=False)
+        audio_reader, audio_writer = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=_encoder_main, name='encoder-process',
+            args=(ring.memory.name, ring.capacity, ring.shape, encoder_factory, filename, fps, size,
+                  ring.reader, acks_writer, audio_reader))
+        self.process.start()
+        # Only the encoder process keeps these ends; otherwise it would never see end of file
+        for connection in (ring.reader, acks_writer, audio_reader):
+            connection.close()
+        self._acks = acks_reader
+
+        try:
+            if not acks_reader.poll(timeout):
+                raise OSError(f"The encoder process did not start within {timeout:.0f} s")
+            message = acks_reader.recv_bytes()
+        except (EOFError, OSError) as e:
+            self._abort(audio_writer)
+            raise OSError(f"The encoder process failed to start: {e}")
+        if message[:1] == b'E':
+            self._abort(audio_writer)
+            raise OSError(message[1:].decode())
+        if message == b'R1':
+            self.audio_sink = ProcessAudioSink(audio_writer)
+        else:
+            self.audio_sink = None
+            audio_writer.close()
+        self._replays = collections.deque()
+        self._replay_cond = threading.Condition()
+        self._thread = threading.Thread(target=self._receive, name='encoder-acks', daemon=True)
+        self._thread.start()
+
+    def _abort(self, audio_writer):
+        audio_writer.close()
+        self.ring.close()
+        self.process.join(5.0)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+    def _receive(self):
+        try:
+            while True:
+                message = self._acks.recv_bytes()
+                kind = message[:1]
+                if kind == b'A':
+                    index, written, seconds, captured_at = ACK.unpack_from(message, 1)
+                    self.ring.acknowledge(index, written)
+                    if self.on_ack is not None:
+                        self.on_ack(written, seconds, captured_at)
+                elif kind == b'P':
+                    with self._replay_cond:
+                        self._replays.append(int(message[1:]) if len(message) > 1 else None)
+                        self._replay_cond.notify_all()
+                elif kind == b'D':
+                    self.result = int(message[1:])
+        except (EOFError, OSError):
+            pass
+        finally:
+            self.ring.encoder_exited()
+            with self._replay_cond:
+                self._replay_cond.notify_all()
+
+    def save_replay(self, output_file, timeout=60.0):
+        """Ask the encoder process to save its replay buffer; returns its result like the encoder's."""
+        with self._replay_cond:
+            pending = len(self._replays)
+            if not self.ring.send_control(b'P' + output_file.encode()):
+                return None
+            self._replay_cond.wait_for(lambda: len(self._replays) > pending or not self._thread.is_alive(), timeout)
+            return self._replays.popleft() if self._replays else None
+
+    def release(self, timeout=120.0):
+        """
+        Wait for the encoder process to finish its file, free the shared memory
+        and return its result. A process still running after `timeout` seconds
+        is terminated.
+        """
+        self.ring.close()
+        try:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                print(f"Encoder process did not finish within {timeout:.0f} s, terminating it")
+                self.process.terminate()
+                self.process.join()
+            self._thread.join()
+            self._acks.close()
+        finally:
+            self.ring.unlink()
+        if self.result is None:
+            print(f"Encoder process exited with code {self.process.exitcode}")
+            return self.process.exitcode or 1
+        return self.result
+
+
+class ProcessFramePipeline(CapturePipeline):
+    """
+    Pipeline whose encoder runs in its own process (see the module docstring).
+    The capture side is shared with FramePipeline: acquire, capture, commit,
+    push, push_unchanged, discard and close. `encoder` is the EncoderProcess,
+    which ScreenRecorder uses as its output. Messages carry no frame shape, so
+    the capture scale cannot change.
+    """
+    scalable = False
+
+    def __init__(self, encoder_factory, filename, fps, size, capacity=8, policy=DROP_OLDEST, capture_shape=None,
+                 metrics=None):
+        width, height = size
+        frame_shape = (height, width, 3)
+        super().__init__(SharedFrameRing(capacity, frame_shape, policy=policy), frame_shape, capture_shape, metrics)
+        self._latency = self.metrics.histogram('frame_latency_seconds',
+                                               'Time from capture until the encoder process wrote the frame')
+        try:
+            self.encoder = EncoderProcess(self.ring, encoder_factory, filename, fps, size, on_ack=self._on_ack)
+        except Exception:
+            self.ring.unlink()
+            raise
+
+    @property
+    def encoded(self):
+        return self.ring.encoded
+
+    def _on_ack(self, written, seconds, captured_at):
+        if written:
+            self._encode_time.observe(seconds / written)
+            self._latency.observe(time.monotonic() - captured_at)
+
+    def start(self):
+        pass  # The encoder process is running since the constructor
+
+    def close(self):
+        """Stop sending frames; EncoderProcess.release() waits for the rest to be written."""
+        self.ring.close()
@@ -0,0 +1,330 @@
+"""
+Video encoders used by the screen capture pipeline.
+
+An encoder takes BGR frames through write(frame) and finalizes its output in
+release(). A frame is either a (height, width, 3) uint8 array or any buffer
+(e.g. a memoryview) holding exactly that many bytes; neither is copied.
+"""
+import collections
+import functools
+import inspect
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from muxing import concat_segments, read_concat_list
+
+
+class OpenCVVideoEncoder:
+    def __init__(self, filename, fps, size, fourcc='mp4v'):
+        self.filename = filename
+        self.shape = (size[1], size[0], 3)
+        self.out = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        if not self.out.isOpened():
+            raise OSError(f"OpenCV could not open a '{fourcc}' writer for {filename}")
+
+    def write(self, frame):
+        if not isinstance(frame, np.ndarray):
+            frame = np.frombuffer(frame, dtype=np.uint8).reshape(self.shape)
+        self.out.write(frame)
+
+    def release(self):
+        self.out.release()
+
+
+def segment_directory(filename):
+    """Directory holding the segments of `filename` while it is being recorded."""
+    return os.path.splitext(filename)[0] + '_segments'
+
+
+class SegmentedEncoder:
+    """
+    Splits the recording into files of `segment_seconds`, each written by its own
+    inner encoder (OpenCVVideoEncoder by default) and therefore complete on disk
+    as soon as the next one starts; a crash loses at most the open segment. On
+    release() the segments are joined into `filename` with a stream copy.
+
+    With `max_segments` set it acts as a replay buffer instead: only the newest
+    segments are kept on disk, save_replay() writes them out on demand and
+    release() discards them.
+
+    A new segment is also started whenever the frame size changes or
+    reconfigure() is called, so encoder options (e.g. the preset) and the
+    capture scale can change during a recording; with `segment_seconds=None`
+    that is the only time it rotates. Frames smaller than `size` are scaled
+    back up by the inner encoder, which needs an `output_size` option for that
+    (FFmpegPipeEncoder has one).
+    """
+
+    def __init__(self, filename, fps, size, segment_seconds=60, max_segments=None,
+                 encoder_factory=OpenCVVideoEncoder):
+        self.filename = filename
+        self.fps = fps
+        self.size = size
+        self.max_segments = max_segments
+        self.encoder_factory = encoder_factory
+        self.frames_per_segment = max(1, round(segment_seconds * fps)) if segment_seconds else None
+        self.options = {}
+        self.segment_dir = segment_directory(filename)
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self.segments = collections.deque()
+        self._lock = threading.Lock()
+        self._extension = os.path.splitext(filename)[1] or '.mp4'
+        self._index = 0
+        self._current = None
+        self._current_file = None
+        self._current_size = None
+        self._reconfigured = False
+        self._frames = 0
+
+    def supports(self, option):
+        """Whether the inner encoder takes `option` (e.g. 'preset' or 'output_size')."""
+        factory = self.encoder_factory
+        if isinstance(factory, functools.partial):
+            factory = factory.func
+        try:
+            return option in inspect.signature(factory).parameters
+        except (TypeError, ValueError):
+            return False
+
+    def reconfigure(self, **options):
+        """Pass `options` to the inner encoder from the next segment on, which starts with the next frame."""
+        self.options = {**self.options, **options}
+        self._reconfigured = True
+
+    def write(self, frame):
+        size = (frame.shape[1], frame.shape[0]) if isinstance(frame, np.ndarray) else self.size
+        if self._current is not None and (self._reconfigured or size != self._current_size):
+            self._rotate()
+        if self._current is None:
+            self._current_file = os.path.join(self.segment_dir, f'segment_{self._index:05d}{self._extension}')
+            options = dict(self.options)
+            if size != tuple(self.size):
+                options['output_size'] = self.size
+            self._reconfigured = False
+            self._current = self.encoder_factory(self._current_file, self.fps, size, **options)
+            self._current_size = size
+            self._index += 1
+        self._current.write(frame)
+        self._frames += 1
+        if self.frames_per_segment is not None and self._frames >= self.frames_per_segment:
+            self._rotate()
+
+    def _rotate(self):
+        self._current.release()
+        with self._lock:
+            self.segments.append(self._current_file)
+            while self.max_segments is not None and len(self.segments) > self.max_segments:
+                os.remove(self.segments.popleft())
+        self._current = None
+        self._frames = 0
+
+    def save_replay(self, output_file):
+        """Join the finished segments currently on disk into `output_file`."""
+        with self._lock:
+            segments = list(self.segments)
+        if not segments:
+            return None
+        return concat_segments(segments, output_file)
+
+    def release(self):
+        if self._current is not None:
+            self._rotate()
+        result = 0
+        if self.max_segments is None and self.segments:
+            try:
+                result = concat_segments(list(self.segments), self.filename)
+            except OSError as e:
+                print(f"Could not run ffmpeg to join segments: {e}")
+                result = 1
+            if result != 0:
+                print(f"Joining segments failed with code {result}, they are kept in {self.segment_dir}")
+                return result
+        shutil.rmtree(self.segment_dir, ignore_errors=True)
+        return result
+
+
+class FFmpegAudioInput:
+    """
+    Write end of the second ffmpeg input that carries raw PCM. On POSIX this is
+    an inherited pipe; elsewhere ffmpeg listens on a loopback TCP port and the
+    connection is made on the first write.
+    """
+
+    def __init__(self, fd=None, address=None):
+        self._fd = fd
+        self._address = address
+        self._sock = None
+
+    def write(self, data):
+        if self._fd is not None:
+            view = memoryview(data)
+            while view:
+                written = os.write(self._fd, view)
+                view = view[written:]
+            return
+        if self._sock is None:
+            self._sock = self._connect()
+        self._sock.sendall(data)
+
+    def _connect(self, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return socket.create_connection(self._address)
+            except OSError:
+                # ffmpeg opens its inputs one after another, so it may not be listening yet
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        elif self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class FFmpegPipeEncoder:
+    """
+    Single-pass encoder: raw BGR frames go to ffmpeg's stdin and, optionally,
+    PCM audio goes through `audio_sink`, so ffmpeg encodes and muxes both into
+    the final file while recording. Nothing is left to do once both inputs are
+    closed.
+
+    With `vfr=True` ffmpeg drops frames identical to the previous one before
+    they reach the encoder and writes variable frame rate timestamps, which
+    makes mostly-static screens much cheaper to encode and store.
+
+    `segment_seconds` and `max_segments` work as in SegmentedEncoder, using
+    ffmpeg's segment muxer so audio is carried in every segment.
+
+    With an `output_size` other than `size`, ffmpeg scales the frames to it
+    before encoding. `threads` limits the encoder's threads (default: ffmpeg's
+    choice, about one per core).
+    """
+
+    def __init__(self, filename, fps, size, codec='libx264', preset='ultrafast', crf=23,
+                 audio_rate=None, audio_channels=2, audio_codec='aac', audio_bitrate='192k',
+                 vfr=False, segment_seconds=None, max_segments=None, output_size=None, threads=None,
+                 ffmpeg='ffmpeg'):
+        self.filename = filename
+        self.ffmpeg = ffmpeg
+        self.audio_sink = None
+        self.segment_list = None
+        self.max_segments = max_segments
+        width, height = size
+
+        # Both inputs are fully described on the command line. Without -probesize/
+        # -analyzeduration ffmpeg would read seconds of real-time audio before
+        # draining the video pipe, stalling capture and dropping frames at startup.
+        no_probe = ['-probesize', '32', '-analyzeduration', '0']
+        command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', *no_probe,
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}',
+                   '-framerate', str(fps), '-i', 'pipe:0']
+        pass_fds = ()
+        audio_fd = None
+        if audio_rate is not None:
+            if os.name == 'posix':
+                audio_fd, write_fd = os.pipe()
+                audio_url = f'pipe:{audio_fd}'
+                pass_fds = (audio_fd,)
+                self.audio_sink = FFmpegAudioInput(fd=write_fd)
+            else:
+                address = ('127.0.0.1', _free_port())
+                audio_url = f'tcp://{address[0]}:{address[1]}?listen=1'
+                self.audio_sink = FFmpegAudioInput(address=address)
+            command += [*no_probe, '-f', 's16le', '-ar', str(audio_rate), '-ac', str(audio_channels), '-i', audio_url]
+
+        command += ['-map', '0:v', '-c:v', codec]
+        if preset:
+            command += ['-preset', preset]
+        if codec in ('libx264', 'libx265'):
+            command += ['-crf', str(crf)]
+        if threads:
+            command += ['-threads', str(threads)]
+        command += ['-pix_fmt', 'yuv420p']
+        filters = []
+        if vfr:
+            # Thresholds of 1 with frac=0 only drop frames that are pixel-identical
+            filters.append('mpdecimate=hi=1:lo=1:frac=0:max=0')
+        if output_size is not None and tuple(output_size) != (width, height):
+            filters.append(f'scale={output_size[0]}:{output_size[1]}')
+            width, height = output_size
+        if width % 2 or height % 2:
+            filters.append('pad=ceil(iw/2)*2:ceil(ih/2)*2')
+        if filters:
+            command += ['-vf', ','.join(filters)]
+        if vfr:
+            command += ['-fps_mode', 'vfr']
+        if audio_rate is not None:
+            command += ['-map', '1:a', '-c:a', audio_codec, '-b:a', audio_bitrate]
+        if segment_seconds:
+            command += self._segment_args(segment_seconds)
+        else:
+            command.append(filename)
+
+        self.command = command
+        # Unbuffered: whole frames go straight to the pipe without an extra copy
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, pass_fds=pass_fds, bufsize=0)
+        if audio_fd is not None:
+            os.close(audio_fd)
+
+    def write(self, frame):
+        view = memoryview(frame).cast('B')
+        while view:
+            written = self.proc.stdin.write(view)
+            view = view[written:]
+
+    def _segment_args(self, segment_seconds):
+        self.segment_dir = segment_directory(self.filename)
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self.segment_list = os.path.join(self.segment_dir, 'segments.ffconcat')
+        extension = os.path.splitext(self.filename)[1] or '.mp4'
+        # Keyframes exactly on the boundaries so every segment starts cleanly
+        args = ['-force_key_frames', f'expr:gte(t,n_forced*{segment_seconds})',
+                '-f', 'segment', '-segment_time', str(segment_seconds), '-segment_format', extension[1:],
+                '-reset_timestamps', '1', '-segment_list', self.segment_list, '-segment_list_type', 'ffconcat']
+        if self.max_segments:
+            # The list names the last N finished segments; file N+1 is the one being written
+            args += ['-segment_list_size', str(self.max_segments), '-segment_wrap', str(self.max_segments + 1)]
+        args.append(os.path.join(self.segment_dir, f'segment_%05d{extension}'))
+        return args
+
+    def save_replay(self, output_file):
+        """Join the finished segments currently listed by ffmpeg into `output_file`."""
+        if self.segment_list is None or not os.path.exists(self.segment_list):
+            return None
+        return concat_segments(read_concat_list(self.segment_list), output_file, self.ffmpeg)
+
+    def release(self):
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        result = self.proc.wait()
+        if result != 0:
+            print(f"FFmpeg encoder exited with code {result}")
+        if self.segment_list is None:
+            return result
+        if self.max_segments is None and os.path.exists(self.segment_list):
+            result = concat_segments(read_concat_list(self.segment_list), self.filename, self.ffmpeg)
+            if result != 0:
+                print(f"Joining segments failed with code {result}, they are kept in {self.segment_dir}")
+                return result
+        shutil.rmtree(self.segment_dir, ignore_errors=True)
+        return result
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
@@ -0,0 +1,27 @@
+import os
+import sys
+import time
+
+# The modules live flat in src/, as the application runs them
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+def wait_for(condition, timeout=10.0, interval=0.05):
+    """Poll `condition` until it is true; returns False if `timeout` seconds pass first."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def run_frames(pipeline, source, frames):
+    """Capture `frames` frames from `source` through `pipeline` as ScreenRecorder does, dropping when it is full."""
+    for _ in range(frames):
+        index = pipeline.acquire()
+        if index is None:
+            pipeline.discard()
+            continue
+        pipeline.capture(index, source)
+        pipeline.commit(index)
@@ -0,0 +1,51 @@
+import functools
+import time
+
+from adaptive import AdaptiveController
+from benchmark import EncoderLoad, SlowEncoder
+from conftest import wait_for
+from frame_sources import SyntheticFrameSource
+from screen_recorder import ScreenRecorder
+from video_encoders import SegmentedEncoder
+
+INTERVAL = 0.5
+PATIENCE = 3
+
+
+def test_overload_steps_down_quickly_and_recovery_steps_back_up(tmp_path):
+    fps = 20
+    # 640x360 costs 83 ms per frame at 'medium', well over the 50 ms a frame may take
+    load = EncoderLoad()
+    inner = functools.partial(SlowEncoder, preset='medium', seconds_per_megapixel=0.1, load=load)
+    factory = functools.partial(SegmentedEncoder, segment_seconds=None, encoder_factory=inner)
+    recorder = ScreenRecorder(None, fps, str(tmp_path / 'adaptive.mp4'),
+                              frame_source=SyntheticFrameSource((0, 0, 640, 360)), encoder_factory=factory)
+    controller = AdaptiveController(recorder, min_fps=fps / 2, preset='medium', interval=INTERVAL,
+                                    patience=PATIENCE, log=lambda message: None)
+    try:
+        began = time.monotonic()
+        recorder.start()
+        controller.start()
+        assert wait_for(lambda: controller.adjustments, PATIENCE * INTERVAL + 1.0)
+        # The first sample only sets the baseline; the next one already sees the overload
+        first = controller.adjustments[0]
+        assert first['direction'] == 'down'
+        assert first['time'] <= PATIENCE * INTERVAL
+
+        # Let it settle where the encoder keeps up, then take the load away
+        assert wait_for(lambda: time.monotonic() - began - controller.adjustments[-1]['time']
+                        > PATIENCE * INTERVAL, 15.0)
+        lowest = controller.level
+        assert lowest > 0
+        load.value = 0.05
+        dropped = time.monotonic() - began
+        assert wait_for(lambda: controller.level < lowest, 10 * PATIENCE * INTERVAL)
+    finally:
+        controller.stop()
+        recorder.stop()
+        recorder.join()
+
+    up = next(a for a in controller.adjustments if a['direction'] == 'up')
+    # Going back up needs `patience` calm intervals in a row
+    assert up['time'] - dropped >= (PATIENCE - 1) * INTERVAL
+    assert not [a for a in controller.adjustments if a['direction'] == 'down' and a['time'] > dropped]
@@ -0,0 +1,133 @@
+import time
+
+import numpy as np
+import pytest
+
+import fake_audio
+from audio_mixer import AudioInput, AudioMixer
+from audio_recorder import AudioRecorder
+from conftest import wait_for
+
+RATE = 48000
+CHUNK = 1024
+
+
+def open_input(audio, device_index, chunk=CHUNK):
+    info = audio.get_device_info_by_index(device_index)
+    return AudioInput(audio, fake_audio, device_index, fake_audio.paInt16, int(info['defaultSampleRate']),
+                      int(info['maxInputChannels']), chunk)
+
+
+def hz(frequency):
+    return pytest.approx(frequency, abs=5.0)
+
+
+def peak_frequencies(pcm, channels, rate, count):
+    samples = np.frombuffer(pcm, dtype=np.int16).reshape(-1, channels)[:, 0].astype(np.float64)
+    spectrum = np.abs(np.fft.rfft(samples * np.hanning(len(samples))))
+    frequencies = np.fft.rfftfreq(len(samples), 1.0 / rate)
+    peaks = []
+    for index in np.argsort(spectrum)[::-1]:
+        if all(abs(frequencies[index] - peak) > 20 for peak in peaks):
+            peaks.append(frequencies[index])
+        if len(peaks) == count:
+            break
+    return sorted(peaks)
+
+
+def test_callback_queues_stamped_buffers_and_counts_flags():
+    device = fake_audio.FakeDevice('Mic', rate=RATE, channels=1, overflow_every=3, underflow_every=4)
+    audio = fake_audio.PyAudio([device])
+    audio_input = open_input(audio, 0)
+    try:
+        assert wait_for(lambda: audio_input.overflows >= 2 and audio_input.underflows >= 1)
+    finally:
+        audio_input.close()
+    buffers = []
+    while not audio_input.queue.empty():
+        buffers.append(audio_input.queue.get_nowait())
+    assert len(buffers) >= 6
+    assert all(len(data) == CHUNK * 2 for data, _, _ in buffers)
+    # An overflow lost the buffer before the flagged one
+    assert sum(lost for _, _, lost in buffers) == CHUNK * audio_input.overflows
+    stamps = [captured_at for _, captured_at, _ in buffers]
+    assert stamps == sorted(stamps)
+    # Buffers arrive at the device's pace, not in a burst
+    assert stamps[-1] - stamps[0] >= (len(buffers) - 1) * CHUNK / RATE * 0.5
+
+
+def test_two_devices_are_converted_and_mixed():
+    audio = fake_audio.PyAudio([
+        fake_audio.FakeDevice('Mic', rate=44100, channels=1, frequency=440.0),
+        fake_audio.FakeDevice('Monitor', rate=RATE, channels=2, frequency=660.0),
+    ])
+    inputs = [open_input(audio, 0), open_input(audio, 1, chunk=CHUNK * RATE // 44100)]
+    mixer = AudioMixer(inputs, RATE, 2)
+    assert not mixer.passthrough
+    blocks = []
+    try:
+        # The secondary input is only mixed in once its cushion has built up
+        for _ in range(40):
+            block = mixer.read(timeout=1.0)
+            assert block is not None
+            blocks.append(block[0])
+    finally:
+        for audio_input in inputs:
+            audio_input.close()
+    mixed = b''.join(blocks[-20:])
+    assert len(mixed) % 4 == 0
+    assert peak_frequencies(mixed, 2, RATE, 2) == [hz(440.0), hz(660.0)]
+    assert mixer.underruns == 0
+
+
+def test_lost_secondary_device_counts_underruns_and_primary_goes_on():
+    audio = fake_audio.PyAudio([
+        fake_audio.FakeDevice('Mic', rate=RATE, channels=1, frequency=440.0),
+        fake_audio.FakeDevice('Monitor', rate=RATE, channels=1, frequency=660.0, lost_after=15),
+    ])
+    inputs = [open_input(audio, 0), open_input(audio, 1)]
+    mixer = AudioMixer(inputs, RATE, 1)
+    blocks = []
+    try:
+        for _ in range(40):
+            block = mixer.read(timeout=1.0)
+            assert block is not None
+            blocks.append(block[0])
+    finally:
+        for audio_input in inputs:
+            audio_input.close()
+    assert not inputs[1].stream.is_active()
+    assert mixer.underruns >= 1
+    # Only the microphone is left at the end
+    assert peak_frequencies(b''.join(blocks[-10:]), 1, RATE, 1) == [hz(440.0)]
+
+
+class ListSink:
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def close(self):
+        self.closed = True
+
+
+def test_recorder_survives_losing_its_only_device(monkeypatch):
+    monkeypatch.setattr(fake_audio, 'DEFAULT_DEVICES',
+                        [fake_audio.FakeDevice('Mic', rate=RATE, channels=1, lost_after=5)])
+    sink = ListSink()
+    recorder = AudioRecorder(fake_audio.paInt16, 1, RATE, CHUNK, 'unused.wav', sink=sink, backend=fake_audio)
+    recorder.start()
+    try:
+        assert wait_for(lambda: recorder.inputs and not recorder.inputs[0].stream.is_active())
+        # The recorder keeps waiting for the device instead of failing
+        time.sleep(0.6)
+        assert recorder.is_alive()
+    finally:
+        recorder.stop()
+        recorder.join(timeout=5)
+    assert not recorder.is_alive()
+    assert sink.closed
+    assert len(sink.chunks) == 5
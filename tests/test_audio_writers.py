@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+import wave
+
+import pytest
+
+from audio_writers import StreamingWavWriter, recover_wav
+
+CHANNELS, SAMPLE_WIDTH, RATE = 2, 2, 44100
+BLOCK_ALIGN = CHANNELS * SAMPLE_WIDTH
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+# Writes whole buffers, then dies without close(): no atexit, no finally
+CRASHING_WRITER = """
+import os, sys
+from audio_writers import StreamingWavWriter
+writer = StreamingWavWriter(sys.argv[1], 2, 2, 44100, buffer_size=4096)
+for _ in range(10):
+    writer.write(bytes(range(256)) * 16)
+writer.write(b'\\x01' * 1000)  # Still in the buffer when the process dies
+os._exit(0)
+"""
+
+
+def read_frames(filename):
+    with wave.open(filename, 'rb') as wav:
+        return wav.getnframes(), wav.readframes(wav.getnframes())
+
+
+def test_writer_buffers_and_closes_to_a_valid_file(tmp_path):
+    filename = str(tmp_path / 'audio.wav')
+    writer = StreamingWavWriter(filename, CHANNELS, SAMPLE_WIDTH, RATE, buffer_size=1024)
+    chunk = bytes(range(200)) * 2
+    for _ in range(10):
+        writer.write(chunk)
+    assert writer.bytes_written < 10 * len(chunk)
+    writer.close()
+    writer.close()
+    assert writer.bytes_written == 10 * len(chunk)
+    frames, data = read_frames(filename)
+    assert frames == 10 * len(chunk) // BLOCK_ALIGN
+    assert data == chunk * 10
+
+
+def test_crashed_writer_leaves_a_playable_file(tmp_path):
+    filename = str(tmp_path / 'crashed.wav')
+    subprocess.run([sys.executable, '-c', CRASHING_WRITER, filename], cwd=SRC, check=True)
+    # The header was patched at the last flush, only the unflushed buffer is lost
+    frames, data = read_frames(filename)
+    assert frames * BLOCK_ALIGN == 10 * 4096
+    assert data == bytes(range(256)) * 16 * 10
+    assert recover_wav(filename) == 10 * 4096
+
+
+def test_recover_wav_fixes_sizes_and_trims_a_partial_frame(tmp_path):
+    filename = str(tmp_path / 'torn.wav')
+    writer = StreamingWavWriter(filename, CHANNELS, SAMPLE_WIDTH, RATE, buffer_size=64)
+    writer.write(b'\x02' * 400)
+    writer.flush()
+    # Audio that reached the disk after the last header patch, ending mid sample frame
+    with open(filename, 'ab') as f:
+        f.write(b'\x03' * 403)
+    assert read_frames(filename)[0] == 100
+
+    kept = recover_wav(filename)
+    assert kept == 800
+    assert os.path.getsize(filename) == 44 + 800
+    frames, data = read_frames(filename)
+    assert frames == 200
+    assert data == b'\x02' * 400 + b'\x03' * 400
+
+
+def test_recover_wav_rejects_other_files(tmp_path):
+    filename = tmp_path / 'not.wav'
+    filename.write_bytes(b'ID3' + bytes(100))
+    with pytest.raises(ValueError):
+        recover_wav(str(filename))
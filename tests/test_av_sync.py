@@ -0,0 +1,42 @@
+import time
+import wave
+
+import fake_audio
+from audio_recorder import AudioRecorder
+from av_sync import SessionClock, SyncTrack, sync_filename
+from conftest import wait_for
+
+RATE = 44100
+CHUNK = 1024
+
+
+def test_overflows_are_filled_and_recorded_in_the_sidecar(tmp_path, monkeypatch):
+    monkeypatch.setattr(fake_audio, 'DEFAULT_DEVICES',
+                        [fake_audio.FakeDevice('Mic', rate=RATE, channels=2, overflow_every=5)])
+    session = SessionClock()
+    sync = SyncTrack(RATE)
+    filename = str(tmp_path / 'audio.wav')
+    recorder = AudioRecorder(fake_audio.paInt16, 2, RATE, CHUNK, filename, session=session, sync=sync,
+                             backend=fake_audio)
+    session.start()
+    recorder.start()
+    try:
+        assert wait_for(lambda: recorder.inputs and recorder.inputs[0].overflows >= 4)
+    finally:
+        recorder.stop()
+        recorder.join()
+    ended = session.now()
+    sync.save(sync_filename(filename))
+
+    overflows = recorder.inputs[0].overflows
+    chunks = recorder.metrics.snapshot()['audio_chunks_total']
+    saved = SyncTrack.load(sync_filename(filename))
+    # One gap of one buffer per overflow, however short
+    assert [samples for _, samples in saved.audio_gaps] == [CHUNK] * overflows
+    with wave.open(filename) as f:
+        frames = f.getnframes()
+    # Every buffer and every lost one, less what of the first came before session start
+    assert (chunks + overflows - 1) * CHUNK < frames <= (chunks + overflows) * CHUNK
+    # With the lost buffers filled, the audio spans the whole session after its start
+    assert abs(saved.audio_start + frames / RATE - ended) < 3 * CHUNK / RATE
+    assert abs(saved.drift_ratio() - 1.0) < 0.01
@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+
+import pytest
+
+from batch_remux import (MANIFEST_NAME, MANIFEST_VERSION, find_pairs, load_manifest, remux_all, remux_options,
+                         split_up_to_date)
+
+# Stands in for ffmpeg: writes the output it is given, fails for inputs named in FAIL_ON
+FAKE_FFMPEG = f"""#!{sys.executable}
+import os, sys
+if any(name and name in arg for arg in sys.argv for name in os.environ.get('FAIL_ON', '').split(',')):
+    sys.exit(1)
+with open(sys.argv[-1], 'wb') as f:
+    f.write(b'muxed')
+"""
+
+
+@pytest.fixture
+def ffmpeg(tmp_path):
+    filename = tmp_path / 'fake-ffmpeg'
+    filename.write_text(FAKE_FFMPEG)
+    filename.chmod(0o755)
+    return str(filename)
+
+
+@pytest.fixture
+def recordings(tmp_path):
+    """A two-region command line recording sharing one audio file, and a window recording."""
+    directory = tmp_path / 'recordings'
+    directory.mkdir()
+    for name in ('talk.0.video.mp4', 'talk.1.video.mp4', 'talk.audio.m4a',
+                 'output_20240101_120000.mp4', 'output_20240101_120001.wav'):
+        (directory / name).write_bytes(name.encode())
+    return directory
+
+
+def outputs(jobs):
+    return [os.path.basename(job.output) for job in jobs]
+
+
+def test_find_pairs_matches_both_naming_schemes(recordings):
+    jobs = find_pairs(str(recordings))
+    assert outputs(jobs) == ['combined_20240101_120000.mp4', 'talk.0.mp4', 'talk.1.mp4']
+    assert jobs[0].audio.endswith('output_20240101_120001.wav')
+    assert jobs[1].audio == jobs[2].audio
+
+
+def test_manifest_marks_finished_jobs_up_to_date(recordings, ffmpeg):
+    manifest = str(recordings / MANIFEST_NAME)
+    jobs = find_pairs(str(recordings))
+    summary = remux_all(jobs, manifest, workers=2, ffmpeg=ffmpeg, report=lambda line: None)
+    assert summary['muxed'] == 3 and not summary['failed']
+    assert len(load_manifest(manifest)) == 3
+
+    options = remux_options()
+    pending, current = split_up_to_date(jobs, manifest, options)
+    assert not pending and len(current) == 3
+    # Forced, with other options, or once an input changed, a job runs again
+    assert len(split_up_to_date(jobs, manifest, options, force=True)[0]) == 3
+    assert len(split_up_to_date(jobs, manifest, remux_options(video_codec='libx264'))[0]) == 3
+    (recordings / 'talk.1.video.mp4').write_bytes(b're-recorded')
+    assert outputs(split_up_to_date(jobs, manifest, options)[0]) == ['talk.1.mp4']
+
+
+def test_missing_output_or_old_manifest_is_not_up_to_date(recordings, ffmpeg):
+    manifest = str(recordings / MANIFEST_NAME)
+    jobs = find_pairs(str(recordings))
+    remux_all(jobs, manifest, ffmpeg=ffmpeg, report=lambda line: None)
+    os.remove(jobs[0].output)
+    assert outputs(split_up_to_date(jobs, manifest, remux_options())[0]) == ['combined_20240101_120000.mp4']
+
+    # A manifest from another version counts as none
+    with open(manifest) as f:
+        entries = json.load(f)['entries']
+    with open(manifest, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION - 1, 'entries': entries}, f)
+    assert len(split_up_to_date(jobs, manifest, remux_options())[0]) == 3
+
+
+def test_failed_jobs_are_left_out_of_the_manifest_and_retried(recordings, ffmpeg, monkeypatch):
+    manifest = str(recordings / MANIFEST_NAME)
+    jobs = find_pairs(str(recordings))
+    monkeypatch.setenv('FAIL_ON', 'talk.1.video')
+    summary = remux_all(jobs, manifest, ffmpeg=ffmpeg, report=lambda line: None)
+    assert [os.path.basename(output) for output in summary['failed']] == ['talk.1.mp4']
+    assert not os.path.exists(recordings / 'talk.1.partial.mp4')
+
+    monkeypatch.delenv('FAIL_ON')
+    lines = []
+    summary = remux_all(jobs, manifest, ffmpeg=ffmpeg, report=lines.append)
+    assert (summary['muxed'], summary['skipped']) == (1, 2)
+    assert sum(line.startswith('skipped') for line in lines) == 2
+
+
+def test_shared_audio_is_deleted_once_every_region_is_done(recordings, ffmpeg, monkeypatch):
+    manifest = str(recordings / MANIFEST_NAME)
+    jobs = find_pairs(str(recordings))
+    # Region 0 was muxed by an earlier run, region 1 fails this time
+    remux_all(jobs[1:2], manifest, ffmpeg=ffmpeg, report=lambda line: None)
+    monkeypatch.setenv('FAIL_ON', 'talk.1.video')
+    remux_all(jobs, manifest, ffmpeg=ffmpeg, delete_inputs=True, report=lambda line: None)
+    assert set(os.listdir(recordings)) == {MANIFEST_NAME, 'combined_20240101_120000.mp4', 'talk.0.mp4',
+                                           'talk.1.video.mp4', 'talk.audio.m4a'}
+
+    # With the last region muxed the shared audio goes too
+    monkeypatch.delenv('FAIL_ON')
+    jobs = find_pairs(str(recordings))
+    assert outputs(jobs) == ['talk.1.mp4']
+    remux_all(jobs, manifest, ffmpeg=ffmpeg, delete_inputs=True, report=lambda line: None)
+    assert set(os.listdir(recordings)) == {MANIFEST_NAME, 'combined_20240101_120000.mp4', 'talk.0.mp4',
+                                           'talk.1.mp4'}
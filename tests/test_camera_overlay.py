@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from benchmark import bench_overlay
+from camera_overlay import CORNERS, CameraOverlay, LatestFrame
+
+
+def overlay_with_camera(corner, camera_shape=(120, 160, 3), **kwargs):
+    slot = LatestFrame()
+    slot.put(np.full(camera_shape, 200, dtype=np.uint8))
+    return CameraOverlay(slot, corner=corner, **kwargs)
+
+
+@pytest.mark.parametrize('corner', CORNERS)
+def test_overlay_lands_in_its_corner(corner):
+    overlay = overlay_with_camera(corner, size=0.25, margin=10)
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    overlay.apply(frame)
+
+    # A quarter of the width, the camera's 4:3 aspect kept
+    left, top, width, height = overlay._rect
+    assert (width, height) == (160, 120)
+    assert left == (10 if corner.endswith('left') else 640 - 160 - 10)
+    assert top == (10 if corner.startswith('top') else 480 - 120 - 10)
+
+    drawn = np.argwhere(frame[:, :, 0] == 200)
+    assert drawn.min(axis=0).tolist() == [top, left]
+    assert drawn.max(axis=0).tolist() == [top + height - 1, left + width - 1]
+    assert len(drawn) == width * height
+
+
+def test_overlay_is_clamped_inside_the_margins():
+    overlay = overlay_with_camera('bottom-right', camera_shape=(480, 160, 3), size=0.5, margin=16)
+    frame = np.zeros((200, 320, 3), dtype=np.uint8)
+    overlay.apply(frame)
+    left, top, width, height = overlay._rect
+    assert width == 160
+    # A tall camera is cut to the frame height minus both margins
+    assert height == 200 - 2 * 16
+    assert (left, top) == (320 - 160 - 16, 16)
+
+
+def test_overlay_resizes_only_new_camera_frames():
+    overlay = overlay_with_camera('top-left')
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    for _ in range(3):
+        overlay.apply(frame)
+    overlay.slot.put(np.full((120, 160, 3), 50, dtype=np.uint8))
+    overlay.apply(frame)
+    assert overlay.summary()['frames'] == 4
+    assert overlay.resizes == 2
+    assert frame[16, 16, 0] == 50
+
+
+def test_overlay_without_camera_frame_leaves_frame_alone():
+    overlay = CameraOverlay(LatestFrame())
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    overlay.apply(frame)
+    assert not frame.any()
+    assert overlay.frames == 0
+
+
+def test_bench_overlay_reports_both_rates():
+    result = bench_overlay((320, 240), frames=30, camera_size=(160, 120))
+    assert result['plain_fps'] > 0 and result['overlay_fps'] > 0
+    assert result['frames'] == 30
+    assert result['resizes'] >= 1
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from damage import DamageDetector
+
+
+def frame(width=320, height=200):
+    return np.zeros((height, width, 3), dtype=np.uint8)
+
+
+def test_first_frame_is_all_damage():
+    detector = DamageDetector(tile_size=64)
+    stats = detector.update(frame())
+    assert stats.changed
+    assert stats.dirty_tiles == stats.total_tiles == 5 * 4
+    assert stats.bbox == (0, 0, 320, 200)
+
+
+def test_identical_frame_is_unchanged():
+    detector = DamageDetector(tile_size=64)
+    detector.update(frame())
+    stats = detector.update(frame())
+    assert not stats.changed
+    assert stats.dirty_tiles == 0 and stats.bbox is None
+    assert detector.summary()['unchanged'] == 1
+
+
+@pytest.mark.parametrize('stride', [1, 2])
+def test_changed_pixel_dirties_its_tile(stride):
+    detector = DamageDetector(tile_size=64, stride=stride)
+    detector.update(frame())
+    changed = frame()
+    changed[130, 200, 1] = 1
+    stats = detector.update(changed)
+    assert stats.changed
+    assert stats.dirty_tiles == 1
+    assert stats.dirty_fraction == pytest.approx(1 / 20)
+    assert stats.bbox == (192, 128, 256, 192)
+    # The change becomes the reference, showing it again is no damage
+    assert not detector.update(changed).changed
+
+
+def test_bbox_spans_all_dirty_tiles_and_is_clipped_to_the_frame():
+    detector = DamageDetector(tile_size=64)
+    detector.update(frame())
+    changed = frame()
+    changed[5, 5] = 255
+    changed[199, 319] = 255
+    stats = detector.update(changed)
+    assert stats.dirty_tiles == 2
+    assert stats.bbox == (0, 0, 320, 200)
+
+
+def test_odd_row_length_is_compared_bytewise():
+    detector = DamageDetector(tile_size=8)
+    detector.update(frame(width=13, height=9))
+    changed = frame(width=13, height=9)
+    changed[8, 12, 2] = 7
+    stats = detector.update(changed)
+    assert stats.changed
+    assert stats.bbox == (8, 8, 13, 9)
+
+
+def test_size_change_resets_the_reference():
+    detector = DamageDetector(tile_size=64)
+    detector.update(frame())
+    stats = detector.update(frame(width=640, height=400))
+    assert stats.changed and stats.dirty_fraction == 1.0
+    assert not detector.update(frame(width=640, height=400)).changed
+
+
+def test_rejects_tile_size_not_a_multiple_of_8_or_stride():
+    with pytest.raises(ValueError):
+        DamageDetector(tile_size=60)
+    with pytest.raises(ValueError):
+        DamageDetector(tile_size=64, stride=3)
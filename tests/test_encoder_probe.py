@@ -0,0 +1,44 @@
+import cv2
+import numpy as np
+
+from encoder_probe import (OPENCV_FOURCCS, make_encoder_factory, measure_encoder, probe_encoders, select_encoder,
+                           written_fourcc)
+
+
+def test_opencv_factories_write_with_their_fourcc(tmp_path):
+    encoder = make_encoder_factory('MJPG')(str(tmp_path / 'mjpg.avi'), 20, (64, 48))
+    try:
+        encoder.write(np.zeros((48, 64, 3), dtype=np.uint8))
+    finally:
+        encoder.release()
+    capture = cv2.VideoCapture(str(tmp_path / 'mjpg.avi'))
+    try:
+        fourcc = int(capture.get(cv2.CAP_PROP_FOURCC)).to_bytes(4, 'little').decode()
+    finally:
+        capture.release()
+    assert fourcc == 'MJPG'
+
+
+def test_failing_opencv_fourccs_are_left_out(monkeypatch):
+    import encoder_probe
+
+    def measure(name, directory, **kwargs):
+        if name == 'mp4v':
+            return {'fps': 100.0, 'pixels_per_second': 1e8, 'psnr': 38.0, 'bytes': 1000}
+        return {'error': 'could not open'}
+
+    monkeypatch.setattr(encoder_probe, 'measure_encoder', measure)
+    monkeypatch.setattr(encoder_probe, 'ffmpeg_encoders', lambda ffmpeg: {'libx264'})
+    results = probe_encoders(candidates=('libx264:ultrafast',) + OPENCV_FOURCCS, log=None)
+    # ffmpeg encoders keep their error, OpenCV fourccs that do not open are dropped
+    assert set(results) == {'libx264:ultrafast', 'mp4v'}
+    assert select_encoder(results, 1e6) == 'mp4v'
+
+
+def test_fourccs_the_container_replaces_are_rejected(tmp_path):
+    clips = [np.zeros((48, 64, 3), dtype=np.uint8)]
+    assert 'error' not in measure_encoder('mp4v', str(tmp_path), size=(64, 48), frames=5, clips=clips)
+    assert written_fourcc(str(tmp_path / 'probe_mp4v.mp4')) == 'mp4v'
+    # OpenCV writes XVID into an .mp4 under the mp4v tag, which would measure mp4v twice
+    result = measure_encoder('XVID', str(tmp_path), size=(64, 48), frames=5, clips=clips)
+    assert 'error' in result
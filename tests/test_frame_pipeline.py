@@ -0,0 +1,50 @@
+import tracemalloc
+
+import pytest
+
+from conftest import run_frames
+from frame_pipeline import FramePipeline
+from frame_sources import SyntheticFrameSource
+
+
+class CountingEncoder:
+    def __init__(self):
+        self.frames = 0
+
+    def write(self, frame):
+        self.frames += 1
+
+    def release(self):
+        pass
+
+
+@pytest.mark.parametrize('capture_size', [(1280, 720), (1920, 1080)], ids=['same size', 'scaled'])
+def test_steady_state_capture_does_not_allocate_frames(capture_size):
+    width, height = 1280, 720
+    frame_bytes = width * height * 3
+    source = SyntheticFrameSource((0, 0) + capture_size)
+    encoder = CountingEncoder()
+    pipeline = FramePipeline(encoder, (height, width, 3), capacity=4,
+                             capture_shape=(capture_size[1], capture_size[0], 3))
+    pipeline.start()
+    frames = 100
+    try:
+        run_frames(pipeline, source, 20)
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            run_frames(pipeline, source, frames)
+            after, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        pipeline.close()
+
+    stats = pipeline.stats()
+    assert stats['captured'] == 120
+    assert encoder.frames == stats['encoded'] > 0
+    # A single copy of a frame per step would show as frame_bytes per frame of
+    # growth if kept, or in the peak if freed right away
+    assert (after - before) / frames < frame_bytes / 1000
+    assert peak - before < frame_bytes / 10
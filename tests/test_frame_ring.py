@@ -0,0 +1,95 @@
+import threading
+
+import pytest
+
+from frame_pipeline import BLOCK, DROP_NEWEST, DROP_OLDEST, FrameRing
+
+
+def fill(ring, frames):
+    """Publish `frames` frames, discarding the ones the ring has no slot for."""
+    for _ in range(frames):
+        index = ring.acquire()
+        if index is None:
+            ring.discard()
+        else:
+            ring.publish(index)
+
+
+def drain(ring):
+    ring.close()
+    taken = []
+    while (item := ring.take()) is not None:
+        taken.append(item)
+        ring.release(item[0])
+    return taken
+
+
+def test_rejects_bad_arguments():
+    with pytest.raises(ValueError):
+        FrameRing(4, (2, 2, 3), policy='drop_some')
+    with pytest.raises(ValueError):
+        FrameRing(1, (2, 2, 3))
+
+
+def test_drop_oldest_hands_dropped_duration_to_the_next_frame():
+    ring = FrameRing(3, (2, 2, 3), policy=DROP_OLDEST)
+    fill(ring, 10)
+    taken = drain(ring)
+    # Only the newest frames are left, but together they still last all 10 output frames
+    assert len(taken) == 3
+    assert sum(repeat for _, _, repeat in taken) == 10
+    assert ring.dropped == 7
+    assert [seq for _, seq, _ in taken] == [0, 1, 2]
+
+
+def test_drop_newest_carries_dropped_duration_to_the_next_publish():
+    ring = FrameRing(3, (2, 2, 3), policy=DROP_NEWEST)
+    fill(ring, 10)
+    assert ring.dropped == 7
+    assert ring.depth == 3
+    # The seven dropped frames ride on the next frame that gets a slot
+    index, _, _ = ring.take()
+    ring.release(index)
+    fill(ring, 1)
+    taken = drain(ring)
+    assert [repeat for _, _, repeat in taken] == [1, 1, 8]
+
+
+def test_extend_repeats_the_last_ready_frame_or_the_last_written_one():
+    ring = FrameRing(2, (2, 2, 3))
+    fill(ring, 1)
+    ring.extend(2)
+    ring.discard()
+    ring.extend()
+    index, _, repeat = ring.take()
+    assert index is not None and repeat == 5
+    ring.release(index)
+    # Nothing ready: the repeat becomes an entry without a slot
+    ring.extend(3)
+    assert drain(ring) == [(None, 1, 3)]
+
+
+def test_block_waits_for_a_slot():
+    ring = FrameRing(2, (2, 2, 3), policy=BLOCK)
+    fill(ring, 2)
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(ring.acquire()))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+    index, _, _ = ring.take()
+    ring.release(index)
+    waiter.join(5.0)
+    assert acquired == [index]
+    assert ring.dropped == 0
+
+
+def test_close_wakes_blocked_acquire():
+    ring = FrameRing(2, (2, 2, 3), policy=BLOCK)
+    fill(ring, 2)
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(ring.acquire()))
+    waiter.start()
+    ring.close()
+    waiter.join(5.0)
+    assert acquired == [None]
@@ -0,0 +1,83 @@
+import pytest
+
+from frame_scheduler import FrameScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def scheduler(clock):
+    scheduler = FrameScheduler(10, clock=clock, sleep=clock.sleep)
+    scheduler.start()
+    return scheduler
+
+
+def test_on_time_frames_cover_one_tick(scheduler, clock):
+    for tick in range(5):
+        assert scheduler.wait() == pytest.approx(tick * 0.1)
+        clock.now += 0.01
+        assert scheduler.advance() == 1
+    assert scheduler.tick == 5
+    assert scheduler.duplicated == scheduler.skipped == 0
+
+
+def test_overrun_repeats_the_late_frame(scheduler, clock):
+    scheduler.wait()
+    # The capture took 3.5 intervals: ticks 1 and 2 have passed, 3 is next
+    clock.now += 0.35
+    assert scheduler.advance() == 3
+    assert scheduler.tick == 3
+    assert scheduler.duplicated == 2
+    # The next deadline is absolute, the overrun does not shift it
+    assert scheduler.wait() == pytest.approx(0.35)
+    assert scheduler.lateness[-1] == pytest.approx(0.05)
+
+
+def test_step_skips_ticks_on_purpose(scheduler, clock):
+    scheduler.set_step(3)
+    scheduler.wait()
+    clock.now += 0.01
+    assert scheduler.advance() == 3
+    assert scheduler.skipped == 2 and scheduler.duplicated == 0
+    assert scheduler.wait() == pytest.approx(0.3)
+
+
+def test_overrun_beyond_the_step_counts_only_the_excess_as_duplicates(scheduler, clock):
+    scheduler.set_step(2)
+    scheduler.wait()
+    clock.now += 0.55
+    assert scheduler.advance() == 5
+    assert scheduler.skipped == 1
+    assert scheduler.duplicated == 3
+
+
+def test_set_step_clamps_to_one(scheduler):
+    scheduler.set_step(0)
+    assert scheduler.step == 1
+    scheduler.set_step(2.7)
+    assert scheduler.step == 2
+
+
+def test_report_counts_output_ticks(scheduler, clock):
+    for _ in range(4):
+        scheduler.wait()
+        clock.now += 0.15
+        scheduler.advance()
+    report = scheduler.report()
+    assert report['frames'] == 4
+    assert report['ticks'] == report['frames'] + report['duplicated']
+    assert 'jitter_ms' in report
@@ -0,0 +1,29 @@
+import pytest
+
+import frame_sources
+from frame_sources import SyntheticFrameSource, select_frame_source
+
+
+class BrokenSource:
+    def __init__(self, bbox):
+        raise OSError("no display")
+
+
+@pytest.fixture
+def broken(monkeypatch):
+    monkeypatch.delenv('SCREENRECORDER_SOURCE', raising=False)
+    monkeypatch.setitem(frame_sources.FRAME_SOURCES, 'broken', BrokenSource)
+
+
+def test_no_working_backend_raises_instead_of_recording_a_test_pattern(broken):
+    with pytest.raises(OSError, match='broken'):
+        select_frame_source(candidates=('broken',))
+
+
+def test_synthetic_source_only_when_named(broken):
+    source = select_frame_source(bbox=(0, 0, 64, 48), candidates=('broken', 'synthetic'), probe_frames=2)
+    try:
+        assert isinstance(source, SyntheticFrameSource)
+        assert source.grab().shape == (48, 64, 3)
+    finally:
+        source.close()
@@ -0,0 +1,86 @@
+import json
+import subprocess
+
+import cv2
+import numpy as np
+import pytest
+
+import recording_index
+from recording_index import build_index, index_filename, keyframe_at, read_mp4_keyframes, trim
+
+FPS = 10
+
+
+@pytest.fixture
+def video(tmp_path):
+    """Three seconds of moving noise; OpenCV's mp4v puts a keyframe every 12 frames."""
+    filename = str(tmp_path / 'clip.mp4')
+    base = np.random.default_rng(0).integers(0, 255, (48, 64, 3), dtype=np.uint8)
+    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*'mp4v'), FPS, (64, 48))
+    for n in range(30):
+        writer.write(np.roll(base, n, axis=1))
+    writer.release()
+    return filename
+
+
+@pytest.fixture
+def trim_commands(monkeypatch):
+    commands = []
+    monkeypatch.setattr(recording_index.subprocess, 'run',
+                        lambda command: commands.append(command) or subprocess.CompletedProcess(command, 0))
+    return commands
+
+
+def test_keyframes_from_the_sample_tables(video):
+    info = read_mp4_keyframes(video)
+    assert (info['width'], info['height'], info['frames']) == (64, 48, 30)
+    assert info['duration'] == pytest.approx(3.0)
+    assert [k['time'] for k in info['keyframes']] == [0.0, 1.2, 2.4]
+    # Every offset points at an MPEG-4 group of VOP start code
+    with open(video, 'rb') as f:
+        data = f.read()
+    for keyframe in info['keyframes']:
+        assert data[keyframe['offset']:keyframe['offset'] + 4] == b'\x00\x00\x01\xb3'
+
+
+def test_keyframe_at_snaps_before_and_after():
+    keyframes = [{'time': t} for t in (0.0, 1.2, 2.4)]
+    assert keyframe_at(keyframes, 1.0) == 0.0
+    assert keyframe_at(keyframes, 1.2) == 1.2
+    assert keyframe_at(keyframes, 1.3, snap='after') == 2.4
+    assert keyframe_at(keyframes, 3.0, snap='after') == 2.4
+    assert keyframe_at([], 5.0) == 0.0
+    with pytest.raises(ValueError):
+        keyframe_at(keyframes, 1.0, snap='nearest')
+
+
+def test_trim_starts_the_copy_on_a_keyframe(video, tmp_path, trim_commands):
+    output = str(tmp_path / 'out.mp4')
+    assert trim(video, output, start=2.0, end=2.9) == (0, 1.2)
+    command = trim_commands[0]
+    assert command[command.index('-ss') + 1] == '1.201000'
+    assert command[command.index('-t') + 1] == '1.700000'
+    assert command[command.index('-c') + 1] == 'copy'
+    assert command[-1] == output
+
+    assert trim(video, output, start=2.0, snap='after') == (0, 2.4)
+    assert '-t' not in trim_commands[1]
+
+
+def test_trim_from_the_first_keyframe_does_not_seek(video, tmp_path, trim_commands):
+    assert trim(video, str(tmp_path / 'out.mp4'), start=0.5) == (0, 0.0)
+    assert '-ss' not in trim_commands[0]
+
+
+def test_trim_refuses_an_empty_clip(video, tmp_path, trim_commands):
+    with pytest.raises(ValueError):
+        trim(video, str(tmp_path / 'out.mp4'), start=2.0, end=2.2, snap='after')
+    assert not trim_commands
+
+
+def test_trim_takes_keyframes_from_a_current_index(video, tmp_path, trim_commands):
+    index = build_index(video, thumbnails=0, scene_threshold=None)
+    index['keyframes'] = [{'time': 0.0, 'offset': 0}, {'time': 1.0, 'offset': 0}]
+    with open(index_filename(video), 'w') as f:
+        json.dump(index, f)
+    assert trim(video, str(tmp_path / 'out.mp4'), start=1.1) == (0, 1.0)
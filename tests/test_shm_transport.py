@@ -0,0 +1,173 @@
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+import time
+
+import cv2
+
+from conftest import run_frames, wait_for
+from frame_sources import SyntheticFrameSource
+from shm_transport import ProcessFramePipeline
+from video_encoders import OpenCVVideoEncoder
+
+SIZE = (320, 240)
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+def shm_path(pipeline):
+    return os.path.join('/dev/shm', pipeline.ring.memory.name.lstrip('/'))
+
+
+def decoded_frames(filename):
+    capture = cv2.VideoCapture(filename)
+    frames = 0
+    try:
+        while capture.read()[0]:
+            frames += 1
+    finally:
+        capture.release()
+    return frames
+
+
+def test_clean_stop_exits_zero_and_frees_shared_memory(tmp_path):
+    filename = str(tmp_path / 'clean.mp4')
+    pipeline = ProcessFramePipeline(OpenCVVideoEncoder, filename, 20, SIZE)
+    path = shm_path(pipeline)
+    assert os.path.exists(path)
+    pipeline.start()
+    run_frames(pipeline, SyntheticFrameSource((0, 0) + SIZE), 30)
+    pipeline.close()
+    result = pipeline.encoder.release()
+
+    assert result == 0
+    assert pipeline.encoder.process.exitcode == 0
+    assert not os.path.exists(path)
+    assert pipeline.encoded > 0
+    assert decoded_frames(filename) == pipeline.encoded
+
+
+def test_killed_encoder_is_noticed_and_shared_memory_freed(tmp_path):
+    pipeline = ProcessFramePipeline(OpenCVVideoEncoder, str(tmp_path / 'killed.mp4'), 20, SIZE)
+    path = shm_path(pipeline)
+    source = SyntheticFrameSource((0, 0) + SIZE)
+    run_frames(pipeline, source, 10)
+    os.kill(pipeline.encoder.process.pid, signal.SIGKILL)
+    assert wait_for(lambda: pipeline.ring.failed)
+    try:
+        run_frames(pipeline, source, pipeline.ring.capacity + 1)
+    except OSError:
+        pass  # Raised by acquire() once the free slots are gone
+    else:
+        raise AssertionError("capturing went on after the encoder process died")
+    pipeline.close()
+    result = pipeline.encoder.release()
+
+    assert result != 0
+    assert pipeline.encoder.process.exitcode == -signal.SIGKILL
+    assert not os.path.exists(path)
+
+
+def test_repeats_pending_at_close_are_written(tmp_path):
+    filename = str(tmp_path / 'carry.mp4')
+    pipeline = ProcessFramePipeline(OpenCVVideoEncoder, filename, 20, SIZE)
+    run_frames(pipeline, SyntheticFrameSource((0, 0) + SIZE), 10)
+    # Frames dropped after the last commit still have to last their time
+    pipeline.discard(3)
+    pipeline.close()
+    assert pipeline.encoder.release() == 0
+    assert pipeline.encoded == 13
+    assert decoded_frames(filename) == 13
+
+
+class HangingEncoder(OpenCVVideoEncoder):
+    def release(self):
+        super().release()
+        time.sleep(60)
+
+
+def test_release_terminates_an_encoder_that_does_not_finish(tmp_path):
+    pipeline = ProcessFramePipeline(HangingEncoder, str(tmp_path / 'hang.mp4'), 20, SIZE)
+    path = shm_path(pipeline)
+    run_frames(pipeline, SyntheticFrameSource((0, 0) + SIZE), 5)
+    pipeline.close()
+    start = time.monotonic()
+    result = pipeline.encoder.release(timeout=1.0)
+
+    assert time.monotonic() - start < 10
+    assert result != 0
+    assert pipeline.encoder.process.exitcode == -signal.SIGTERM
+    assert not os.path.exists(path)
+
+
+def test_capture_side_is_initialised_like_frame_pipeline(tmp_path):
+    pipeline = ProcessFramePipeline(OpenCVVideoEncoder, str(tmp_path / 'init.mp4'), 20, SIZE,
+                                    capture_shape=(480, 640, 3))
+    try:
+        pipeline.set_step(2)
+        run_frames(pipeline, SyntheticFrameSource((0, 0, 640, 480)), 3)
+        assert (pipeline.step, pipeline.captured, pipeline.skipped) == (2, 3, 0)
+        snapshot = pipeline.metrics.snapshot()
+        assert snapshot['frames_captured_total'] == 3
+        assert 'frame_latency_seconds' in snapshot
+    finally:
+        pipeline.close()
+        pipeline.encoder.release()
+
+
+PARENT = textwrap.dedent('''
+    import sys
+    import time
+    sys.path.insert(0, {src!r})
+    from frame_sources import SyntheticFrameSource
+    from shm_transport import ProcessFramePipeline
+    from video_encoders import OpenCVVideoEncoder
+
+    if __name__ == '__main__':
+        pipeline = ProcessFramePipeline(OpenCVVideoEncoder, {filename!r}, 20, {size!r})
+        source = SyntheticFrameSource((0, 0) + {size!r})
+        reported = False
+        while True:
+            # Paced like a recording: an unpaced loop would pile its drops up as repeats
+            time.sleep(0.05)
+            index = pipeline.acquire()
+            if index is None:
+                pipeline.discard()
+                continue
+            pipeline.capture(index, source)
+            pipeline.commit(index)
+            if not reported and pipeline.encoded >= 20:
+                print(pipeline.encoder.process.pid, pipeline.ring.memory.name, flush=True)
+                reported = True
+''')
+
+
+def process_gone(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] == 'Z'
+    except FileNotFoundError:
+        return True
+
+
+def test_encoder_finishes_the_file_when_the_recording_process_is_killed(tmp_path):
+    filename = str(tmp_path / 'orphan.mp4')
+    script = tmp_path / 'parent.py'
+    script.write_text(PARENT.format(src=SRC, filename=filename, size=SIZE))
+    parent = subprocess.Popen([sys.executable, str(script)], stdout=subprocess.PIPE, text=True)
+    try:
+        line = parent.stdout.readline()
+        assert line, "the recording process exited before encoding"
+        encoder_pid, memory_name = line.split()
+        parent.send_signal(signal.SIGKILL)
+        parent.wait()
+    finally:
+        if parent.poll() is None:
+            parent.kill()
+            parent.wait()
+
+    assert wait_for(lambda: process_gone(int(encoder_pid)))
+    assert decoded_frames(filename) >= 20
+    # The resource tracker unlinks the block once both processes are gone
+    assert wait_for(lambda: not os.path.exists(os.path.join('/dev/shm', memory_name.lstrip('/'))))
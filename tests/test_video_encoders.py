@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+
+import video_encoders
+from video_encoders import SegmentedEncoder, segment_directory
+
+
+class FileEncoder:
+    """Inner encoder that writes one line per frame, enough to tell segments apart."""
+
+    def __init__(self, filename, fps, size, **options):
+        self.file = open(filename, 'w')
+        self.options = options
+
+    def write(self, frame):
+        self.file.write(f"{int(frame[0, 0, 0])}\n")
+
+    def release(self):
+        self.file.close()
+
+
+def frame(value, size=(16, 8)):
+    return np.full((size[1], size[0], 3), value, dtype=np.uint8)
+
+
+def read_segment(filename):
+    with open(filename) as f:
+        return [int(line) for line in f]
+
+
+def replay_encoder(tmp_path, max_segments=3):
+    # Two frames per segment
+    return SegmentedEncoder(str(tmp_path / 'replay.mp4'), 2, (16, 8), segment_seconds=1.0,
+                            max_segments=max_segments, encoder_factory=FileEncoder)
+
+
+def test_replay_keeps_only_the_newest_segments(tmp_path):
+    encoder = replay_encoder(tmp_path)
+    for value in range(11):
+        encoder.write(frame(value))
+    # Five segments finished, the sixth is still open
+    assert len(encoder.segments) == 3
+    assert [read_segment(name) for name in encoder.segments] == [[4, 5], [6, 7], [8, 9]]
+    on_disk = sorted(os.listdir(segment_directory(encoder.filename)))
+    assert on_disk == ['segment_00002.mp4', 'segment_00003.mp4', 'segment_00004.mp4', 'segment_00005.mp4']
+
+
+def test_save_replay_joins_the_finished_window(tmp_path, monkeypatch):
+    joined = []
+    monkeypatch.setattr(video_encoders, 'concat_segments', lambda segments, output: joined.append(segments) or 0)
+    encoder = replay_encoder(tmp_path)
+    assert encoder.save_replay(str(tmp_path / 'empty.mp4')) is None
+    for value in range(9):
+        encoder.write(frame(value))
+    assert encoder.save_replay(str(tmp_path / 'saved.mp4')) == 0
+    assert [read_segment(name) for name in joined[0]] == [[2, 3], [4, 5], [6, 7]]
+
+
+def test_release_discards_a_replay_buffer(tmp_path, monkeypatch):
+    monkeypatch.setattr(video_encoders, 'concat_segments', lambda segments, output: 1 / 0)
+    encoder = replay_encoder(tmp_path)
+    for value in range(7):
+        encoder.write(frame(value))
+    assert encoder.release() == 0
+    assert not os.path.exists(segment_directory(encoder.filename))
+    assert not os.path.exists(encoder.filename)
+
+
+def test_size_change_and_reconfigure_start_a_new_segment(tmp_path):
+    encoder = replay_encoder(tmp_path, max_segments=None)
+    encoder.write(frame(1))
+    encoder.write(frame(2, size=(8, 4)))
+    encoder.reconfigure(preset='fast')
+    encoder.write(frame(3, size=(8, 4)))
+    assert [read_segment(name) for name in encoder.segments] == [[1], [2]]
+    assert encoder._current.options == {'preset': 'fast', 'output_size': (16, 8)}